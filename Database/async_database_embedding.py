@@ -0,0 +1,264 @@
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple, Union
+import numpy as np
+from datetime import datetime
+from pool_metrics import PoolMetricsListener
+from embedding_codec import encode_embedding
+from database_embedding import (
+    POOL_MAX_SIZE,
+    DUPLICATE_KEY_ERROR,
+    SYNC_FIELD,
+    TEMPLATE_PROJECTION,
+    TOMBSTONE_TTL_SECONDS,
+    _notify_change,
+    doc_templates,
+    pool_client_options,
+    template_filter,
+    template_insert,
+    template_remove,
+    template_update,
+    tombstone_update,
+)
+
+DEFAULT_PROJECTION = TEMPLATE_PROJECTION
+
+
+class AsyncFaceEmbeddingsDB:
+    """
+    Motor-based counterpart of FaceEmbeddingsDB with the same save/get/list/delete
+    surface, plus bulk reads for loading large galleries without blocking the
+    event loop. Writes fire the same change notifications as the sync store.
+    """
+
+    def __init__(
+        self,
+        mongo_uri: str = "mongodb://localhost:27017",
+        db_name: str = "face_recognition_db",
+        collection_name: str = "face_embeddings",
+        client: Optional[AsyncIOMotorClient] = None,
+        pool_metrics: Optional[PoolMetricsListener] = None,
+    ):
+        self._owns_client = client is None
+        self.client = client if client is not None else AsyncIOMotorClient(mongo_uri)
+        self.pool_metrics = pool_metrics
+        self.db = self.client[db_name]
+        self.collection = self.db[collection_name]
+        self.tombstones = self.db[f"{collection_name}_tombstones"]
+
+    @classmethod
+    def pooled(
+        cls,
+        mongo_uri: str = "mongodb://localhost:27017",
+        db_name: str = "face_recognition_db",
+        collection_name: str = "face_embeddings",
+    ) -> "AsyncFaceEmbeddingsDB":
+        """Create a long-lived store backed by a tuned, instrumented connection pool."""
+        metrics = PoolMetricsListener()
+        client = AsyncIOMotorClient(mongo_uri, **pool_client_options(metrics))
+        db = cls(db_name=db_name, collection_name=collection_name, client=client, pool_metrics=metrics)
+        db._owns_client = True
+        return db
+
+    def pool_stats(self) -> Dict:
+        """Connection pool usage, if this store was created with pool metrics."""
+        if self.pool_metrics is None:
+            return {}
+        stats = self.pool_metrics.snapshot()
+        stats["max_pool_size"] = POOL_MAX_SIZE
+        return stats
+
+    @property
+    def namespace(self) -> str:
+        """Fully qualified collection name, used to scope change notifications."""
+        return f"{self.db.name}.{self.collection.name}"
+
+    async def save_embedding(
+        self,
+        person_id: str,
+        new_embedding: Union[List[float], np.ndarray],
+        image_path: Optional[str] = None,
+        timestamp: Optional[datetime] = None
+    ):
+        """
+        Add an embedding to the person's template set, creating the person if needed.
+        Only the newest MAX_TEMPLATES embeddings are kept. Also, save the list of image paths.
+        Returns the updated document (person_id and templates).
+        """
+        if timestamp is None:
+            timestamp = datetime.utcnow()
+
+        try:
+            doc = await self._save_template(person_id, new_embedding, image_path, timestamp)
+        except DuplicateKeyError:
+            # A concurrent first save of this person won the insert; the retry updates its document
+            doc = await self._save_template(person_id, new_embedding, image_path, timestamp)
+
+        _notify_change(self.namespace, person_id, doc_templates(doc))
+        return doc
+
+    async def _save_template(self, person_id: str, new_embedding, image_path: Optional[str], timestamp: datetime) -> Dict:
+        doc = await self.collection.find_one_and_update(
+            template_filter(person_id, image_path),
+            template_update(new_embedding, image_path, timestamp),
+            projection=TEMPLATE_PROJECTION,
+            upsert=not image_path,
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc is None:
+            # A new person, or an image whose template is stored already
+            doc = await self.collection.find_one_and_update(
+                {"person_id": person_id},
+                template_insert(new_embedding, image_path, timestamp),
+                projection=TEMPLATE_PROJECTION,
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        return doc
+
+    async def save_many(
+        self,
+        entries: List[Tuple[str, Union[List[float], np.ndarray], Optional[str]]],
+        timestamp: Optional[datetime] = None,
+    ):
+        """
+        Bulk save_embedding() for (person_id, embedding, image_path) entries.
+
+        All template appends go out in a single unordered bulk write, paired
+        with a template_insert() upsert for entries with an image (the two
+        commute); the resulting template sets are then read back with one
+        $in query for the change notifications.
+        """
+        if not entries:
+            return None
+        if timestamp is None:
+            timestamp = datetime.utcnow()
+
+        operations, owners = self._save_operations(entries, timestamp)
+        try:
+            result = await self.collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if not errors or any(error.get("code") != DUPLICATE_KEY_ERROR for error in errors):
+                raise
+            # Concurrent first saves won some inserts; redo those entries against their documents
+            retry = [entries[i] for i in sorted({owners[error["index"]] for error in errors})]
+            result = await self.collection.bulk_write(self._save_operations(retry, timestamp)[0], ordered=False)
+
+        stored = await self.get_many({person_id for person_id, _, _ in entries})
+        for person_id, doc in stored.items():
+            _notify_change(self.namespace, person_id, doc_templates(doc))
+        return result
+
+    async def remove_template(
+        self,
+        person_id: str,
+        new_embedding: Union[List[float], np.ndarray],
+        image_path: Optional[str] = None,
+    ) -> bool:
+        """
+        Take back a template added by save_embedding()/save_many(), matched by its
+        exact encoding. Returns False if the person does not hold that template.
+        """
+        doc = await self.collection.find_one_and_update(
+            {"person_id": person_id, "templates": encode_embedding(new_embedding)},
+            template_remove(new_embedding, image_path),
+            projection=TEMPLATE_PROJECTION,
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc is None:
+            return False
+        _notify_change(self.namespace, person_id, doc_templates(doc))
+        return True
+
+    @staticmethod
+    def _save_operations(entries, timestamp: datetime) -> Tuple[List[UpdateOne], List[int]]:
+        """save_many() writes, and the index of the entry each one belongs to."""
+        operations, owners = [], []
+        for i, (person_id, new_embedding, image_path) in enumerate(entries):
+            operations.append(UpdateOne(
+                template_filter(person_id, image_path),
+                template_update(new_embedding, image_path, timestamp),
+                upsert=not image_path,
+            ))
+            owners.append(i)
+            if image_path:
+                operations.append(UpdateOne(
+                    {"person_id": person_id}, template_insert(new_embedding, image_path, timestamp), upsert=True
+                ))
+                owners.append(i)
+        return operations, owners
+
+    async def get_embedding(self, person_id: str) -> Optional[Dict]:
+        """Retrieve the embedding document for a given person_id."""
+        return await self.collection.find_one({"person_id": person_id})
+
+    async def get_many(self, person_ids: Iterable[str], projection: Optional[Dict] = None) -> Dict[str, Dict]:
+        """Fetch the documents for several person_ids in one query, keyed by person_id."""
+        person_ids = list(person_ids)
+        if not person_ids:
+            return {}
+        projection = dict(projection or DEFAULT_PROJECTION)
+        projection["person_id"] = 1
+        cursor = self.collection.find({"person_id": {"$in": person_ids}}, projection)
+        return {doc["person_id"]: doc async for doc in cursor}
+
+    async def iter_all(
+        self,
+        batch_size: int = 1000,
+        projection: Optional[Dict] = None,
+        query: Optional[Dict] = None,
+    ) -> AsyncIterator[Dict]:
+        """Stream every matching document through a server-side cursor, batch_size at a time."""
+        cursor = self.collection.find(query or {}, projection or DEFAULT_PROJECTION, batch_size=batch_size)
+        async for doc in cursor:
+            yield doc
+
+    async def list_person_ids(self) -> List[str]:
+        """Return a list of all person_ids in the collection."""
+        return await self.collection.distinct("person_id")
+
+    async def delete_embedding(self, person_id: str) -> int:
+        """Delete the embedding document for a given person_id. Returns number of deleted documents."""
+        result = await self.collection.delete_one({"person_id": person_id})
+        if result.deleted_count:
+            await self.tombstones.update_one({"person_id": person_id}, tombstone_update(), upsert=True)
+            _notify_change(self.namespace, person_id, None)
+        return result.deleted_count
+
+    async def ensure_indexes(self):
+        """Unique person_id, so concurrent first saves of a person can't create two documents."""
+        try:
+            await self.collection.create_index("person_id", unique=True)
+        except OperationFailure as e:
+            print(f"⚠️ Could not create the unique person_id index (duplicate person documents?): {e}")
+
+    async def ensure_sync_indexes(self):
+        """Indexes used by gallery sync: the write stamp on both collections and the tombstone TTL."""
+        await self.collection.create_index(SYNC_FIELD)
+        await self.tombstones.create_index("person_id", unique=True)
+        await self.tombstones.create_index(SYNC_FIELD)
+        await self.tombstones.create_index("deleted_at", expireAfterSeconds=TOMBSTONE_TTL_SECONDS)
+
+    async def latest_sync_stamp(self):
+        """Newest write stamp across documents and tombstones, or None for an unstamped store."""
+        stamps = []
+        for collection in (self.collection, self.tombstones):
+            doc = await collection.find_one({SYNC_FIELD: {"$exists": True}}, {SYNC_FIELD: 1}, sort=[(SYNC_FIELD, -1)])
+            if doc:
+                stamps.append(doc[SYNC_FIELD])
+        return max(stamps) if stamps else None
+
+    async def changes_since(self, stamp, projection: Optional[Dict] = None) -> Tuple[List[Dict], List[Dict]]:
+        """Documents and tombstones whose write stamp is after `stamp` (everything stamped when None)."""
+        query = {SYNC_FIELD: {"$gt": stamp}} if stamp is not None else {SYNC_FIELD: {"$exists": True}}
+        projection = dict(projection or DEFAULT_PROJECTION)
+        projection[SYNC_FIELD] = 1
+        docs = await self.collection.find(query, projection).to_list(None)
+        tombstones = await self.tombstones.find(query, {"_id": 0, "person_id": 1, SYNC_FIELD: 1}).to_list(None)
+        return docs, tombstones
+
+    def close(self):
+        if self._owns_client:
+            self.client.close()
@@ -3,6 +3,7 @@ from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
 from beanie import init_beanie, PydanticObjectId as ObjectId
 from pymongo.errors import ServerSelectionTimeoutError
 from models.student_model import Student
+from embedding_codec import encode_embedding
 
 MONGO_URI = "mongodb://localhost:27017"
 DB_NAME = "mydatabase"
@@ -53,7 +54,7 @@ async def save_embedding(embedding_collection, matriculation_number: str, embedd
     """Save the face embedding vector with reference to matriculation number."""
     doc = {
         "matriculation_number": matriculation_number,
-        "embedding": embedding_vector.tolist()  # convert numpy array to list for BSON compatibility
+        "embedding": encode_embedding(embedding_vector)  # compact versioned float32 binary
     }
     result = await embedding_collection.insert_one(doc)
     return result.inserted_id
@@ -1,65 +1,261 @@
-from pymongo import MongoClient
-from typing import List, Optional, Dict
+import os
+from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from typing import Callable, Iterator, List, Optional, Dict, Tuple, Union
 import numpy as np
 from datetime import datetime
+from pool_metrics import PoolMetricsListener
+from embedding_codec import decode_embedding, encode_embedding
+
+# Connection pool tuning for the shared embedding store
+POOL_MAX_SIZE = int(os.getenv("EMBEDDINGS_POOL_MAX_SIZE", "50"))
+POOL_MIN_SIZE = int(os.getenv("EMBEDDINGS_POOL_MIN_SIZE", "5"))
+POOL_MAX_IDLE_MS = int(os.getenv("EMBEDDINGS_POOL_MAX_IDLE_MS", "300000"))
+POOL_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("EMBEDDINGS_POOL_WAIT_QUEUE_TIMEOUT_MS", "2000"))
+SERVER_SELECTION_TIMEOUT_MS = 5000
+# Embeddings kept per person; older enrollment images are dropped beyond this
+MAX_TEMPLATES = int(os.getenv("FACE_MAX_TEMPLATES", "5"))
+# MongoDB's error code for a unique index violation
+DUPLICATE_KEY_ERROR = 11000
+TEMPLATE_PROJECTION = {"_id": 0, "person_id": 1, "embedding": 1, "templates": 1}
+# Deleted person_ids are recorded in "<collection>_tombstones" so that polling
+# workers see deletes; a TTL index drops them after this long
+TOMBSTONE_TTL_SECONDS = int(os.getenv("FACE_TOMBSTONE_TTL_SECONDS", "86400"))
+# Every write stamps documents and tombstones with a server-side BSON timestamp
+# in this field, which gallery sync polls on
+SYNC_FIELD = "sync_ts"
+
+# Callbacks notified after every write, as (namespace, person_id, templates).
+# templates is the person's (T, D) template set, or None when the person was deleted.
+_change_listeners: List[Callable[[str, str, Optional[np.ndarray]], None]] = []
+
+
+def add_change_listener(listener: Callable[[str, str, Optional[np.ndarray]], None]):
+    """Register a callback that is invoked whenever an embedding is saved or deleted."""
+    if listener not in _change_listeners:
+        _change_listeners.append(listener)
+
+
+def remove_change_listener(listener: Callable[[str, str, Optional[np.ndarray]], None]):
+    if listener in _change_listeners:
+        _change_listeners.remove(listener)
+
+
+def _notify_change(namespace: str, person_id: str, embedding: Optional[np.ndarray]):
+    for listener in list(_change_listeners):
+        try:
+            listener(namespace, person_id, embedding)
+        except Exception as e:
+            print(f"Embedding change listener failed: {e}")
+
+
+def pool_client_options(metrics: PoolMetricsListener) -> Dict:
+    """Connection pool settings shared by the sync (pymongo) and async (motor) stores."""
+    return {
+        "maxPoolSize": POOL_MAX_SIZE,
+        "minPoolSize": POOL_MIN_SIZE,
+        "maxIdleTimeMS": POOL_MAX_IDLE_MS,
+        "waitQueueTimeoutMS": POOL_WAIT_QUEUE_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": SERVER_SELECTION_TIMEOUT_MS,
+        "event_listeners": [metrics],
+    }
+
+
+def create_pooled_client(mongo_uri: str = "mongodb://localhost:27017"):
+    """
+    Build a MongoClient with a tuned connection pool and pool metrics attached.
+
+    Returns:
+        (MongoClient, PoolMetricsListener)
+    """
+    metrics = PoolMetricsListener()
+    client = MongoClient(mongo_uri, **pool_client_options(metrics))
+    return client, metrics
+
+
+def doc_templates(doc: Dict, max_templates: int = MAX_TEMPLATES) -> np.ndarray:
+    """
+    Decode the template set of a face_embeddings document as a (T, D) float32 array, oldest first.
+
+    A legacy single `embedding` (the old running average) counts as the oldest
+    template, so it ages out once the person has `max_templates` newer ones.
+    """
+    stored = ([doc["embedding"]] if "embedding" in doc else []) + list(doc.get("templates", []))
+    vectors = [decode_embedding(value) for value in stored[-max_templates:]]
+    if not vectors:
+        return np.empty((0, 0), dtype=np.float32)
+    dim = vectors[-1].shape[0]
+    return np.stack([vec for vec in vectors if vec.shape[0] == dim])
+
+
+def template_filter(person_id: str, image_path: Optional[str]) -> Dict:
+    """
+    Query for template_update(): the person, unless `image_path` is already
+    among their images, in which case its template is stored already.
+
+    Without an image it is applied with upsert, which also creates a new
+    person. With one, template_insert() is applied alongside (or after a
+    miss) to create the person.
+    """
+    query = {"person_id": person_id}
+    if image_path:
+        query["images"] = {"$ne": image_path}
+    return query
+
+
+def template_update(
+    new_embedding: Union[List[float], np.ndarray],
+    image_path: Optional[str],
+    timestamp: datetime,
+    max_templates: int = MAX_TEMPLATES,
+) -> Dict:
+    """Update document that appends a template and keeps only the newest `max_templates`."""
+    update = {
+        "$push": {"templates": {"$each": [encode_embedding(new_embedding)], "$slice": -max_templates}},
+        "$set": {"timestamp": timestamp},
+        "$currentDate": {SYNC_FIELD: {"$type": "timestamp"}},
+    }
+    if image_path:
+        update["$addToSet"] = {"images": image_path}
+    else:
+        update["$setOnInsert"] = {"images": []}
+    return update
+
+
+def template_insert(
+    new_embedding: Union[List[float], np.ndarray],
+    image_path: Optional[str],
+    timestamp: datetime,
+) -> Dict:
+    """
+    Upsert update creating a person with a single template. An existing
+    person is left as is, so it can run in either order with template_update().
+    """
+    return {
+        "$setOnInsert": {
+            "templates": [encode_embedding(new_embedding)],
+            "images": [image_path] if image_path else [],
+            "timestamp": timestamp,
+        },
+        "$currentDate": {SYNC_FIELD: {"$type": "timestamp"}},
+    }
+
+
+def template_remove(new_embedding: Union[List[float], np.ndarray], image_path: Optional[str]) -> Dict:
+    """Update document undoing template_update(): pulls that exact template and its image."""
+    update = {
+        "$pull": {"templates": encode_embedding(new_embedding)},
+        "$currentDate": {SYNC_FIELD: {"$type": "timestamp"}},
+    }
+    if image_path:
+        update["$pull"]["images"] = image_path
+    return update
+
+
+def tombstone_update() -> Dict:
+    """Upsert update recording that a person was deleted, stamped like template writes."""
+    return {"$currentDate": {SYNC_FIELD: {"$type": "timestamp"}, "deleted_at": True}}
+
 
 class FaceEmbeddingsDB:
     def __init__(
         self, 
         mongo_uri: str = "mongodb://localhost:27017", 
         db_name: str = "face_recognition_db", 
-        collection_name: str = "face_embeddings"
+        collection_name: str = "face_embeddings",
+        client: Optional[MongoClient] = None,
+        pool_metrics: Optional[PoolMetricsListener] = None,
     ):
-        self.client = MongoClient(mongo_uri)
+        """
+        Pass an existing `client` to share its connection pool; the store then
+        leaves closing the client to its owner.
+        """
+        self._owns_client = client is None
+        self.client = client if client is not None else MongoClient(mongo_uri)
+        self.pool_metrics = pool_metrics
         self.db = self.client[db_name]
         self.collection = self.db[collection_name]
+        self.tombstones = self.db[f"{collection_name}_tombstones"]
+        self._indexed = False
+
+    @classmethod
+    def pooled(
+        cls,
+        mongo_uri: str = "mongodb://localhost:27017",
+        db_name: str = "face_recognition_db",
+        collection_name: str = "face_embeddings",
+    ) -> "FaceEmbeddingsDB":
+        """Create a long-lived store backed by a tuned, instrumented connection pool."""
+        client, metrics = create_pooled_client(mongo_uri)
+        db = cls(db_name=db_name, collection_name=collection_name, client=client, pool_metrics=metrics)
+        db._owns_client = True
+        return db
+
+    def pool_stats(self) -> Dict:
+        """Connection pool usage, if this store was created with pool metrics."""
+        if self.pool_metrics is None:
+            return {}
+        stats = self.pool_metrics.snapshot()
+        stats["max_pool_size"] = POOL_MAX_SIZE
+        return stats
+
+    @property
+    def namespace(self) -> str:
+        """Fully qualified collection name, used to scope change notifications."""
+        return self.collection.full_name
 
     def save_embedding(
         self, 
         person_id: str, 
-        new_embedding: List[float], 
+        new_embedding: Union[List[float], np.ndarray], 
         image_path: Optional[str] = None, 
         timestamp: Optional[datetime] = None
     ):
         """
-        Save or update the embedding for a person.
-        If an embedding for the person exists, average the embeddings.
-        Also, save the list of image paths.
+        Add an embedding to the person's template set, creating the person if needed.
+        Only the newest MAX_TEMPLATES embeddings are kept. Also, save the list of image paths.
+        Returns the updated document (person_id and templates).
         """
         if timestamp is None:
             timestamp = datetime.utcnow()
+        if not self._indexed:
+            self.ensure_indexes()
+
+        try:
+            doc = self._save_template(person_id, new_embedding, image_path, timestamp)
+        except DuplicateKeyError:
+            # A concurrent first save of this person won the insert; the retry updates its document
+            doc = self._save_template(person_id, new_embedding, image_path, timestamp)
 
-        existing_doc = self.collection.find_one({"person_id": person_id})
-
-        if existing_doc:
-            # Average the embeddings
-            existing_embedding = np.array(existing_doc["embedding"])
-            new_embedding_np = np.array(new_embedding)
-            avg_embedding = ((existing_embedding * len(existing_doc.get("images", []))) + new_embedding_np) / (len(existing_doc.get("images", [])) + 1)
-            avg_embedding_list = avg_embedding.tolist()
-
-            # Append new image path if provided
-            images = existing_doc.get("images", [])
-            if image_path and image_path not in images:
-                images.append(image_path)
-
-            update_doc = {
-                "embedding": avg_embedding_list,
-                "images": images,
-                "timestamp": timestamp,
-            }
-            result = self.collection.update_one({"person_id": person_id}, {"$set": update_doc})
-        else:
-            # Insert new document
-            doc = {
-                "person_id": person_id,
-                "embedding": new_embedding,
-                "images": [image_path] if image_path else [],
-                "timestamp": timestamp,
-            }
-            result = self.collection.insert_one(doc)
-
-        return result
+        _notify_change(self.namespace, person_id, doc_templates(doc))
+        return doc
+
+    def _save_template(self, person_id: str, new_embedding, image_path: Optional[str], timestamp: datetime) -> Dict:
+        doc = self.collection.find_one_and_update(
+            template_filter(person_id, image_path),
+            template_update(new_embedding, image_path, timestamp),
+            projection=TEMPLATE_PROJECTION,
+            upsert=not image_path,
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc is None:
+            # A new person, or an image whose template is stored already
+            doc = self.collection.find_one_and_update(
+                {"person_id": person_id},
+                template_insert(new_embedding, image_path, timestamp),
+                projection=TEMPLATE_PROJECTION,
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        return doc
+
+    def ensure_indexes(self):
+        """Unique person_id, so concurrent first saves of a person can't create two documents."""
+        try:
+            self.collection.create_index("person_id", unique=True)
+        except OperationFailure as e:
+            print(f"⚠️ Could not create the unique person_id index (duplicate person documents?): {e}")
+        self._indexed = True
 
     def get_embedding(self, person_id: str) -> Optional[Dict]:
         """Retrieve the embedding document for a given person_id."""
@@ -69,13 +265,34 @@ class FaceEmbeddingsDB:
         """Return a list of all person_ids in the collection."""
         return self.collection.distinct("person_id")
 
+    def iter_templates(self, batch_size: int = 1000) -> Iterator[Tuple[str, np.ndarray]]:
+        """Stream (person_id, (T, D) templates) pairs for the whole collection in a single query."""
+        cursor = self.collection.find({}, TEMPLATE_PROJECTION, batch_size=batch_size)
+        for doc in cursor:
+            templates = doc_templates(doc)
+            if len(templates):
+                yield doc["person_id"], templates
+
+    def latest_sync_stamp(self):
+        """Newest write stamp across documents and tombstones, or None for an unstamped store."""
+        stamps = []
+        for collection in (self.collection, self.tombstones):
+            doc = collection.find_one({SYNC_FIELD: {"$exists": True}}, {SYNC_FIELD: 1}, sort=[(SYNC_FIELD, -1)])
+            if doc:
+                stamps.append(doc[SYNC_FIELD])
+        return max(stamps) if stamps else None
+
     def delete_embedding(self, person_id: str) -> int:
         """Delete the embedding document for a given person_id. Returns number of deleted documents."""
         result = self.collection.delete_one({"person_id": person_id})
+        if result.deleted_count:
+            self.tombstones.update_one({"person_id": person_id}, tombstone_update(), upsert=True)
+            _notify_change(self.namespace, person_id, None)
         return result.deleted_count
 
     def close(self):
-        self.client.close()
+        if self._owns_client:
+            self.client.close()
 
 
 # Example usage (can be removed or commented out in production)
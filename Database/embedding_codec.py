@@ -0,0 +1,47 @@
+import os
+from typing import Any, Dict
+import numpy as np
+from bson.binary import Binary, USER_DEFINED_SUBTYPE
+
+# Version of the binary embedding layout written by encode_embedding()
+EMBEDDING_FORMAT_VERSION = 1
+# Storage precision for new writes: "float32" (default) or "float16"
+STORAGE_DTYPE = os.getenv("EMBEDDINGS_STORAGE_DTYPE", "float32")
+
+_DTYPES = {
+    "float32": np.dtype("<f4"),
+    "float16": np.dtype("<f2"),
+}
+
+
+def encode_embedding(embedding, dtype: str = STORAGE_DTYPE) -> Dict[str, Any]:
+    """
+    Encode an embedding vector as a compact, versioned BSON sub-document:
+
+        {"v": 1, "dtype": "float32", "dim": 512, "data": Binary(<little-endian bytes>)}
+    """
+    if dtype not in _DTYPES:
+        raise ValueError(f"Unsupported embedding storage dtype: {dtype}")
+    vec = np.asarray(embedding, dtype=_DTYPES[dtype]).reshape(-1)
+    return {
+        "v": EMBEDDING_FORMAT_VERSION,
+        "dtype": dtype,
+        "dim": int(vec.shape[0]),
+        "data": Binary(vec.tobytes(), USER_DEFINED_SUBTYPE),
+    }
+
+
+def decode_embedding(value) -> np.ndarray:
+    """
+    Decode a stored embedding into a float32 vector.
+
+    Accepts both the binary format written by encode_embedding() and the legacy
+    format (a plain BSON array of floats).
+    """
+    if isinstance(value, dict):
+        version = value.get("v")
+        if version != EMBEDDING_FORMAT_VERSION:
+            raise ValueError(f"Unknown embedding format version: {version}")
+        vec = np.frombuffer(value["data"], dtype=_DTYPES[value["dtype"]])
+        return vec.astype(np.float32)
+    return np.asarray(value, dtype=np.float32)
@@ -0,0 +1,109 @@
+"""
+Online migration of stored face embeddings to the compact binary format.
+
+Folds the legacy single `embedding` (a BSON array or binary value) into the
+`templates` set as its oldest entry, and re-encodes every template stored in
+a different storage dtype, in batches. Each update is conditional on the
+document still holding the values that were read, so documents rewritten
+concurrently by the running app are left alone and picked up again on a
+later run. Converted documents get a new write stamp so gallery sync
+reloads them.
+
+Usage:
+    python migrate_embeddings.py [--dtype float32|float16] [--batch-size 500] [--dry-run]
+"""
+import argparse
+import time
+from pymongo import MongoClient, UpdateOne
+from database_embedding import MAX_TEMPLATES, SYNC_FIELD
+from embedding_codec import decode_embedding, encode_embedding
+
+
+def pending_filter(dtype: str):
+    """Documents that are not yet stored as binary templates in the target dtype."""
+    return {
+        "$or": [
+            {"embedding": {"$exists": True}},
+            {"templates": {"$elemMatch": {"dtype": {"$ne": dtype}}}},
+        ]
+    }
+
+
+def migrated_update(doc, dtype: str, max_templates: int = MAX_TEMPLATES):
+    """(guard, update) rewriting `doc` as templates only, all in `dtype`."""
+    stored = ([doc["embedding"]] if "embedding" in doc else []) + list(doc.get("templates", []))
+    templates = [encode_embedding(decode_embedding(value), dtype=dtype) for value in stored[-max_templates:]]
+    # Only replace the values we actually read
+    guard = {"_id": doc["_id"]}
+    for field in ("embedding", "templates"):
+        guard[field] = doc[field] if field in doc else {"$exists": False}
+    update = {
+        "$set": {"templates": templates},
+        "$unset": {"embedding": ""},
+        "$currentDate": {SYNC_FIELD: {"$type": "timestamp"}},
+    }
+    return guard, update
+
+
+def migrate(collection, dtype: str = "float32", batch_size: int = 500, dry_run: bool = False, pause: float = 0.0):
+    """
+    Convert embeddings in `collection` to the binary format in batches.
+
+    Returns:
+        dict with counts of scanned, converted and skipped (changed concurrently) documents.
+    """
+    scanned = converted = skipped = 0
+    last_id = None
+
+    while True:
+        query = pending_filter(dtype)
+        if last_id is not None:
+            query = {"$and": [query, {"_id": {"$gt": last_id}}]}
+        batch = list(
+            collection.find(query, {"_id": 1, "embedding": 1, "templates": 1}).sort("_id", 1).limit(batch_size)
+        )
+        if not batch:
+            break
+        last_id = batch[-1]["_id"]
+        scanned += len(batch)
+
+        operations = [UpdateOne(*migrated_update(doc, dtype)) for doc in batch]
+
+        if dry_run:
+            converted += len(operations)
+        else:
+            result = collection.bulk_write(operations, ordered=False)
+            converted += result.modified_count
+            skipped += len(operations) - result.modified_count
+
+        print(f"🔁 Scanned {scanned} documents, converted {converted}, skipped {skipped}")
+        if pause:
+            time.sleep(pause)
+
+    return {"scanned": scanned, "converted": converted, "skipped": skipped}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert stored face embeddings to binary float32/float16.")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db-name", default="face_recognition_db")
+    parser.add_argument("--collection", default="face_embeddings")
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    client = MongoClient(args.mongo_uri)
+    try:
+        collection = client[args.db_name][args.collection]
+        remaining = collection.count_documents(pending_filter(args.dtype))
+        print(f"🚀 {remaining} embeddings to migrate to binary {args.dtype}")
+        stats = migrate(collection, args.dtype, args.batch_size, args.dry_run, args.pause)
+        print(f"✅ Migration finished: {stats}")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
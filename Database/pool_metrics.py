@@ -0,0 +1,88 @@
+import threading
+from typing import Dict
+from pymongo import monitoring
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """
+    Collects connection pool usage for a MongoClient.
+
+    Pass an instance in the client's `event_listeners` and read `snapshot()`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open_connections = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.connections_created = 0
+        self.connections_closed = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.pool_clears = 0
+        self._checkout_wait_total = 0.0
+        self._checkout_wait_max = 0.0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open_connections += 1
+            self.connections_created += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open_connections -= 1
+            self.connections_closed += 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        # `duration` (seconds spent waiting for the connection) is reported by pymongo >= 4.7
+        wait = getattr(event, "duration", None) or 0.0
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            self._checkout_wait_total += wait
+            self._checkout_wait_max = max(self._checkout_wait_max, wait)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use -= 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "open_connections": self.open_connections,
+                "in_use": self.in_use,
+                "peak_in_use": self.peak_in_use,
+                "connections_created": self.connections_created,
+                "connections_closed": self.connections_closed,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "pool_clears": self.pool_clears,
+                "mean_checkout_wait_ms": (
+                    self._checkout_wait_total * 1000.0 / self.checkouts if self.checkouts else 0.0
+                ),
+                "max_checkout_wait_ms": self._checkout_wait_max * 1000.0,
+            }
@@ -0,0 +1,9 @@
+"""
+Performance benchmarks for the recognition pipeline.
+
+Run from the repository root (with services/ and Database/ importable, as for
+main.py):
+
+    python -m benchmarks.run --out results.json
+    python -m benchmarks.compare baseline.json results.json
+"""
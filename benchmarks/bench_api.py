@@ -0,0 +1,138 @@
+"""
+End-to-end API benchmarks: /students/create and /students/verify through
+FastAPI's TestClient, with the full lifespan (models, executor, gallery,
+profile cache) running against an in-process Mongo stand-in.
+
+Needs mongomock-motor (pip install mongomock-motor). GridFS uploads go to an
+in-memory bucket. Every request sends distinct image bytes (a face image with
+one perturbed pixel), so the embedding cache never short-circuits the pipeline.
+Latencies include TestClient's in-process transport but no network.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, List, Optional
+from unittest import mock
+
+import cv2
+import numpy as np
+from beanie import PydanticObjectId as ObjectId
+
+from benchmarks.common import find_images, record, summarize
+
+READY_TIMEOUT_SECONDS = 300
+
+
+class _MemoryGridFSBucket:
+    """Stand-in for AsyncIOMotorGridFSBucket.upload_from_stream."""
+
+    def __init__(self):
+        self.files: Dict[ObjectId, bytes] = {}
+
+    async def upload_from_stream(self, filename: str, data: bytes) -> ObjectId:
+        file_id = ObjectId()
+        self.files[file_id] = data
+        return file_id
+
+
+def _face_uploads(images_dir: Optional[str], count: int, seed: int) -> List[bytes]:
+    """`count` distinct JPEG uploads cycled from the images under `images_dir`."""
+    images = [img for img in (cv2.imread(path) for path in find_images(images_dir)) if img is not None]
+    if not images:
+        raise SystemExit(f"❌ The api suite needs face images; none found under {images_dir!r} (use --images)")
+    rng = np.random.default_rng(seed)
+    uploads = []
+    for i in range(count):
+        img = images[i % len(images)].copy()
+        y, x = rng.integers(img.shape[0]), rng.integers(img.shape[1])
+        img[y, x] = rng.integers(0, 256, size=3)
+        uploads.append(cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 95])[1].tobytes())
+    return uploads
+
+
+def _student_form(i: int) -> Dict[str, str]:
+    return {
+        "full_name": f"Bench Student {i}",
+        "email": f"bench{i}@example.com",
+        "program": "Computer Science",
+        "matriculation_number": f"BENCH{i:06d}",
+        "registration_number": f"R{i:06d}",
+        "room_details": "A101",
+        "gender": "male" if i % 2 else "female",
+        "hall_of_residence": "Hall",
+        "level": "300",
+    }
+
+
+def run(args) -> List[Dict]:
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        raise SystemExit("❌ The api suite needs mongomock-motor: pip install mongomock-motor")
+    from beanie import init_beanie
+    from fastapi.testclient import TestClient
+
+    import main
+    from async_database_embedding import AsyncFaceEmbeddingsDB
+    from database import DB_NAME
+    from gallery_sync import GallerySync
+    from models.student_model import Student
+
+    mongo = AsyncMongoMockClient()
+
+    async def init_db():
+        await init_beanie(database=mongo[DB_NAME], document_models=[Student])
+        return _MemoryGridFSBucket()
+
+    students, probes = args.api_students, args.api_requests
+    uploads = _face_uploads(args.images, students + probes * 2, args.seed)
+    create_uploads, verify_uploads = uploads[:students], uploads[students:]
+
+    with mock.patch.object(main, "init_db", init_db), \
+            mock.patch.object(AsyncFaceEmbeddingsDB, "pooled", classmethod(lambda cls, **kwargs: cls(client=mongo))), \
+            mock.patch.object(main, "GallerySync", partial(GallerySync, mode="off")), \
+            TestClient(main.app) as client:
+        start = time.perf_counter()
+        while client.get("/health/ready").status_code != 200:
+            if time.perf_counter() - start > READY_TIMEOUT_SECONDS:
+                raise SystemExit("❌ Models did not become ready")
+            time.sleep(0.1)
+        print(f"✅ API ready in {time.perf_counter() - start:.1f}s")
+
+        verified = []
+
+        def post(path: str, upload: bytes, data: Optional[Dict] = None) -> float:
+            begin = time.perf_counter()
+            response = client.post(path, data=data, files={"profile_image": ("face.jpg", upload, "image/jpeg")})
+            elapsed = time.perf_counter() - begin
+            if response.status_code != 200:
+                raise SystemExit(f"❌ {path} returned {response.status_code}: {response.text}")
+            verified.append("student" in response.json())
+            return elapsed
+
+        rows = []
+        latencies = [post("/students/create", upload, _student_form(i)) for i, upload in enumerate(create_uploads)]
+        rows.append(record("api", "students_create", {"concurrency": 1}, summarize(latencies)))
+        print(f"⏱️ /students/create: p50 {rows[-1]['p50_ms']:.1f} ms")
+
+        verified.clear()
+        latencies = [post("/students/verify", upload) for upload in verify_uploads[:probes]]
+        rows.append(record(
+            "api", "students_verify", {"concurrency": 1, "gallery_size": students}, summarize(latencies),
+            verified_fraction=sum(verified) / len(verified),
+        ))
+        print(f"⏱️ /students/verify: p50 {rows[-1]['p50_ms']:.1f} ms")
+
+        # Throughput: requests/s over the wall time with several requests in flight
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            begin = time.perf_counter()
+            latencies = list(pool.map(partial(post, "/students/verify"), verify_uploads[probes:]))
+            wall = time.perf_counter() - begin
+        stats = summarize(latencies)
+        stats["items_per_s"] = len(latencies) / wall
+        rows.append(record(
+            "api", "students_verify", {"concurrency": args.concurrency, "gallery_size": students}, stats,
+            executor=client.get("/metrics").json().get("inference_executor"),
+        ))
+        print(f"⏱️ /students/verify x{args.concurrency}: {stats['items_per_s']:.1f} req/s, p50 {stats['p50_ms']:.1f} ms")
+    return rows
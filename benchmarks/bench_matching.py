@@ -0,0 +1,111 @@
+"""
+Gallery matching benchmarks on synthetic embeddings.
+
+For each gallery size a GalleryIndex is filled with random unit templates
+(no database involved) and installed as the shared index, so
+FaceVerifier.verify_face runs its production path. Probes are noisy copies
+of enrolled identities, so every probe has a true match.
+"""
+import time
+from typing import Dict, List
+
+import numpy as np
+from pymongo import MongoClient
+
+from benchmarks.common import measure, record
+from database_embedding import FaceEmbeddingsDB
+from face_recognition import FaceVerifier
+from gallery_index import GalleryIndex, install_gallery_index
+from gallery_snapshot import GallerySnapshot
+
+GALLERY_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+DIM = 512
+# Probe = identity center + gaussian noise of norm ~PROBE_NOISE (cosine ~0.9 to its identity)
+PROBE_NOISE = 0.5
+# Template spread around the identity center when several templates are enrolled
+TEMPLATE_NOISE = 0.3
+BATCH_PROBES = 32
+GENERATE_BLOCK = 65536
+
+
+def _unit(vectors: np.ndarray) -> np.ndarray:
+    vectors /= np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors
+
+
+def synthetic_gallery(size: int, templates: int, namespace: str, rng: np.random.Generator):
+    """
+    An exact GalleryIndex over `size` random identities, built in place
+    without per-person upserts, and its (size, templates, DIM) template array.
+    """
+    matrix = np.empty((size, templates, DIM), dtype=np.float32)
+    for start in range(0, size, GENERATE_BLOCK):
+        stop = min(start + GENERATE_BLOCK, size)
+        centers = _unit(rng.standard_normal((stop - start, DIM), dtype=np.float32))
+        block = np.repeat(centers[:, None, :], templates, axis=1)
+        if templates > 1:
+            block += TEMPLATE_NOISE * rng.standard_normal(block.shape, dtype=np.float32) / np.sqrt(DIM)
+        matrix[start:stop] = _unit(block)
+    manifest = {"version": "synthetic", "namespace": namespace, "dim": DIM, "max_templates": templates}
+    snapshot = GallerySnapshot(
+        None, manifest, matrix, np.ones((size, templates), dtype=bool), [f"S{i:07d}" for i in range(size)]
+    )
+    index = GalleryIndex(dim=DIM, backend="exact", max_templates=templates)
+    index.load_snapshot(snapshot)
+    return index, matrix
+
+
+def _probes(matrix: np.ndarray, count: int, rng: np.random.Generator):
+    """(expected person_ids, unit probes) drawn around randomly chosen identities."""
+    rows = rng.choice(len(matrix), size=min(count, len(matrix)), replace=False)
+    centers = _unit(matrix[rows].mean(axis=1))
+    noise = PROBE_NOISE * rng.standard_normal((len(rows), DIM), dtype=np.float32) / np.sqrt(DIM)
+    return [f"S{row:07d}" for row in rows], _unit(centers + noise)
+
+
+def run(args) -> List[Dict]:
+    rng = np.random.default_rng(args.seed)
+    # Only the namespace is used: the verifier reads the installed index, never Mongo
+    db = FaceEmbeddingsDB(client=MongoClient(connect=False))
+    verifier = FaceVerifier(db=db)
+    rows = []
+    for size in args.gallery_sizes:
+        start = time.perf_counter()
+        index, matrix = synthetic_gallery(size, args.templates, db.namespace, rng)
+        build_s = time.perf_counter() - start
+        install_gallery_index(index)
+        expected, probes = _probes(matrix, max(args.match_repeats, BATCH_PROBES), rng)
+        params = {"gallery_size": size, "templates": args.templates}
+
+        hits = sum(verifier.verify_face(probe, threshold=0.0) == pid for pid, probe in zip(expected, probes))
+        stats = measure(
+            lambda i: verifier.verify_face(probes[i % len(probes)], exact=True), args.match_repeats, warmup=2
+        )
+        rows.append(record(
+            "matching", "verify_face_exact", params, stats,
+            top1_accuracy=hits / len(probes), build_s=build_s,
+            gallery_mb=matrix.nbytes / 2**20,
+        ))
+        print(f"⏱️ verify_face exact, {size} identities: p50 {stats['p50_ms']:.2f} ms")
+
+        batch = probes[:BATCH_PROBES]
+        stats = measure(lambda _: index.best_matches(batch, exact=True), max(3, args.match_repeats // 10), warmup=1, items=len(batch))
+        rows.append(record("matching", "best_matches_exact", dict(params, batch=len(batch)), stats))
+        print(f"⏱️ best_matches x{len(batch)}, {size} identities: {stats['items_per_s']:.0f} probes/s")
+
+        if args.ann:
+            start = time.perf_counter()
+            index.enable_ann()
+            train_s = time.perf_counter() - start
+            stats = measure(lambda i: verifier.verify_face(probes[i % len(probes)]), args.match_repeats, warmup=2)
+            rows.append(record(
+                "matching", "verify_face_ivf", params, stats,
+                recall_at_1=index.ann_recall(probes[:100], k=1), train_s=train_s,
+            ))
+            print(f"⏱️ verify_face IVF, {size} identities: p50 {stats['p50_ms']:.2f} ms")
+        del index, matrix
+    # Unloaded (no namespace), so the next user of the shared index reloads it from its store
+    install_gallery_index(GalleryIndex(dim=DIM))
+    verifier.close()
+    db.client.close()
+    return rows
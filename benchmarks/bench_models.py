@@ -0,0 +1,82 @@
+"""
+Model benchmarks: MTCNN detection at several image resolutions and
+InceptionResnetV1 forwards at several batch sizes, with the models built
+exactly as the API builds them (FACE_* settings apply).
+"""
+from typing import Dict, List, Optional, Tuple
+
+import torch
+from PIL import Image, ImageDraw
+
+import face_embedding
+from benchmarks.common import find_images, measure, record
+
+RESOLUTIONS = [(320, 240), (640, 480), (1280, 720), (1920, 1080), (3840, 2160)]
+BATCH_SIZES = [1, 2, 4, 8, 16, 32, 64]
+
+
+def _base_image(images_dir: Optional[str]) -> Tuple[Image.Image, str]:
+    """The first image under `images_dir`, or a synthetic face-like drawing when there is none."""
+    paths = find_images(images_dir)
+    if paths:
+        return Image.open(paths[0]).convert("RGB"), paths[0]
+    img = Image.new("RGB", (480, 640), (200, 200, 200))
+    draw = ImageDraw.Draw(img)
+    draw.ellipse((120, 140, 360, 460), fill=(224, 172, 140))
+    draw.ellipse((180, 250, 220, 280), fill=(40, 40, 40))
+    draw.ellipse((260, 250, 300, 280), fill=(40, 40, 40))
+    draw.rectangle((200, 380, 280, 395), fill=(150, 60, 60))
+    return img, "synthetic"
+
+
+def _fit(img: Image.Image, width: int, height: int) -> Image.Image:
+    """`img` scaled to fit a width x height canvas, centered, so the face keeps its proportions."""
+    scale = min(width / img.width, height / img.height)
+    resized = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))), Image.BILINEAR)
+    canvas = Image.new("RGB", (width, height), (128, 128, 128))
+    canvas.paste(resized, ((width - resized.width) // 2, (height - resized.height) // 2))
+    return canvas
+
+
+def bench_mtcnn(images_dir: Optional[str], resolutions: List[Tuple[int, int]], repeats: int) -> List[Dict]:
+    face_embedding.init_models(warmup=False)
+    base, source = _base_image(images_dir)
+    rows = []
+    for width, height in resolutions:
+        img = _fit(base, width, height)
+        boxes, _ = face_embedding.mtcnn.detect(img)
+        stats = measure(lambda _: face_embedding.mtcnn.detect(img), repeats, warmup=2)
+        rows.append(record(
+            "models", "mtcnn_detect", {"width": width, "height": height}, stats,
+            faces=0 if boxes is None else len(boxes), image=source,
+        ))
+        print(f"⏱️ MTCNN.detect {width}x{height}: p50 {stats['p50_ms']:.1f} ms")
+    return rows
+
+
+def bench_facenet(batch_sizes: List[int], repeats: int, seed: int) -> List[Dict]:
+    face_embedding.init_models(warmup=False)
+    generator = torch.Generator().manual_seed(seed)
+    rows = []
+    for batch_size in batch_sizes:
+        batch = torch.randn(batch_size, 3, 160, 160, generator=generator).to(face_embedding.device)
+
+        def forward(_):
+            with torch.no_grad():
+                out = face_embedding.facenet(batch)
+            if out.is_cuda:
+                torch.cuda.synchronize()
+
+        stats = measure(forward, repeats, warmup=2, items=batch_size)
+        stats["ms_per_face"] = stats["p50_ms"] / batch_size
+        rows.append(record("models", "facenet_forward", {"batch_size": batch_size}, stats))
+        print(f"⏱️ InceptionResnetV1 batch {batch_size}: p50 {stats['p50_ms']:.1f} ms ({stats['items_per_s']:.0f} faces/s)")
+    return rows
+
+
+def run(args) -> List[Dict]:
+    resolutions = [tuple(int(v) for v in r.split("x")) for r in args.resolutions]
+    return (
+        bench_mtcnn(args.images, resolutions, args.repeats)
+        + bench_facenet(args.batch_sizes, args.repeats, args.seed)
+    )
@@ -0,0 +1,104 @@
+"""Timing, result records and environment capture shared by the benchmark suites."""
+import os
+import platform
+import subprocess
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import torch
+
+RESULT_FORMAT_VERSION = 1
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def summarize(seconds: List[float], items: int = 1) -> Dict:
+    """Latency percentiles (ms) of timed runs and the items/s they sustain."""
+    ms = np.asarray(seconds, dtype=np.float64) * 1000
+    return {
+        "runs": len(ms),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "min_ms": float(ms.min()),
+        "max_ms": float(ms.max()),
+        "stdev_ms": float(ms.std()),
+        "items_per_s": float(items * len(ms) / (ms.sum() / 1000)) if ms.sum() > 0 else 0.0,
+    }
+
+
+def measure(fn: Callable[[int], object], repeats: int, warmup: int = 1, items: int = 1) -> Dict:
+    """Time `repeats` calls of fn(run_index) after `warmup` untimed calls."""
+    for i in range(warmup):
+        fn(i)
+    seconds = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        fn(i)
+        seconds.append(time.perf_counter() - start)
+    return summarize(seconds, items)
+
+
+def record(suite: str, benchmark: str, params: Dict, stats: Dict, **extra) -> Dict:
+    """One result row; (benchmark, params) identifies it across runs."""
+    row = {"suite": suite, "benchmark": benchmark, "params": params}
+    row.update(stats)
+    row.update(extra)
+    return row
+
+
+def result_key(row: Dict) -> str:
+    params = ",".join(f"{k}={row['params'][k]}" for k in sorted(row["params"]))
+    return f"{row['benchmark']}[{params}]"
+
+
+def find_images(directory: Optional[str]) -> List[str]:
+    """Image files under `directory` (recursively, sorted), or [] if it is unset or missing."""
+    if not directory or not os.path.isdir(directory):
+        return []
+    paths = []
+    for root, _, files in os.walk(directory):
+        paths.extend(
+            os.path.join(root, name) for name in files
+            if name.lower().endswith((".jpg", ".jpeg", ".png", ".bmp"))
+        )
+    return sorted(paths)
+
+
+def _git(*args: str) -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", *args], cwd=REPO_ROOT, capture_output=True, text=True, check=True, timeout=10
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _cpu_model() -> Optional[str]:
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or None
+
+
+def environment() -> Dict:
+    """What the numbers depend on: commit, library versions, CPU, threads and FACE_* settings."""
+    return {
+        "git_commit": _git("rev-parse", "HEAD"),
+        "git_dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "cpu_model": _cpu_model(),
+        "cpu_count": os.cpu_count(),
+        "cpu_affinity": len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else None,
+        "torch_threads": torch.get_num_threads(),
+        "cuda": torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
+        "settings": {k: v for k, v in sorted(os.environ.items()) if k.startswith("FACE_")},
+    }
@@ -0,0 +1,67 @@
+"""
+Compare two benchmark result files, e.g. from the parent commit and this one.
+
+    python -m benchmarks.compare baseline.json current.json [--metric p50_ms] [--tolerance 0.1]
+
+Exits with status 1 when any benchmark got slower than the tolerance allows.
+"""
+import argparse
+import json
+import sys
+from typing import Dict
+
+from benchmarks.common import result_key
+
+# Metrics where a larger value is better; every other metric is a latency
+HIGHER_IS_BETTER = {"items_per_s"}
+
+
+def load(path: str) -> Dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(baseline: Dict, current: Dict, metric: str = "p50_ms", tolerance: float = 0.1) -> int:
+    """Print the per-benchmark change in `metric` and return the number of regressions."""
+    before = {result_key(row): row for row in baseline["results"]}
+    after = {result_key(row): row for row in current["results"]}
+    commits = (baseline["environment"].get("git_commit") or "?")[:10], (current["environment"].get("git_commit") or "?")[:10]
+    print(f"\n--- {metric}: {commits[0]} -> {commits[1]} (tolerance {tolerance:.0%}) ---")
+    for side, report in (("baseline", baseline), ("current", current)):
+        env = report["environment"]
+        print(f"{side:<8} {env.get('cpu_model')}, {env.get('torch_threads')} torch threads, torch {env.get('torch')}")
+
+    regressions = 0
+    for key in sorted(before.keys() & after.keys()):
+        old, new = before[key].get(metric), after[key].get(metric)
+        if not old or new is None:
+            continue
+        change = new / old - 1
+        worse = -change if metric in HIGHER_IS_BETTER else change
+        flag = ""
+        if worse > tolerance:
+            flag = "  ❌ regression"
+            regressions += 1
+        elif worse < -tolerance:
+            flag = "  ✅ faster"
+        print(f"{key:<60} {old:>12.3f} {new:>12.3f} {change:>+8.1%}{flag}")
+    for key in sorted(before.keys() - after.keys()):
+        print(f"{key:<60} missing from the current run")
+    for key in sorted(after.keys() - before.keys()):
+        print(f"{key:<60} new")
+    print(f"\n{regressions} regression(s)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--metric", default="p50_ms")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed relative slowdown")
+    args = parser.parse_args()
+    sys.exit(1 if compare(load(args.baseline), load(args.current), args.metric, args.tolerance) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Run the benchmark suites and write the results as JSON.
+
+    python -m benchmarks.run [--suites models,matching,api] [--out benchmark_results.json]
+                             [--images evaluation_dataset] [--threads 4] [--compare baseline.json]
+
+Seeds, thread counts and the FACE_* settings are fixed or recorded so runs
+on different commits can be compared with benchmarks.compare.
+"""
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+import torch
+
+from benchmarks import bench_matching, bench_models
+from benchmarks.common import RESULT_FORMAT_VERSION, environment
+
+SUITES = ["models", "matching", "api"]
+
+
+def _ints(text: str):
+    return [int(v) for v in text.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark detection, embedding, matching and the API.")
+    parser.add_argument("--suites", default=",".join(SUITES), help=f"Comma-separated subset of {SUITES}")
+    parser.add_argument("--out", default="benchmark_results.json")
+    parser.add_argument("--images", default="evaluation_dataset", help="Face images for detection and API requests")
+    parser.add_argument("--threads", type=int, default=0, help="torch threads (default: torch's own choice)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=20, help="Timed runs per model benchmark")
+    parser.add_argument("--resolutions", default=",".join(f"{w}x{h}" for w, h in bench_models.RESOLUTIONS))
+    parser.add_argument("--batch-sizes", type=_ints, default=bench_models.BATCH_SIZES)
+    parser.add_argument("--gallery-sizes", type=_ints, default=bench_matching.GALLERY_SIZES)
+    parser.add_argument("--templates", type=int, default=1, help="Templates per synthetic identity")
+    parser.add_argument("--match-repeats", type=int, default=200, help="Timed probes per gallery size")
+    parser.add_argument("--ann", action="store_true", help="Also train and time the IVF index per gallery size")
+    parser.add_argument("--api-students", type=int, default=50, help="Students created before verifying")
+    parser.add_argument("--api-requests", type=int, default=50, help="Verify requests, sequential and concurrent")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--compare", help="Baseline results JSON to compare against after the run")
+    args = parser.parse_args()
+    args.resolutions = args.resolutions.split(",")
+
+    suites = [s for s in args.suites.split(",") if s]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        parser.error(f"Unknown suites: {sorted(unknown)}")
+
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    results, durations = [], {}
+    for suite in suites:
+        print(f"\n--- {suite} ---")
+        start = time.perf_counter()
+        if suite == "models":
+            results += bench_models.run(args)
+        elif suite == "matching":
+            results += bench_matching.run(args)
+        else:
+            # Imported only when used: it pulls in the app and needs mongomock-motor
+            from benchmarks import bench_api
+            results += bench_api.run(args)
+        durations[suite] = time.perf_counter() - start
+
+    report = {
+        "format": RESULT_FORMAT_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "environment": environment(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        "suite_seconds": durations,
+        "results": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n💾 {len(results)} results written to {args.out}")
+
+    if args.compare:
+        from benchmarks.compare import compare, load
+        compare(load(args.compare), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,73 +1,355 @@
+"""
+Evaluate face verification on evaluation_dataset with a full threshold sweep.
+
+Every image is embedded once: files are hashed and looked up in an on-disk
+embedding cache, and only misses are decoded, detected and embedded, in
+batches spread over a thread pool. Each student's reg.jpg is enrolled in an
+in-memory GalleryIndex; all other images (and everything under impostors/)
+are probes.
+
+From one probe x gallery score pass the report gives:
+  - verification (1:1) ROC / DET: FAR and FRR at every threshold, and the EER
+  - identification (1:N, as served by /students/verify): precision, recall,
+    F1 and accuracy at every threshold
+  - approximate (IVF) vs exact search recall on the same probes
+  - time spent in each stage
+
+Usage:
+    python evaluation.py [--dataset evaluation_dataset] [--workers 4] [--batch-size 16]
+                         [--cache-dir .evaluation_cache] [--threshold 0.7] [--curves curves.csv]
+"""
+import argparse
+import csv
 import os
-import cv2
-from face_embedding import get_embedding_from_image
-from face_recognition import FaceVerifier
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+import face_embedding
+from embedding_cache import EmbeddingCache
+from gallery_index import GalleryIndex, reduce_template_scores
 
 # Path to your dataset
 DATASET_PATH = "evaluation_dataset"
 THRESHOLD = 0.7
+CACHE_DIR = ".evaluation_cache"
+BATCH_SIZE = 16
+# Thresholds printed in the report; the CSV covers the whole sweep
+REPORT_THRESHOLDS = [0.3, 0.4, 0.5, 0.55, 0.6, 0.65, 0.7, 0.75, 0.8, 0.9]
+# Cosine similarity sweep resolution
+SWEEP_STEP = 0.001
+# Probes scored per block, bounding the (probes, gallery, templates) score buffer
+SCORE_BLOCK_PROBES = 1024
+# Recall of the approximate (IVF) gallery search is measured against exact search
+ANN_RECALL_K = 10
+ANN_NPROBE_VALUES = [1, 2, 4, 8, 16, 32]
 
-verifier = FaceVerifier()
 
-true_positives = 0
-false_positives = 0
-false_negatives = 0
-true_negatives = 0
+class StageTimer:
+    """Seconds per named stage; stages timed inside worker threads are summed over threads."""
 
-# Evaluate genuine matches
-for student_id in os.listdir(DATASET_PATH):
-    student_path = os.path.join(DATASET_PATH, student_id)
-    if student_id == "impostors" or not os.path.isdir(student_path):
-        continue
+    def __init__(self):
+        self.seconds: Dict[str, float] = defaultdict(float)
+        self._lock = threading.Lock()
 
-    for test_image in os.listdir(student_path):
-        if test_image == "reg.jpg":
-            continue
+    @contextmanager
+    def __call__(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.seconds[name] += elapsed
 
-        img_path = os.path.join(student_path, test_image)
-        img = cv2.imread(img_path)
-        emb = get_embedding_from_image(img)
-        if emb is None:
+
+def scan_dataset(dataset_path: str) -> Tuple[List[Tuple[str, str]], List[Tuple[str, Optional[str]]]]:
+    """Return (gallery as (student_id, path), probes as (path, expected student_id or None))."""
+    gallery, probes = [], []
+    for student_id in sorted(os.listdir(dataset_path)):
+        student_path = os.path.join(dataset_path, student_id)
+        if not os.path.isdir(student_path):
             continue
+        for img_name in sorted(os.listdir(student_path)):
+            path = os.path.join(student_path, img_name)
+            if student_id == "impostors":
+                probes.append((path, None))
+            elif img_name == "reg.jpg":
+                gallery.append((student_id, path))
+            else:
+                probes.append((path, student_id))
+    return gallery, probes
+
+
+def embed_files(
+    paths: List[str], cache: EmbeddingCache, timer: StageTimer, batch_size: int, workers: int
+) -> List[Optional[np.ndarray]]:
+    """Embedding (or None) per file, from the cache where possible, computed in parallel batches otherwise."""
+
+    def run(chunk: List[str]):
+        with timer("read + hash"):
+            data = []
+            for path in chunk:
+                with open(path, "rb") as f:
+                    data.append(f.read())
+            lookups = [cache.lookup(image_bytes) for image_bytes in data]
+        results = [result for _, result in lookups]
+        misses = [i for i, result in enumerate(results) if result is None]
+        if misses:
+            with timer("decode"):
+                imgs = [face_embedding.decode_image(data[i]) for i in misses]
+            with timer("detect"):
+                faces = face_embedding.detect_face_tensors(imgs)
+            found = [j for j, face in enumerate(faces) if face is not None]
+            with timer("embed"):
+                embeddings = face_embedding.embed_face_tensors([faces[j] for j in found])
+            computed = [(img is not None, None) for img in imgs]
+            for j, embedding in zip(found, embeddings):
+                computed[j] = (True, embedding)
+            for i, result in zip(misses, computed):
+                cache.put(lookups[i][0], result)
+                results[i] = result
+        return [embedding for _, embedding in results]
+
+    chunks = [paths[start:start + batch_size] for start in range(0, len(paths), batch_size)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return [embedding for chunk in pool.map(run, chunks) for embedding in chunk]
+
+
+def _normalize(embeddings: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+def score_probes(gallery: GalleryIndex, probes: np.ndarray, expected: List[Optional[str]], thresholds: np.ndarray) -> Dict:
+    """
+    Score every probe against every enrolled identity in blocks and reduce to:
+      - histograms of genuine / impostor pair scores on the threshold grid (1:1)
+      - each probe's best identity and score (1:N)
+    """
+    ids, templates, mask = gallery.arrays()
+    columns = {person_id: column for column, person_id in enumerate(ids)}
+    flat = templates.reshape(-1, gallery.dim)
+    bins = np.append(thresholds, np.inf)
+    genuine_hist = np.zeros(len(thresholds), dtype=np.int64)
+    impostor_hist = np.zeros(len(thresholds), dtype=np.int64)
+    best_ids, best_scores = [], []
+
+    for start in range(0, len(probes), SCORE_BLOCK_PROBES):
+        block = probes[start:start + SCORE_BLOCK_PROBES]
+        raw = (block @ flat.T).reshape(len(block), len(ids), gallery.max_templates)
+        scores = reduce_template_scores(raw, mask, gallery.reduce, gallery.top_k)
+
+        own = np.array([columns.get(person_id, -1) for person_id in expected[start:start + len(block)]])
+        genuine_rows = np.flatnonzero(own >= 0)
+        is_genuine = np.zeros(scores.shape, dtype=bool)
+        is_genuine[genuine_rows, own[genuine_rows]] = True
+        genuine_hist += np.histogram(scores[is_genuine], bins=bins)[0]
+        impostor_hist += np.histogram(scores[~is_genuine], bins=bins)[0]
+
+        best = np.argmax(scores, axis=1)
+        best_ids.extend(ids[column] for column in best)
+        best_scores.append(scores[np.arange(len(block)), best])
+
+    return {
+        "genuine_hist": genuine_hist,
+        "impostor_hist": impostor_hist,
+        "best_ids": best_ids,
+        "best_scores": np.concatenate(best_scores) if best_scores else np.empty(0, dtype=np.float32),
+    }
+
+
+def _at_least(hist: np.ndarray) -> np.ndarray:
+    """Counts of scores >= each threshold, from a histogram whose bins start at the thresholds."""
+    return np.cumsum(hist[::-1])[::-1]
+
+
+def verification_sweep(genuine_hist: np.ndarray, impostor_hist: np.ndarray) -> Dict[str, np.ndarray]:
+    """FAR, FRR and TPR at every threshold of the grid (ROC: TPR vs FAR; DET: FRR vs FAR)."""
+    genuine_total = max(int(genuine_hist.sum()), 1)
+    impostor_total = max(int(impostor_hist.sum()), 1)
+    tpr = _at_least(genuine_hist) / genuine_total
+    far = _at_least(impostor_hist) / impostor_total
+    return {"far": far, "frr": 1.0 - tpr, "tpr": tpr}
+
+
+def equal_error_rate(thresholds: np.ndarray, far: np.ndarray, frr: np.ndarray) -> Tuple[float, float]:
+    """(EER, threshold) where FAR and FRR cross, interpolated between the two grid points around the crossing."""
+    gap = far - frr  # non-increasing along the grid
+    i = int(np.argmax(gap <= 0))
+    if i == 0:
+        return float((far[0] + frr[0]) / 2), float(thresholds[0])
+    w = gap[i - 1] / (gap[i - 1] - gap[i])
+    eer = far[i - 1] + w * (far[i] - far[i - 1])
+    return float(eer), float(thresholds[i - 1] + w * (thresholds[i] - thresholds[i - 1]))
+
+
+def identification_sweep(
+    thresholds: np.ndarray, best_ids: List[str], best_scores: np.ndarray, expected: List[Optional[str]]
+) -> Dict[str, np.ndarray]:
+    """
+    Confusion counts and precision / recall / F1 / accuracy of 1:N matching at every threshold.
+
+    A probe is accepted when its best score reaches the threshold. Accepting
+    the right student is a true positive; accepting an impostor or the wrong
+    student is a false positive (and, for a genuine probe, also a false negative).
+    """
+    correct = np.array([e is not None and e == b for e, b in zip(expected, best_ids)], dtype=bool)
+    genuine = np.array([e is not None for e in expected], dtype=bool)
+
+    def at_least(scores: np.ndarray) -> np.ndarray:
+        return len(scores) - np.searchsorted(np.sort(scores), thresholds, side="left")
+
+    tp = at_least(best_scores[correct])
+    fp = at_least(best_scores[~correct])
+    fn = int(genuine.sum()) - tp
+    tn = int((~genuine).sum()) - at_least(best_scores[~genuine])
+    precision = tp / np.maximum(tp + fp, 1)
+    recall = tp / max(int(genuine.sum()), 1)
+    return {
+        "tp": tp, "fp": fp, "fn": fn, "tn": tn,
+        "precision": precision,
+        "recall": recall,
+        "f1": 2 * precision * recall / np.maximum(precision + recall, 1e-12),
+        "accuracy": (tp + tn) / max(len(expected), 1),
+    }
+
+
+def ann_comparison(gallery: GalleryIndex, probes: np.ndarray) -> Tuple[float, List[Tuple[int, float, float, float]]]:
+    """Exact ms/probe and (nprobe, recall@1, recall@k, ms/probe) of IVF search on the same probes."""
+    if not gallery.ann_active:
+        gallery.enable_ann()
+    start = time.perf_counter()
+    for probe in probes:
+        gallery.search(probe, k=ANN_RECALL_K, exact=True)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(probes)
+    results = []
+    for nprobe in ANN_NPROBE_VALUES:
+        start = time.perf_counter()
+        for probe in probes:
+            gallery.search(probe, k=ANN_RECALL_K, nprobe=nprobe)
+        ann_ms = (time.perf_counter() - start) * 1000 / len(probes)
+        recall_k = gallery.ann_recall(probes, k=ANN_RECALL_K, nprobe=nprobe)
+        top1 = gallery.ann_recall(probes, k=1, nprobe=nprobe)
+        results.append((nprobe, top1, recall_k, ann_ms))
+    return exact_ms, results
+
+
+def write_curves(path: str, thresholds: np.ndarray, verification: Dict, identification: Dict):
+    columns = ["far", "frr", "tpr", "precision", "recall", "f1", "accuracy", "tp", "fp", "fn", "tn"]
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["threshold"] + columns)
+        for i, threshold in enumerate(thresholds):
+            values = [verification[c][i] if c in verification else identification[c][i] for c in columns]
+            writer.writerow([f"{threshold:.3f}"] + [f"{v:.6f}" if isinstance(v, float) else int(v) for v in values])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Threshold sweep, ROC/DET and EER on the evaluation dataset.")
+    parser.add_argument("--dataset", default=DATASET_PATH)
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="On-disk embedding cache, keyed by file hash")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="Operating threshold to highlight")
+    parser.add_argument("--curves", help="Write the full per-threshold sweep to this CSV file")
+    parser.add_argument("--no-ann", action="store_true", help="Skip the IVF vs exact search comparison")
+    args = parser.parse_args()
+
+    timer = StageTimer()
+    total_start = time.perf_counter()
+    # Split the cores between the worker threads instead of letting each use all of them
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // args.workers))
+
+    with timer("load models"):
+        face_embedding.init_models(warmup=False)
+    with timer("scan dataset"):
+        gallery_files, probe_files = scan_dataset(args.dataset)
+    if not gallery_files or not probe_files:
+        raise SystemExit(f"❌ No gallery or probe images found under {args.dataset}")
+
+    cache = EmbeddingCache(
+        max_entries=0, ttl_seconds=float("inf"), disk_dir=args.cache_dir, namespace=face_embedding.pipeline_tag()
+    )
+    paths = [path for _, path in gallery_files] + [path for path, _ in probe_files]
+    with timer("embeddings (wall)"):
+        embeddings = embed_files(paths, cache, timer, args.batch_size, args.workers)
+    cache_stats = cache.stats()
+
+    with timer("gallery"):
+        gallery = GalleryIndex()
+        for (student_id, _), embedding in zip(gallery_files, embeddings):
+            if embedding is not None:
+                gallery.upsert(student_id, embedding)
+        probe_embeddings = embeddings[len(gallery_files):]
+        kept = [i for i, embedding in enumerate(probe_embeddings) if embedding is not None]
+        probes = _normalize(np.stack([probe_embeddings[i] for i in kept]).astype(np.float32)) if kept else None
+        expected = [probe_files[i][1] for i in kept]
+    if probes is None or len(gallery) == 0:
+        raise SystemExit("❌ No faces found in the gallery or probe images")
+
+    thresholds = np.round(np.arange(-1.0, 1.0 + SWEEP_STEP / 2, SWEEP_STEP), 3)
+    with timer("scoring"):
+        scored = score_probes(gallery, probes, expected, thresholds)
+    with timer("threshold sweep"):
+        verification = verification_sweep(scored["genuine_hist"], scored["impostor_hist"])
+        identification = identification_sweep(thresholds, scored["best_ids"], scored["best_scores"], expected)
+        eer, eer_threshold = equal_error_rate(thresholds, verification["far"], verification["frr"])
+        best_f1 = int(np.argmax(identification["f1"]))
+
+    ann_results = []
+    if not args.no_ann:
+        with timer("ANN comparison"):
+            exact_ms, ann_results = ann_comparison(gallery, probes)
+    if args.curves:
+        write_curves(args.curves, thresholds, verification, identification)
+
+    def row(threshold: float) -> str:
+        i = int(np.argmin(np.abs(thresholds - threshold)))
+        return (
+            f"{thresholds[i]:>6.2f}  {identification['precision'][i]:>9.2%}  {identification['recall'][i]:>7.2%}  "
+            f"{identification['f1'][i]:>7.2%}  {identification['accuracy'][i]:>8.2%}  "
+            f"{verification['far'][i]:>8.4%}  {verification['frr'][i]:>7.2%}"
+        )
+
+    skipped = len(probe_files) - len(kept) + len(gallery_files) - len(gallery)
+    print(f"\n--- Evaluation Results ({len(gallery)} identities, {len(probes)} probes, {skipped} images without a face) ---")
+    print(f"{'thresh':>6}  {'precision':>9}  {'recall':>7}  {'F1':>7}  {'accuracy':>8}  {'FAR':>8}  {'FRR':>7}")
+    for threshold in sorted(set(REPORT_THRESHOLDS + [args.threshold])):
+        marker = "  ◀ operating threshold" if threshold == args.threshold else ""
+        print(row(threshold) + marker)
+    i = int(np.argmin(np.abs(thresholds - args.threshold)))
+    print(
+        f"\n✅ True Positives: {identification['tp'][i]}  ❌ False Negatives: {identification['fn'][i]}  "
+        f"🚫 False Positives: {identification['fp'][i]}  ✔️ True Negatives: {identification['tn'][i]}  (at {args.threshold})"
+    )
+    print(f"⚖️ EER: {eer:.2%} at threshold {eer_threshold:.3f}")
+    print(f"📈 Best F1: {identification['f1'][best_f1]:.2%} at threshold {thresholds[best_f1]:.3f}")
+    if args.curves:
+        print(f"💾 Full sweep ({len(thresholds)} thresholds) written to {args.curves}")
+
+    if ann_results:
+        print(f"\n--- ANN vs Exact Search ({len(gallery)} identities, {len(probes)} probes) ---")
+        print(f"⏱️ Exact search: {exact_ms:.3f} ms/probe")
+        for nprobe, top1, recall_k, ann_ms in ann_results:
+            print(
+                f"nprobe={nprobe:<3} recall@1: {top1:.2%} (loss {1 - top1:.2%})  "
+                f"recall@{ANN_RECALL_K}: {recall_k:.2%} (loss {1 - recall_k:.2%})  {ann_ms:.3f} ms/probe"
+            )
+
+    print(f"\n--- Timing ({args.workers} workers, batch {args.batch_size}, {torch.get_num_threads()} torch threads each) ---")
+    print(f"💾 Embedding cache: {cache_stats['disk_hits']} hits, {cache_stats['misses']} misses ({args.cache_dir})")
+    for name, seconds in timer.seconds.items():
+        summed = " (summed over workers)" if name in ("read + hash", "decode", "detect", "embed") else ""
+        print(f"{name:<20} {seconds:8.2f} s{summed}")
+    print(f"{'total':<20} {time.perf_counter() - total_start:8.2f} s")
+
 
-        matched_id = verifier.verify_face(emb, threshold=THRESHOLD)
-        if matched_id == student_id:
-            true_positives += 1
-        else:
-            false_negatives += 1
-        print(f"Expected: {student_id}, Predicted: {matched_id}")
-
-# Evaluate impostors
-impostor_path = os.path.join(DATASET_PATH, "impostors")
-for img_name in os.listdir(impostor_path):
-    img_path = os.path.join(impostor_path, img_name)
-    img = cv2.imread(img_path)
-    emb = get_embedding_from_image(img)
-    if emb is None:
-        continue
-
-    matched_id = verifier.verify_face(emb, threshold=THRESHOLD)
-    if matched_id:
-        false_positives += 1
-        print(f"Impostor {img_name} incorrectly matched with {matched_id}")
-    else:
-        true_negatives += 1
-
-verifier.close()
-
-# Calculate metrics
-total = true_positives + false_negatives + false_positives + true_negatives
-accuracy = (true_positives + true_negatives) / total
-precision = true_positives / (true_positives + false_positives + 1e-6)
-recall = true_positives / (true_positives + false_negatives + 1e-6)
-f1 = 2 * (precision * recall) / (precision + recall + 1e-6)
-
-print("\n--- Evaluation Results ---")
-print(f"✅ True Positives: {true_positives}")
-print(f"❌ False Negatives: {false_negatives}")
-print(f"🚫 False Positives: {false_positives}")
-print(f"✔️ True Negatives: {true_negatives}")
-print(f"\n📊 Accuracy: {accuracy:.2%}")
-print(f"🎯 Precision: {precision:.2%}")
-print(f"📥 Recall: {recall:.2%}")
-print(f"📈 F1 Score: {f1:.2%}")
+if __name__ == "__main__":
+    main()
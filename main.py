@@ -1,16 +1,23 @@
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
+import asyncio
+import json
+import zipfile
 from pydantic import EmailStr
-from typing import Literal
+from typing import List, Literal, Optional, Union
 import numpy as np
-import cv2
 
-from models.student_model import Student
-from face_embedding import get_embedding_from_image
-from face_recognition import FaceRegistrar, FaceVerifier
-import face_embeddings
+from models.student_model import Student, StudentProfile, add_student_change_listener, remove_student_change_listener
+import face_embedding
+from inference_executor import InferenceExecutor
+from face_recognition import AsyncFaceRegistrar, AsyncFaceVerifier
+from gallery_sync import GallerySync
+from bulk_enrollment import enroll_archive
 from database import init_db
+from async_database_embedding import AsyncFaceEmbeddingsDB
+from student_profile_cache import StudentProfileCache
 
 # App setup and lifespan context
 @asynccontextmanager
@@ -20,8 +27,31 @@ async def lifespan(app: FastAPI):
     if not grid_fs_bucket:
         raise RuntimeError("❌ Failed to initialize GridFS bucket.")
     app.state.grid_fs_bucket = grid_fs_bucket
+    # Models load and warm up in the background; /health/ready reports 503 until they are hot
+    app.state.models_task = asyncio.create_task(asyncio.to_thread(face_embedding.init_models))
+    app.state.embedding_db = AsyncFaceEmbeddingsDB.pooled()
+    await app.state.embedding_db.ensure_indexes()
+    # Load the in-memory gallery up front and follow writes made by other workers
+    app.state.gallery_sync = GallerySync(app.state.embedding_db)
+    await app.state.gallery_sync.start()
+    app.state.inference_executor = InferenceExecutor()
+    # Verify responses are served from cached profile projections; Student writes evict them
+    app.state.profile_cache = StudentProfileCache()
+    add_student_change_listener(app.state.profile_cache.invalidate)
+    # Other workers' Student writes reach the cache through a change stream where
+    # the gallery has one; otherwise entries expire after the cache TTL
+    app.state.profile_cache_task = None
+    if app.state.gallery_sync.mode == "change_stream":
+        app.state.profile_cache_task = asyncio.create_task(app.state.profile_cache.follow())
     yield
     print("🛑 App is shutting down")
+    remove_student_change_listener(app.state.profile_cache.invalidate)
+    if app.state.profile_cache_task is not None:
+        app.state.profile_cache_task.cancel()
+    await app.state.gallery_sync.stop()
+    app.state.inference_executor.shutdown()
+    app.state.embedding_db.close()
+    face_embedding.shutdown_models()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -33,6 +63,57 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Upper bound on probe images accepted by /students/verify/batch
+MAX_BATCH_VERIFY_IMAGES = 32
+
+
+def student_summary(student: Union[Student, StudentProfile]) -> dict:
+    """Fields returned to the client for a verified student."""
+    return {
+        "full_name": student.full_name,
+        "program": student.program,
+        "hall_of_residence": student.hall_of_residence,
+        "matriculation_number": student.matriculation_number,
+        "level": student.level,
+        "room_details": student.room_details
+    }
+
+def require_models_ready():
+    if not face_embedding.models_ready():
+        raise HTTPException(status_code=503, detail="Face models are still loading", headers={"Retry-After": "5"})
+
+
+async def require_gallery_fresh(request: Request):
+    if not await request.app.state.gallery_sync.ensure_fresh():
+        raise HTTPException(status_code=503, detail="Face gallery is out of date", headers={"Retry-After": "5"})
+
+
+def parse_face_hint(face_box: Optional[str], face_landmarks: Optional[str]):
+    """Parse the optional JSON face box ([x1, y1, x2, y2]) and landmarks ([[x, y] * 5]) form fields."""
+    try:
+        box = json.loads(face_box) if face_box else None
+        landmarks = json.loads(face_landmarks) if face_landmarks else None
+        if box is not None:
+            box = np.asarray(box, dtype=np.float32)
+            if box.shape != (4,) or not np.isfinite(box).all() or box[2] <= box[0] or box[3] <= box[1]:
+                raise ValueError("face_box must be [x1, y1, x2, y2]")
+        if landmarks is not None:
+            landmarks = np.asarray(landmarks, dtype=np.float32)
+            if landmarks.shape != (5, 2) or not np.isfinite(landmarks).all():
+                raise ValueError("face_landmarks must be five [x, y] points")
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid face hint: {str(e)}")
+    return box, landmarks
+
+
+async def compute_embedding(request: Request, image_bytes: bytes, face_crop: bool, face_box: Optional[str], face_landmarks: Optional[str]):
+    """Embed an upload, skipping MTCNN when the client sent a face crop or a face box."""
+    executor = request.app.state.inference_executor
+    if face_crop or face_box:
+        box, landmarks = parse_face_hint(face_box, face_landmarks)
+        return await executor.embedding_from_crop_bytes(image_bytes, box, landmarks)
+    return await executor.embedding_from_bytes(image_bytes)
+
 # ---------- 📌 ROUTES ---------- #
 
 @app.post("/students/create", tags=["Students"])
@@ -47,8 +128,12 @@ async def create_student(
     gender: Literal["male", "female"] = Form(...),
     hall_of_residence: str = Form(...),
     level: Literal["100", "200", "300", "400", "500"] = Form(...),
-    profile_image: UploadFile = File(...)
+    profile_image: UploadFile = File(...),
+    face_crop: bool = Form(False, description="profile_image is already a cropped face"),
+    face_box: Optional[str] = Form(None, description="JSON [x1, y1, x2, y2] face box in profile_image"),
+    face_landmarks: Optional[str] = Form(None, description="JSON five [x, y] facial landmarks")
 ):
+    require_models_ready()
     try:
         grid_fs_bucket = request.app.state.grid_fs_bucket
 
@@ -60,20 +145,18 @@ async def create_student(
         gridfs_file_id = await grid_fs_bucket.upload_from_stream(profile_image.filename, image_bytes)
         print(f"Image saved with ID: {gridfs_file_id}")
 
-        np_arr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-
-        embedding = face_embeddings.get_embedding_from_image(img)
+        decoded, embedding = await compute_embedding(request, image_bytes, face_crop, face_box, face_landmarks)
+        if not decoded:
+            raise HTTPException(status_code=400, detail="Invalid image file")
         if embedding is None:
             raise HTTPException(status_code=400, detail="Failed to extract face embedding from image")
 
-        registrar = FaceRegistrar()
-        success = registrar.register_face(
+        registrar = AsyncFaceRegistrar(db=request.app.state.embedding_db)
+        success = await registrar.register_face(
             person_id=matriculation_number,
             embedding=embedding,
             image_path=profile_image.filename
         )
-        registrar.close()
 
         if not success:
             raise HTTPException(status_code=500, detail="Failed to save face embedding")
@@ -102,50 +185,150 @@ async def create_student(
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
+@app.post("/students/bulk-create", tags=["Students"])
+async def bulk_create_students(
+    request: Request,
+    archive: UploadFile = File(..., description="Zip of profile images plus manifest.csv or manifest.jsonl")
+):
+    require_models_ready()
+    try:
+        report = await enroll_archive(
+            archive.file,
+            grid_fs_bucket=request.app.state.grid_fs_bucket,
+            executor=request.app.state.inference_executor,
+            embedding_db=request.app.state.embedding_db,
+        )
+        return report
+
+    except (zipfile.BadZipFile, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid archive: {str(e)}")
+    except Exception as e:
+        print(f"Error during bulk enrollment: {e}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
 @app.post("/students/verify", tags=["Students"])
 async def verify_student_face(
     request: Request,
     profile_image: UploadFile = File(...),
-    threshold: float = 0.7
+    threshold: float = 0.7,
+    face_crop: bool = Form(False, description="profile_image is already a cropped face"),
+    face_box: Optional[str] = Form(None, description="JSON [x1, y1, x2, y2] face box in profile_image"),
+    face_landmarks: Optional[str] = Form(None, description="JSON five [x, y] facial landmarks")
 ):
+    require_models_ready()
     try:
         grid_fs_bucket = request.app.state.grid_fs_bucket
 
         image_bytes = await profile_image.read()
-        np_arr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        if img is None:
+        decoded, embedding = await compute_embedding(request, image_bytes, face_crop, face_box, face_landmarks)
+        if not decoded:
             raise HTTPException(status_code=400, detail="Invalid image file")
-
-        embedding = face_embeddings.get_embedding_from_image(img)
         if embedding is None:
             raise HTTPException(status_code=400, detail="Failed to extract face embedding")
 
-        verifier = FaceVerifier()
-        matched_id = verifier.verify_face(embedding, threshold=threshold)
-        verifier.close()
+        await require_gallery_fresh(request)
+        verifier = AsyncFaceVerifier(db=request.app.state.embedding_db)
+        matched_id = await verifier.verify_face(embedding, threshold=threshold)
 
         if not matched_id:
             return {"message": "No matching student found"}
 
-        student = await Student.find_one(Student.matriculation_number == matched_id)
+        student = await request.app.state.profile_cache.get(matched_id)
         if not student:
             raise HTTPException(status_code=404, detail="Matched student not found in database")
 
         return {
             "message": "Student verified successfully",
-            "student": {
-                "full_name": student.full_name,
-                "program": student.program,
-                "hall_of_residence": student.hall_of_residence,
-                "matriculation_number": student.matriculation_number,
-                "level": student.level,
-                "room_details": student.room_details
-            }
+            "student": student_summary(student)
         }
 
     except HTTPException:
         raise
     except Exception as e:
         print(f"Error during verification: {e}")
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+@app.post("/students/verify/batch", tags=["Students"])
+async def verify_student_faces_batch(
+    request: Request,
+    profile_images: List[UploadFile] = File(...),
+    threshold: float = 0.7
+):
+    if len(profile_images) > MAX_BATCH_VERIFY_IMAGES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_VERIFY_IMAGES} images per batch")
+
+    require_models_ready()
+    try:
+        images = [await profile_image.read() for profile_image in profile_images]
+        outputs = await request.app.state.inference_executor.embeddings_from_bytes_batch(images)
+
+        probes = [i for i, (_, embedding) in enumerate(outputs) if embedding is not None]
+        await require_gallery_fresh(request)
+        verifier = AsyncFaceVerifier(db=request.app.state.embedding_db)
+        matches = await verifier.verify_faces(
+            np.stack([outputs[i][1] for i in probes]) if probes else np.empty((0, 512), dtype=np.float32),
+            threshold=threshold
+        )
+        matched = dict(zip(probes, matches))
+
+        matched_ids = {match[0] for match in matches if match is not None}
+        students = await request.app.state.profile_cache.get_many(matched_ids)
+
+        results = []
+        for i, (profile_image, (decoded, embedding)) in enumerate(zip(profile_images, outputs)):
+            result = {"index": i, "filename": profile_image.filename}
+            match = matched.get(i)
+            if not decoded:
+                result["status"] = "invalid_image"
+            elif embedding is None:
+                result["status"] = "no_face"
+            elif match is None:
+                result["status"] = "no_match"
+            elif match[0] not in students:
+                result["status"] = "student_not_found"
+                result["matriculation_number"] = match[0]
+            else:
+                result["status"] = "verified"
+                result["similarity"] = match[1]
+                result["student"] = student_summary(students[match[0]])
+            results.append(result)
+
+        return {
+            "verified": sum(result["status"] == "verified" for result in results),
+            "results": results
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error during batch verification: {e}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+@app.get("/health/live", tags=["Health"])
+async def liveness():
+    return {"status": "alive"}
+
+
+@app.get("/health/ready", tags=["Health"])
+async def readiness():
+    models_task = app.state.models_task
+    if models_task.done() and models_task.exception() is not None:
+        return JSONResponse(status_code=503, content={"status": "failed", "detail": str(models_task.exception())})
+    if not face_embedding.models_ready():
+        return JSONResponse(status_code=503, content={"status": "loading"})
+    return {"status": "ready"}
+
+
+@app.get("/metrics", tags=["Metrics"])
+async def get_metrics():
+    return {
+        "embedding_batching": face_embedding.scheduler.stats() if face_embedding.models_ready() else {},
+        "inference_executor": app.state.inference_executor.stats(),
+        "embedding_cache": app.state.inference_executor.cache.stats() if app.state.inference_executor.cache else {},
+        "embedding_store_pool": app.state.embedding_db.pool_stats(),
+        "student_profile_cache": app.state.profile_cache.stats(),
+        "gallery_sync": app.state.gallery_sync.stats(),
+    }
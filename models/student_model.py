@@ -1,9 +1,30 @@
-
-from beanie import Document, PydanticObjectId as ObjectId, Indexed
-from typing import Optional
-from pydantic import EmailStr, Field
+from beanie import Document, PydanticObjectId as ObjectId, Indexed, after_event, Insert, Replace, Save, SaveChanges, Update, Delete
+from typing import Callable, List, Optional
+from pydantic import BaseModel, EmailStr, Field
 from typing import Literal
 
+# Callbacks notified with a matriculation number after a Student document is
+# written or deleted through Beanie (bulk insert_many does not fire events)
+_student_change_listeners: List[Callable[[str], None]] = []
+
+
+def add_student_change_listener(listener: Callable[[str], None]):
+    if listener not in _student_change_listeners:
+        _student_change_listeners.append(listener)
+
+
+def remove_student_change_listener(listener: Callable[[str], None]):
+    if listener in _student_change_listeners:
+        _student_change_listeners.remove(listener)
+
+
+def notify_student_change(matriculation_number: str):
+    for listener in list(_student_change_listeners):
+        try:
+            listener(matriculation_number)
+        except Exception as e:
+            print(f"Student change listener failed: {e}")
+
 
 class Student(Document):
     full_name: str = Field(..., example="John Doe")
@@ -19,5 +40,19 @@ class Student(Document):
     profile_image: ObjectId =Field(..., description="ID of the image stored in GridFS")  # GridFS file id
     face_embedding_id: Optional[str] = None  # MongoDB ObjectId as string
 
+    @after_event(Insert, Replace, Save, SaveChanges, Update, Delete)
+    def _notify_change(self):
+        notify_student_change(self.matriculation_number)
+
     class Settings:
         name = "students"
+
+
+class StudentProfile(BaseModel):
+    """Projection of Student onto the fields returned by the verify endpoints."""
+    full_name: str
+    program: str
+    hall_of_residence: str
+    matriculation_number: str
+    level: str
+    room_details: str
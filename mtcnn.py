@@ -2,9 +2,25 @@ import torch
 from torch import nn
 import numpy as np
 import os
+from PIL import Image
 
 from .utils.detect_face import detect_face, extract_face
 
+# Local directory holding pnet.pt, rnet.pt and onet.pt
+WEIGHTS_DIR = os.getenv("MTCNN_WEIGHTS_DIR", os.path.join(os.path.dirname(__file__), '../data'))
+
+
+def load_weights_file(path):
+    """Load a state dict from a local file, memory-mapped when the file format allows it.
+
+    Memory-mapped tensors are backed by the page cache, so processes loading the same file
+    share its pages until a tensor is written to. Legacy (non-zip) checkpoints are read normally.
+    """
+    try:
+        return torch.load(path, map_location='cpu', mmap=True, weights_only=True)
+    except RuntimeError:
+        return torch.load(path, map_location='cpu', weights_only=True)
+
 
 class PNet(nn.Module):
     """MTCNN PNet.
@@ -30,9 +46,9 @@ class PNet(nn.Module):
         self.training = False
 
         if pretrained:
-            state_dict_path = os.path.join(os.path.dirname(__file__), '../data/pnet.pt')
-            state_dict = torch.load(state_dict_path)
-            self.load_state_dict(state_dict)
+            state_dict_path = os.path.join(WEIGHTS_DIR, 'pnet.pt')
+            state_dict = load_weights_file(state_dict_path)
+            self.load_state_dict(state_dict, assign=True)
 
     def forward(self, x):
         x = self.conv1(x)
@@ -75,9 +91,9 @@ class RNet(nn.Module):
         self.training = False
 
         if pretrained:
-            state_dict_path = os.path.join(os.path.dirname(__file__), '../data/rnet.pt')
-            state_dict = torch.load(state_dict_path)
-            self.load_state_dict(state_dict)
+            state_dict_path = os.path.join(WEIGHTS_DIR, 'rnet.pt')
+            state_dict = load_weights_file(state_dict_path)
+            self.load_state_dict(state_dict, assign=True)
 
     def forward(self, x):
         x = self.conv1(x)
@@ -128,9 +144,9 @@ class ONet(nn.Module):
         self.training = False
 
         if pretrained:
-            state_dict_path = os.path.join(os.path.dirname(__file__), '../data/onet.pt')
-            state_dict = torch.load(state_dict_path)
-            self.load_state_dict(state_dict)
+            state_dict_path = os.path.join(WEIGHTS_DIR, 'onet.pt')
+            state_dict = load_weights_file(state_dict_path)
+            self.load_state_dict(state_dict, assign=True)
 
     def forward(self, x):
         x = self.conv1(x)
@@ -192,12 +208,26 @@ class MTCNN(nn.Module):
             (default: {False})
         device {torch.device} -- The device on which to run neural net passes. Image tensors and
             models are copied to this device before running forward passes. (default: {None})
+        bucket_aspect_step {float} -- When a list of differently sized images is passed, images are
+            grouped into buckets whose aspect ratios and sizes differ by at most this factor, padded
+            to a common canvas and detected as one batch per bucket. (default: {1.25})
+        bucket_max_batch {int} -- Maximum number of images padded into a single batch.
+            (default: {16})
+        detect_max_side {int} -- If set, images whose longer side exceeds this are downscaled to
+            a proxy of this size for the P-, R- and O-net passes. Boxes and landmarks are mapped
+            back to the original resolution, and faces are still cropped from the original image.
+            (default: {None})
+        min_face_fraction {float} -- If set, the smallest expected face as a fraction of the
+            image's shorter side. Images are downscaled so that such a face still spans
+            2 * min_face_size pixels in the proxy. If both bounds are set, the larger proxy is used.
+            (default: {None})
     """
 
     def __init__(
         self, image_size=160, margin=0, min_face_size=20,
         thresholds=[0.6, 0.7, 0.7], factor=0.709, post_process=True,
-        select_largest=True, selection_method=None, keep_all=False, device=None
+        select_largest=True, selection_method=None, keep_all=False, device=None,
+        bucket_aspect_step=1.25, bucket_max_batch=16, detect_max_side=None, min_face_fraction=None
     ):
         super().__init__()
 
@@ -210,6 +240,10 @@ class MTCNN(nn.Module):
         self.select_largest = select_largest
         self.keep_all = keep_all
         self.selection_method = selection_method
+        self.bucket_aspect_step = bucket_aspect_step
+        self.bucket_max_batch = bucket_max_batch
+        self.detect_max_side = detect_max_side
+        self.min_face_fraction = min_face_fraction
 
         self.pnet = PNet()
         self.rnet = RNet()
@@ -310,12 +344,12 @@ class MTCNN(nn.Module):
         """
 
         with torch.no_grad():
-            batch_boxes, batch_points = detect_face(
-                img, self.min_face_size,
-                self.pnet, self.rnet, self.onet,
-                self.thresholds, self.factor,
-                self.device
-            )
+            proxies, scales = self._proxy_images(img)
+            if proxies is None:
+                batch_boxes, batch_points = self._detect_faces(img)
+            else:
+                batch_boxes, batch_points = self._detect_faces(proxies)
+                batch_boxes, batch_points = _rescale_detections(batch_boxes, batch_points, scales)
 
         boxes, probs, points = [], [], []
         for box, point in zip(batch_boxes, batch_points):
@@ -354,6 +388,112 @@ class MTCNN(nn.Module):
 
         return boxes, probs
 
+    def _detect_faces(self, img):
+        """Run detect_face, bucketing lists of differently sized images."""
+        if isinstance(img, (list, tuple)) and len({_image_hw(im) for im in img}) > 1:
+            return self._detect_bucketed(img)
+        return detect_face(
+            img, self.min_face_size,
+            self.pnet, self.rnet, self.onet,
+            self.thresholds, self.factor,
+            self.device
+        )
+
+    def _proxy_scale(self, h, w):
+        """Downscale factor for detecting faces in an h x w image (1.0 means full resolution)."""
+        scales = []
+        if self.detect_max_side:
+            scales.append(self.detect_max_side / max(h, w))
+        if self.min_face_fraction:
+            scales.append(2 * self.min_face_size / (self.min_face_fraction * min(h, w)))
+        return min(1.0, max(scales)) if scales else 1.0
+
+    def _proxy_images(self, img):
+        """Build downscaled detection proxies for images above the detection resolution cap.
+
+        Returns:
+            tuple -- (proxies, scales), where proxies is a 4D uint8 array when all proxies share
+                a size and a list otherwise, and scales holds the per-image (y, x) factors that
+                map original coordinates to proxy coordinates. (None, None) when no image needs
+                downscaling.
+        """
+        if not self.detect_max_side and not self.min_face_fraction:
+            return None, None
+        if isinstance(img, (list, tuple)) or (isinstance(img, (np.ndarray, torch.Tensor)) and len(img.shape) == 4):
+            imgs = list(img)
+        else:
+            imgs = [img]
+
+        sizes = [_image_hw(im) for im in imgs]
+        factors = [self._proxy_scale(h, w) for h, w in sizes]
+        if all(factor >= 1.0 for factor in factors):
+            return None, None
+
+        proxies, scales = [], []
+        for im, (h, w), factor in zip(imgs, sizes, factors):
+            proxy = _downscale(im, factor) if factor < 1.0 else _as_uint8_array(im)
+            scales.append((proxy.shape[0] / h, proxy.shape[1] / w))
+            proxies.append(proxy)
+        if len({proxy.shape for proxy in proxies}) == 1:
+            proxies = np.stack(proxies)
+        return proxies, scales
+
+    def _detect_bucketed(self, imgs):
+        """Run detect_face on a list of differently sized images.
+
+        Images are bucketed by aspect ratio and size, zero-padded at the bottom/right to the
+        largest height and width in their bucket, and each bucket is detected as one 4D batch,
+        so the P-, R- and O-net passes run once per bucket instead of once per image. Padding
+        does not move image coordinates, so boxes map back to the originals unchanged; detections
+        centred in an image's padded region are discarded using its valid-area mask.
+
+        Arguments:
+            imgs {list} -- PIL images, HxWx3 uint8 numpy arrays or torch tensors.
+
+        Returns:
+            tuple(list, list) -- Per-image boxes (Nx5, last column is probability) and landmarks,
+                in the same format as detect_face.
+        """
+        arrays = [_as_uint8_array(im) for im in imgs]
+        step = np.log(self.bucket_aspect_step)
+        buckets = {}
+        for i, arr in enumerate(arrays):
+            h, w = arr.shape[:2]
+            key = (int(round(np.log(w / h) / step)), int(round(np.log(max(h, w)) / step)))
+            buckets.setdefault(key, []).append(i)
+
+        batch_boxes = [None] * len(arrays)
+        batch_points = [None] * len(arrays)
+        for indices in buckets.values():
+            for start in range(0, len(indices), self.bucket_max_batch):
+                chunk = indices[start:start + self.bucket_max_batch]
+                sizes = np.array([arrays[i].shape[:2] for i in chunk])
+                canvas_h, canvas_w = sizes.max(axis=0)
+                canvas = np.zeros((len(chunk), canvas_h, canvas_w, 3), dtype=np.uint8)
+                for j, i in enumerate(chunk):
+                    h, w = sizes[j]
+                    canvas[j, :h, :w] = arrays[i]
+
+                boxes, points = detect_face(
+                    canvas, self.min_face_size, self.pnet, self.rnet, self.onet,
+                    self.thresholds, self.factor, self.device
+                )
+
+                for j, i in enumerate(chunk):
+                    box = np.array(boxes[j])
+                    point = np.array(points[j])
+                    if len(box):
+                        h, w = sizes[j]
+                        centre_x = (box[:, 0] + box[:, 2]) / 2
+                        centre_y = (box[:, 1] + box[:, 3]) / 2
+                        valid = (centre_x < w) & (centre_y < h)
+                        box = box[valid]
+                        point = point[valid]
+                    batch_boxes[i] = box
+                    batch_points[i] = point
+
+        return batch_boxes, batch_points
+
     def select_boxes(
         self, all_boxes, all_probs, all_points, imgs, method='probability', threshold=0.9,
         center_weight=2.0
@@ -505,6 +645,43 @@ class MTCNN(nn.Module):
         return faces
 
 
+def _image_hw(img):
+    """(height, width) of a PIL image, HxWx3 numpy array or torch tensor."""
+    if isinstance(img, (np.ndarray, torch.Tensor)):
+        return tuple(img.shape[:2])
+    return (img.height, img.width)
+
+
+def _as_uint8_array(img):
+    if isinstance(img, torch.Tensor):
+        img = img.cpu().numpy()
+    return np.asarray(img, dtype=np.uint8)
+
+
+def _downscale(img, factor):
+    """Box-filter downscale of a PIL image, numpy array or tensor to a uint8 HxWx3 array."""
+    if not isinstance(img, Image.Image):
+        img = Image.fromarray(_as_uint8_array(img))
+    size = (max(1, int(round(img.width * factor))), max(1, int(round(img.height * factor))))
+    return np.asarray(img.resize(size, Image.BOX, reducing_gap=3.0))
+
+
+def _rescale_detections(batch_boxes, batch_points, scales):
+    """Map boxes and landmarks detected on proxies back to original image coordinates."""
+    boxes_out, points_out = [], []
+    for box, point, (scale_y, scale_x) in zip(batch_boxes, batch_points, scales):
+        box = np.array(box, dtype=np.float32)
+        point = np.array(point, dtype=np.float32)
+        if len(box):
+            box[:, [0, 2]] /= scale_x
+            box[:, [1, 3]] /= scale_y
+            point[..., 0] /= scale_x
+            point[..., 1] /= scale_y
+        boxes_out.append(box)
+        points_out.append(point)
+    return boxes_out, points_out
+
+
 def fixed_image_standardization(image_tensor):
     processed_tensor = (image_tensor - 127.5) / 128.0
     return processed_tensor
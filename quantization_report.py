@@ -0,0 +1,134 @@
+"""
+Compare fp32 and int8 InceptionResnetV1 on the evaluation dataset.
+
+Faces are detected once and embedded with both models. Each model gets its
+own in-memory gallery built from the reg.jpg images, and the genuine/impostor
+probes from evaluation.py are scored against it. The report shows the
+accuracy delta, the fp32/int8 embedding agreement and the forward speedup.
+
+Usage:
+    python quantization_report.py [--mode int8|dynamic] [--calibration-dir calibration_faces]
+"""
+import argparse
+import os
+import time
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+import face_embedding
+from quantization import build_quantized_model
+
+DATASET_PATH = "evaluation_dataset"
+THRESHOLD = 0.7
+BATCH_SIZE = 16
+TIMING_REPEATS = 5
+
+
+def load_faces(dataset_path: str):
+    """Return (gallery faces by student_id, probe faces as (expected_id or None, face))."""
+    gallery, probes = {}, []
+    for student_id in sorted(os.listdir(dataset_path)):
+        student_path = os.path.join(dataset_path, student_id)
+        if not os.path.isdir(student_path):
+            continue
+        for img_name in sorted(os.listdir(student_path)):
+            img = cv2.imread(os.path.join(student_path, img_name))
+            if img is None:
+                continue
+            face = face_embedding.mtcnn(Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB)))
+            if face is None:
+                continue
+            if student_id == "impostors":
+                probes.append((None, face))
+            elif img_name == "reg.jpg":
+                gallery[student_id] = face
+            else:
+                probes.append((student_id, face))
+    return gallery, probes
+
+
+def embed(model, faces):
+    with torch.no_grad():
+        return np.concatenate([
+            model(torch.stack(faces[start:start + BATCH_SIZE])).numpy()
+            for start in range(0, len(faces), BATCH_SIZE)
+        ])
+
+
+def forward_ms(model, faces):
+    """Mean milliseconds per face for batched forwards, after one warm-up pass."""
+    embed(model, faces)
+    start = time.perf_counter()
+    for _ in range(TIMING_REPEATS):
+        embed(model, faces)
+    return (time.perf_counter() - start) * 1000 / (TIMING_REPEATS * len(faces))
+
+
+def score(gallery_ids, gallery_embeddings, probe_ids, probe_embeddings, threshold):
+    similarities = probe_embeddings @ gallery_embeddings.T
+    best = similarities.argmax(axis=1)
+    best_scores = similarities[np.arange(len(best)), best]
+    predicted = [gallery_ids[i] if s >= threshold else None for i, s in zip(best, best_scores)]
+
+    tp = sum(expected is not None and p == expected for expected, p in zip(probe_ids, predicted))
+    fn = sum(expected is not None and p != expected for expected, p in zip(probe_ids, predicted))
+    fp = sum(expected is None and p is not None for expected, p in zip(probe_ids, predicted))
+    tn = sum(expected is None and p is None for expected, p in zip(probe_ids, predicted))
+    precision = tp / (tp + fp + 1e-6)
+    recall = tp / (tp + fn + 1e-6)
+    return {
+        "accuracy": (tp + tn) / max(tp + fn + fp + tn, 1),
+        "precision": precision,
+        "recall": recall,
+        "f1": 2 * precision * recall / (precision + recall + 1e-6),
+        "predicted": predicted,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="fp32 vs quantized InceptionResnetV1 on the evaluation dataset.")
+    parser.add_argument("--dataset", default=DATASET_PATH)
+    parser.add_argument("--mode", choices=["int8", "dynamic"], default="int8")
+    parser.add_argument("--calibration-dir", default="calibration_faces")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    args = parser.parse_args()
+
+    face_embedding.init_models(warmup=False)
+    fp32_model = face_embedding.load_facenet()
+    quantized_model = build_quantized_model(fp32_model, args.mode, args.calibration_dir, face_embedding.mtcnn)
+
+    gallery, probes = load_faces(args.dataset)
+    gallery_ids = list(gallery)
+    gallery_faces = [gallery[student_id] for student_id in gallery_ids]
+    probe_ids = [expected for expected, _ in probes]
+    probe_faces = [face for _, face in probes]
+    all_faces = gallery_faces + probe_faces
+    if not gallery_faces or not probe_faces:
+        raise SystemExit(f"❌ No gallery or probe faces found under {args.dataset}")
+
+    results = {}
+    embeddings = {}
+    for name, model in (("fp32", fp32_model), (args.mode, quantized_model)):
+        emb = embed(model, all_faces)
+        embeddings[name] = emb
+        results[name] = score(gallery_ids, emb[:len(gallery_faces)], probe_ids, emb[len(gallery_faces):], args.threshold)
+        results[name]["ms_per_face"] = forward_ms(model, all_faces)
+
+    fp32, quant = results["fp32"], results[args.mode]
+    cosine = np.sum(embeddings["fp32"] * embeddings[args.mode], axis=1)
+    changed = sum(a != b for a, b in zip(fp32["predicted"], quant["predicted"]))
+
+    print(f"\n--- fp32 vs {args.mode} ({len(gallery_faces)} identities, {len(probe_faces)} probes) ---")
+    for metric in ("accuracy", "precision", "recall", "f1"):
+        print(f"{metric:<10} fp32: {fp32[metric]:.2%}  {args.mode}: {quant[metric]:.2%}  delta: {quant[metric] - fp32[metric]:+.2%}")
+    print(f"🔁 Changed decisions: {changed}/{len(probe_faces)}")
+    print(f"📐 Embedding cosine fp32 vs {args.mode}: mean {cosine.mean():.5f}, min {cosine.min():.5f}")
+    print(
+        f"⏱️ Forward: fp32 {fp32['ms_per_face']:.2f} ms/face, {args.mode} {quant['ms_per_face']:.2f} ms/face "
+        f"(speedup x{fp32['ms_per_face'] / quant['ms_per_face']:.2f}, {torch.get_num_threads()} threads)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""
+Pre-fork server: load the face models once, then fork uvicorn workers that share them.
+
+The parent loads MTCNN and InceptionResnetV1 before forking, so every worker
+reads the same parameter pages (copy-on-write, or explicit shared memory with
+--share shm) instead of loading its own copy. Workers accept connections on
+one socket bound by the parent. Each worker is pinned to its own slice of the
+physical cores and sizes its torch / OpenCV thread pools to that slice, so
+workers do not oversubscribe the machine.
+
+Usage (POSIX only):
+    python serve.py [--host 0.0.0.0] [--port 8000] [--workers 4] [--share cow|shm]
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict, List
+
+import torch
+
+# Parse "0-3,8,10-11" style CPU lists from sysfs
+def _parse_cpu_list(text: str) -> List[int]:
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-")
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def _read(path: str) -> str:
+    with open(path) as f:
+        return f.read()
+
+
+def physical_cores() -> List[List[int]]:
+    """
+    Usable physical cores as lists of their logical CPUs (SMT siblings),
+    ordered by socket and core so that neighbouring cores share a socket.
+    Falls back to one logical CPU per core where sysfs topology is missing.
+    """
+    allowed = sorted(os.sched_getaffinity(0))
+    cores: Dict[tuple, List[int]] = {}
+    for cpu in allowed:
+        topology = f"/sys/devices/system/cpu/cpu{cpu}/topology"
+        try:
+            package = int(_read(f"{topology}/physical_package_id"))
+            siblings_file = f"{topology}/core_cpus_list"
+            if not os.path.exists(siblings_file):
+                siblings_file = f"{topology}/thread_siblings_list"
+            siblings = [c for c in _parse_cpu_list(_read(siblings_file)) if c in allowed]
+        except (OSError, ValueError):
+            package, siblings = 0, [cpu]
+        cores.setdefault((package, min(siblings)), siblings)
+    return [cores[key] for key in sorted(cores)]
+
+
+def plan_workers(workers: int, cores: List[List[int]]) -> List[List[List[int]]]:
+    """
+    Split the physical cores into `workers` contiguous slices whose sizes
+    differ by at most one. With more workers than cores, cores are shared
+    round-robin and every worker gets one.
+    """
+    if workers <= len(cores):
+        base, extra = divmod(len(cores), workers)
+        plan, start = [], 0
+        for i in range(workers):
+            size = base + (1 if i < extra else 0)
+            plan.append(cores[start:start + size])
+            start += size
+        return plan
+    return [[cores[i % len(cores)]] for i in range(workers)]
+
+
+def share_models(share: str) -> int:
+    """
+    Freeze the loaded models for sharing with forked workers; returns the shared parameter bytes.
+
+    "cow" relies on copy-on-write after fork: parameters are never written
+    (no grads, eval mode) so their pages stay shared. "shm" additionally moves
+    parameters and buffers into shared memory, which keeps them shared even
+    if a worker's allocator would otherwise touch the pages.
+    """
+    import face_embedding
+
+    modules = [face_embedding.facenet, face_embedding.mtcnn]
+    shared_bytes = 0
+    for module in modules:
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            tensor.requires_grad_(False)
+            if share == "shm":
+                try:
+                    tensor.share_memory_()
+                except RuntimeError as e:
+                    print(f"⚠️ Tensor left in private memory: {e}")
+                    continue
+            shared_bytes += tensor.numel() * tensor.element_size()
+    return shared_bytes
+
+
+def _configure_worker(cores: List[List[int]]):
+    cpus = sorted(cpu for core in cores for cpu in core)
+    threads = max(1, len(cores))
+    os.sched_setaffinity(0, cpus)
+    torch.set_num_threads(threads)
+    try:
+        import cv2
+        cv2.setNumThreads(threads)
+    except ImportError:
+        pass
+    return cpus, threads
+
+
+def _run_worker(index: int, cores: List[List[int]], sock: socket.socket, args) -> int:
+    import uvicorn
+    import face_embedding
+    from main import app
+
+    cpus, threads = _configure_worker(cores)
+    print(f"👷 Worker {index} (pid {os.getpid()}): CPUs {cpus}, {threads} torch threads")
+    face_embedding.warm_up_models()
+    config = uvicorn.Config(app, log_level=args.log_level, timeout_keep_alive=args.keep_alive)
+    uvicorn.Server(config).run(sockets=[sock])
+    return 0
+
+
+def _fork_worker(index: int, cores: List[List[int]], sock: socket.socket, args) -> int:
+    pid = os.fork()
+    if pid == 0:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        code = 1
+        try:
+            code = _run_worker(index, cores, sock, args)
+        except BaseException as e:
+            print(f"❌ Worker {index} failed: {e}")
+        finally:
+            os._exit(code)
+    return pid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the API from pre-forked workers that share one copy of the models.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=0, help="Worker processes (default: one per 2 physical cores)")
+    parser.add_argument("--share", choices=["cow", "shm"], default="cow")
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--keep-alive", type=int, default=5)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    if not hasattr(os, "fork"):
+        sys.exit("serve.py needs os.fork(); use `uvicorn main:app` on this platform")
+    if os.getenv("FACE_EXECUTOR_MODE", "thread") == "process":
+        print("⚠️ FACE_EXECUTOR_MODE=process loads a private model copy per executor process; use thread mode here")
+
+    cores = physical_cores()
+    workers = args.workers or max(1, len(cores) // 2)
+    plan = plan_workers(workers, cores)
+
+    # GNU OpenMP thread pools do not survive fork, so the parent must never start one
+    torch.set_num_threads(1)
+    import face_embedding
+    start = time.perf_counter()
+    face_embedding.init_models(warmup=False)
+    shared_bytes = share_models(args.share)
+    print(
+        f"✅ Models loaded in the parent in {time.perf_counter() - start:.1f}s; "
+        f"{shared_bytes / 2**20:.1f} MB of parameters shared ({args.share}) by {workers} workers "
+        f"over {len(cores)} physical cores"
+    )
+    # Imported after the models, before forking, so workers inherit the loaded modules
+    import main as _  # noqa: F401
+    # Keep the collector from touching (and so copying) every object page after fork
+    gc.collect()
+    gc.freeze()
+
+    sock = socket.socket(socket.AF_INET6 if ":" in args.host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(args.backlog)
+    sock.set_inheritable(True)
+    print(f"🚀 Listening on {args.host}:{args.port}")
+
+    children: Dict[int, int] = {}
+    for index, cores_slice in enumerate(plan):
+        children[_fork_worker(index, cores_slice, sock, args)] = index
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # Replace workers that die until asked to stop; forks are cheap since the models are already loaded
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+        print(f"⚠️ Worker {index} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}, restarting")
+        time.sleep(1)
+        children[_fork_worker(index, plan[index], sock, args)] = index
+
+    sock.close()
+    print("🛑 All workers stopped")
+
+
+if __name__ == "__main__":
+    main()
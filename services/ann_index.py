@@ -0,0 +1,200 @@
+import numpy as np
+from typing import Dict, Optional, Tuple
+
+# Vectors assigned to cells per matrix product while building
+BUILD_BLOCK_ROWS = 65536
+
+
+class _InvertedList:
+    """Growable, contiguous storage for the rows assigned to one IVF cell."""
+
+    __slots__ = ("rows", "codes", "size")
+
+    def __init__(self, code_dim: int, capacity: int = 16):
+        self.rows = np.empty(capacity, dtype=np.int64)
+        self.codes = np.empty((capacity, code_dim), dtype=np.float32)
+        self.size = 0
+
+    def append(self, row: int, code: np.ndarray):
+        if self.size == len(self.rows):
+            capacity = 2 * len(self.rows)
+            rows = np.empty(capacity, dtype=np.int64)
+            rows[:self.size] = self.rows[:self.size]
+            codes = np.empty((capacity, self.codes.shape[1]), dtype=np.float32)
+            codes[:self.size] = self.codes[:self.size]
+            self.rows, self.codes = rows, codes
+        self.rows[self.size] = row
+        self.codes[self.size] = code
+        self.size += 1
+
+    def position(self, row: int) -> int:
+        return int(np.flatnonzero(self.rows[:self.size] == row)[0])
+
+    def remove_at(self, pos: int):
+        last = self.size - 1
+        self.rows[pos] = self.rows[last]
+        self.codes[pos] = self.codes[last]
+        self.size = last
+
+
+class IVFIndex:
+    """
+    Inverted-file approximate nearest-neighbour index over L2-normalized vectors.
+
+    Vectors are partitioned into `n_lists` cells by spherical k-means. A query
+    scans only the `nprobe` closest cells using low-dimensional PCA codes, then
+    the best `rerank_k` candidates are re-scored exactly against the full
+    float32 gallery matrix. Raising `nprobe`, `rerank_k` or `code_dim` trades
+    latency for recall.
+
+    The index stores gallery row numbers, not person ids; the owning
+    GalleryIndex keeps it in step with add/remove/move calls.
+    """
+
+    def __init__(
+        self,
+        dim: int = 512,
+        n_lists: Optional[int] = None,
+        nprobe: int = 8,
+        rerank_k: int = 256,
+        code_dim: int = 64,
+        train_iters: int = 10,
+        max_train_points: int = 50000,
+        seed: int = 0,
+    ):
+        self.dim = dim
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.rerank_k = rerank_k
+        self.code_dim = min(code_dim, dim)
+        self.train_iters = train_iters
+        self.max_train_points = max_train_points
+        self.seed = seed
+        self.trained_size = 0
+        self.centroids: Optional[np.ndarray] = None
+        self.projection: Optional[np.ndarray] = None
+        self._lists = []
+        self._assign: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._assign)
+
+    def _train(self, sample: np.ndarray, total: int):
+        """Fit cells and the PCA basis on `sample`, drawn from `total` vectors."""
+        rng = np.random.default_rng(self.seed)
+        n_lists = self.n_lists or int(max(1, round(4 * np.sqrt(total))))
+        n_lists = max(1, min(n_lists, len(sample)))
+
+        # Spherical k-means: centroids stay on the unit sphere so cell
+        # assignment is a single matrix product with the probe.
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(self.train_iters):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            # Per-cell sums accumulated in place; no (N, dim) temporaries
+            sums = np.zeros((n_lists, sample.shape[1]), dtype=np.float32)
+            np.add.at(sums, assign, sample)
+            norms = np.linalg.norm(sums, axis=1)
+            empty = norms == 0
+            if empty.any():
+                sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+                norms[empty] = np.linalg.norm(sums[empty], axis=1)
+            centroids = (sums / norms[:, None]).astype(np.float32)
+
+        # Uncentered PCA basis used for the compressed first-pass scan.
+        _, eigvecs = np.linalg.eigh((sample.T @ sample).astype(np.float64))
+        self.projection = np.ascontiguousarray(eigvecs[:, ::-1][:, :self.code_dim], dtype=np.float32)
+        self.centroids = centroids
+        self.trained_size = total
+
+    def build(self, vectors: np.ndarray, rows: Optional[np.ndarray] = None):
+        """Train the quantizer on `vectors` and add them as `rows` (default 0..N-1)."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.build_from(vectors, np.arange(len(vectors)), rows)
+
+    def build_from(self, matrix: np.ndarray, positions: np.ndarray, rows: Optional[np.ndarray] = None):
+        """
+        Train on and add the vectors matrix[positions] as `rows` (default: the
+        positions themselves). Vectors are gathered in blocks, so the matrix is
+        never copied whole.
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        rows = positions if rows is None else np.asarray(rows, dtype=np.int64)
+        rng = np.random.default_rng(self.seed)
+        train = positions
+        if len(positions) > self.max_train_points:
+            train = np.sort(rng.choice(positions, self.max_train_points, replace=False))
+        self._train(np.asarray(matrix[train], dtype=np.float32), len(positions))
+        self._lists = [_InvertedList(self.code_dim) for _ in range(len(self.centroids))]
+        self._assign = {}
+
+        for start in range(0, len(positions), BUILD_BLOCK_ROWS):
+            block = np.asarray(matrix[positions[start:start + BUILD_BLOCK_ROWS]], dtype=np.float32)
+            assign = np.argmax(block @ self.centroids.T, axis=1)
+            codes = block @ self.projection
+            for row, cell, code in zip(rows[start:start + BUILD_BLOCK_ROWS], assign, codes):
+                self._lists[cell].append(int(row), code)
+                self._assign[int(row)] = int(cell)
+
+    def add(self, row: int, vector: np.ndarray):
+        cell = int(np.argmax(self.centroids @ vector))
+        self._lists[cell].append(row, vector @ self.projection)
+        self._assign[row] = cell
+
+    def remove(self, row: int):
+        cell = self._assign.pop(row, None)
+        if cell is None:
+            return
+        lst = self._lists[cell]
+        lst.remove_at(lst.position(row))
+
+    def move(self, old_row: int, new_row: int):
+        cell = self._assign.pop(old_row, None)
+        if cell is None:
+            return
+        lst = self._lists[cell]
+        lst.rows[lst.position(old_row)] = new_row
+        self._assign[new_row] = cell
+
+    def search(
+        self,
+        query: np.ndarray,
+        matrix: np.ndarray,
+        k: int = 1,
+        nprobe: Optional[int] = None,
+        rerank_k: Optional[int] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the (rows, exact_scores) of the approximate top-k neighbours of `query`.
+
+        `matrix` is the owning gallery's normalized embedding matrix and is
+        only touched for the exact re-rank of the shortlist.
+        """
+        n_lists = len(self._lists)
+        nprobe = min(nprobe or self.nprobe, n_lists)
+        rerank_k = max(k, rerank_k or self.rerank_k)
+
+        cell_scores = self.centroids @ query
+        if nprobe < n_lists:
+            probe = np.argpartition(-cell_scores, nprobe - 1)[:nprobe]
+        else:
+            probe = np.arange(n_lists)
+
+        code = query @ self.projection
+        rows_parts, score_parts = [], []
+        for cell in probe:
+            lst = self._lists[cell]
+            if lst.size:
+                rows_parts.append(lst.rows[:lst.size])
+                score_parts.append(lst.codes[:lst.size] @ code)
+        if not rows_parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        rows = np.concatenate(rows_parts)
+        approx = np.concatenate(score_parts)
+        if len(rows) > rerank_k:
+            shortlist = np.argpartition(-approx, rerank_k - 1)[:rerank_k]
+            rows = rows[shortlist]
+
+        exact = matrix[rows] @ query
+        order = np.argsort(-exact)[:k]
+        return rows[order], exact[order]
@@ -0,0 +1,254 @@
+import asyncio
+import csv
+import io
+import json
+import os
+import zipfile
+from itertools import islice
+from typing import BinaryIO, Dict, Iterator, List, Literal, Optional, Tuple
+
+from pydantic import BaseModel, EmailStr, ValidationError
+from pymongo.errors import BulkWriteError
+
+from models.student_model import Student, notify_student_change
+from async_database_embedding import AsyncFaceEmbeddingsDB
+from database_embedding import DUPLICATE_KEY_ERROR
+from inference_executor import InferenceExecutor
+
+# Rows processed together: one batched detection/embedding call and one bulk write each
+BULK_CHUNK_SIZE = int(os.getenv("BULK_ENROLL_CHUNK_SIZE", "32"))
+# Archive members larger than this are rejected without being read
+MAX_IMAGE_BYTES = int(os.getenv("BULK_ENROLL_MAX_IMAGE_BYTES", str(15 * 1024 * 1024)))
+MANIFEST_NAMES = ("manifest.csv", "manifest.jsonl")
+
+
+class StudentManifestRow(BaseModel):
+    """One manifest row: the Student fields plus the image path inside the archive."""
+    full_name: str
+    email: EmailStr
+    program: str
+    matriculation_number: str
+    registration_number: str
+    room_details: str
+    gender: Literal["male", "female"]
+    hall_of_residence: str
+    level: Literal["100", "200", "300", "400", "500"]
+    image: str
+
+
+def _find_manifest(archive: zipfile.ZipFile) -> str:
+    for info in archive.infolist():
+        if os.path.basename(info.filename).lower() in MANIFEST_NAMES:
+            return info.filename
+    raise ValueError("Archive must contain a manifest.csv or manifest.jsonl file")
+
+
+def _iter_manifest_rows(archive: zipfile.ZipFile, manifest_name: str) -> Iterator[Tuple[int, Dict]]:
+    """Stream (row_number, raw_row) pairs without loading the whole manifest."""
+    with archive.open(manifest_name) as raw:
+        text = io.TextIOWrapper(raw, encoding="utf-8-sig")
+        if manifest_name.lower().endswith(".csv"):
+            for row_number, row in enumerate(csv.DictReader(text), start=1):
+                yield row_number, row
+        else:
+            row_number = 0
+            for line in text:
+                if not line.strip():
+                    continue
+                row_number += 1
+                try:
+                    obj = json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield row_number, {"__error__": f"Invalid JSON: {e}"}
+                    continue
+                if not isinstance(obj, dict):
+                    yield row_number, {"__error__": "Row must be a JSON object"}
+                else:
+                    yield row_number, obj
+
+
+def _read_images(archive: zipfile.ZipFile, base_dir: str, names: List[str]) -> List[Tuple[Optional[bytes], Optional[str]]]:
+    """Read archive members (paths relative to the manifest), returning (bytes, error) per name."""
+    images = []
+    for name in names:
+        try:
+            info = archive.getinfo(os.path.join(base_dir, name) if base_dir else name)
+        except KeyError:
+            images.append((None, f"Image '{name}' not found in archive"))
+            continue
+        if info.file_size > MAX_IMAGE_BYTES:
+            images.append((None, f"Image '{name}' exceeds {MAX_IMAGE_BYTES} bytes"))
+        else:
+            images.append((archive.read(info), None))
+    return images
+
+
+def _result(row_number: int, matriculation_number: Optional[str], status: str, detail: str = None) -> Dict:
+    result = {"row": row_number, "matriculation_number": matriculation_number, "status": status}
+    if detail:
+        result["detail"] = detail
+    return result
+
+
+async def _delete_files(grid_fs_bucket, file_ids: List) -> None:
+    """Best-effort removal of uploaded profile images that no student will reference."""
+    results = await asyncio.gather(*(grid_fs_bucket.delete(file_id) for file_id in file_ids), return_exceptions=True)
+    for file_id, result in zip(file_ids, results):
+        if isinstance(result, Exception):
+            print(f"⚠️ Could not delete orphaned profile image {file_id}: {result}")
+
+
+async def _enroll_chunk(
+    archive: zipfile.ZipFile,
+    base_dir: str,
+    chunk: List[Tuple[int, Dict]],
+    seen: set,
+    grid_fs_bucket,
+    executor: InferenceExecutor,
+    embedding_db: AsyncFaceEmbeddingsDB,
+) -> List[Dict]:
+    results: Dict[int, Dict] = {}
+    pending: List[Tuple[int, StudentManifestRow]] = []
+
+    # 1. Validate rows and drop duplicates within the archive
+    for row_number, raw in chunk:
+        matric = raw.get("matriculation_number")
+        if "__error__" in raw:
+            results[row_number] = _result(row_number, matric, "error", raw["__error__"])
+            continue
+        raw = dict(raw)
+        raw.setdefault("image", raw.pop("profile_image", None))
+        try:
+            row = StudentManifestRow(**raw)
+        except ValidationError as e:
+            problems = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+            results[row_number] = _result(row_number, matric, "error", f"Invalid row: {problems}")
+            continue
+        if row.matriculation_number in seen:
+            results[row_number] = _result(row_number, matric, "skipped", "Duplicate matriculation number in archive")
+            continue
+        seen.add(row.matriculation_number)
+        pending.append((row_number, row))
+
+    # 2. Skip students that already exist, with one $in query for the chunk
+    if pending:
+        existing = await Student.find(
+            {"matriculation_number": {"$in": [row.matriculation_number for _, row in pending]}}
+        ).to_list()
+        existing_ids = {student.matriculation_number for student in existing}
+        still_pending = []
+        for row_number, row in pending:
+            if row.matriculation_number in existing_ids:
+                results[row_number] = _result(row_number, row.matriculation_number, "skipped", "Student already exists")
+            else:
+                still_pending.append((row_number, row))
+        pending = still_pending
+
+    # 3. Read the chunk's images and embed them with batched detection + forward
+    embedded: List[Tuple[int, StudentManifestRow, bytes, object]] = []
+    if pending:
+        images = await asyncio.to_thread(_read_images, archive, base_dir, [row.image for _, row in pending])
+        readable = [(entry, image) for entry, (image, _) in zip(pending, images) if image is not None]
+        for (row_number, row), (image, error) in zip(pending, images):
+            if error:
+                results[row_number] = _result(row_number, row.matriculation_number, "error", error)
+
+        outputs = await executor.embeddings_from_bytes_batch([image for _, image in readable])
+        for ((row_number, row), image), (decoded, embedding) in zip(readable, outputs):
+            if not decoded:
+                results[row_number] = _result(row_number, row.matriculation_number, "error", "Invalid image file")
+            elif embedding is None:
+                results[row_number] = _result(row_number, row.matriculation_number, "error", "Failed to extract face embedding from image")
+            else:
+                embedded.append((row_number, row, image, embedding))
+
+    # 4. Store images and embeddings, then the students, with bulk writes. Embeddings go
+    # first (as in /students/create) so a failure never leaves a student without one.
+    if embedded:
+        file_ids = await asyncio.gather(*(
+            grid_fs_bucket.upload_from_stream(os.path.basename(row.image), image)
+            for _, row, image, _ in embedded
+        ))
+
+        try:
+            await embedding_db.save_many([
+                (row.matriculation_number, embedding, os.path.basename(row.image))
+                for _, row, _, embedding in embedded
+            ])
+        except Exception as e:
+            await _delete_files(grid_fs_bucket, file_ids)
+            for row_number, row, _, _ in embedded:
+                results[row_number] = _result(row_number, row.matriculation_number, "error", f"Failed to save face embedding: {e}")
+            return [results[row_number] for row_number, _ in chunk]
+
+        students = [
+            Student(**row.model_dump(exclude={"image"}), profile_image=file_id)
+            for (_, row, _, _), file_id in zip(embedded, file_ids)
+        ]
+        failed: Dict[int, str] = {}
+        duplicates = set()
+        try:
+            await Student.insert_many(students, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                failed[error["index"]] = error.get("errmsg", "Failed to insert student")
+                if error.get("code") == DUPLICATE_KEY_ERROR:
+                    duplicates.add(error["index"])
+
+        # Undo the image and embedding of rows whose student was not inserted. A duplicate
+        # key means another request created the student meanwhile: only the template this
+        # row appended to that student's set is taken back, the rest stays theirs.
+        await _delete_files(grid_fs_bucket, [file_ids[i] for i in failed])
+        undo = await asyncio.gather(*(
+            embedding_db.remove_template(row.matriculation_number, embedding, os.path.basename(row.image))
+            if i in duplicates else embedding_db.delete_embedding(row.matriculation_number)
+            for i, (_, row, _, embedding) in enumerate(embedded) if i in failed
+        ), return_exceptions=True)
+        for result in undo:
+            if isinstance(result, Exception):
+                print(f"⚠️ Could not undo the face embedding of a student that was not inserted: {result}")
+
+        for i, (row_number, row, _, _) in enumerate(embedded):
+            if i in failed:
+                results[row_number] = _result(row_number, row.matriculation_number, "error", failed[i])
+            else:
+                # insert_many bypasses Beanie event hooks, so announce the new students explicitly
+                notify_student_change(row.matriculation_number)
+                results[row_number] = _result(row_number, row.matriculation_number, "created")
+
+    return [results[row_number] for row_number, _ in chunk]
+
+
+async def enroll_archive(
+    archive_file: BinaryIO,
+    grid_fs_bucket,
+    executor: InferenceExecutor,
+    embedding_db: AsyncFaceEmbeddingsDB,
+    chunk_size: int = BULK_CHUNK_SIZE,
+) -> Dict:
+    """
+    Enroll every student listed in a zip archive's manifest.
+
+    The archive is read member by member from its (spooled) upload file and
+    manifest rows are processed `chunk_size` at a time, so memory use depends
+    on the chunk size rather than the archive size.
+
+    Returns:
+        Report with totals and a per-row result (created / skipped / error).
+    """
+    seen: set = set()
+    report = {"total": 0, "created": 0, "skipped": 0, "failed": 0, "results": []}
+    counters = {"created": "created", "skipped": "skipped", "error": "failed"}
+    with zipfile.ZipFile(archive_file) as archive:
+        manifest_name = _find_manifest(archive)
+        base_dir = os.path.dirname(manifest_name)
+        rows = _iter_manifest_rows(archive, manifest_name)
+        while True:
+            chunk = await asyncio.to_thread(lambda: list(islice(rows, chunk_size)))
+            if not chunk:
+                break
+            for result in await _enroll_chunk(archive, base_dir, chunk, seen, grid_fs_bucket, executor, embedding_db):
+                report["total"] += 1
+                report[counters[result["status"]]] += 1
+                report["results"].append(result)
+    return report
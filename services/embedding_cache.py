@@ -0,0 +1,168 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+# In-memory entries kept per process (0 disables the cache); one entry is ~2 KB
+EMBEDDING_CACHE_SIZE = int(os.getenv("FACE_EMBEDDING_CACHE_SIZE", "10000"))
+EMBEDDING_CACHE_TTL_SECONDS = float(os.getenv("FACE_EMBEDDING_CACHE_TTL_SECONDS", "3600"))
+# Optional directory shared by all workers on a host
+EMBEDDING_CACHE_DIR = os.getenv("FACE_EMBEDDING_CACHE_DIR") or None
+
+# On-disk record: one status byte, followed by the float32 embedding for _FACE
+_INVALID_IMAGE, _NO_FACE, _FACE = 0, 1, 2
+
+# (decoded, embedding) as returned by face_embedding.embedding_from_bytes()
+CachedResult = Tuple[bool, Optional[np.ndarray]]
+
+
+def cache_key(image_bytes: bytes, variant: str = "", namespace: str = "") -> str:
+    """Content address of an upload: sha256 over the pipeline namespace, request variant and image bytes."""
+    digest = hashlib.sha256()
+    digest.update(f"{namespace}\0{variant}\0".encode())
+    digest.update(image_bytes)
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Content-addressed cache of (decoded, embedding) results for uploaded images.
+
+    The memory tier is an LRU bounded by `max_entries` whose entries expire
+    after `ttl_seconds`. With `disk_dir` set, results are also written to small
+    files there (atomically, via rename) so workers on the same host share
+    them; disk entries expire by modification time. Negative results -
+    undecodable images and images without a face - are cached too.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = EMBEDDING_CACHE_SIZE,
+        ttl_seconds: float = EMBEDDING_CACHE_TTL_SECONDS,
+        disk_dir: Optional[str] = EMBEDDING_CACHE_DIR,
+        namespace: str = "",
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir
+        self.namespace = namespace
+        self._entries: "OrderedDict[str, Tuple[float, CachedResult]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "disk_hits": 0, "negative_hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def key(self, image_bytes: bytes, variant: str = "") -> str:
+        return cache_key(image_bytes, variant, self.namespace)
+
+    def get(self, key: str) -> Optional[CachedResult]:
+        """Cached result for `key`, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, result = entry
+                if now - stored_at <= self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self._count_hit("hits", result)
+                    return result
+                del self._entries[key]
+                self._stats["expirations"] += 1
+
+        if self.disk_dir:
+            result = self._read_disk(key, now)
+            if result is not None:
+                self._remember(key, result, now)
+                with self._lock:
+                    self._count_hit("disk_hits", result)
+                return result
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def put(self, key: str, result: CachedResult):
+        decoded, embedding = result
+        if embedding is not None:
+            embedding = np.array(embedding, dtype=np.float32)
+            embedding.setflags(write=False)
+        result = (decoded, embedding)
+        now = time.time()
+        self._remember(key, result, now)
+        if self.disk_dir:
+            self._write_disk(key, result)
+
+    def lookup(self, image_bytes: bytes, variant: str = "") -> Tuple[str, Optional[CachedResult]]:
+        """Hash the upload and look it up; returns (key, result or None)."""
+        key = self.key(image_bytes, variant)
+        return key, self.get(key)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+        lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+        stats["max_entries"] = self.max_entries
+        stats["ttl_seconds"] = self.ttl_seconds
+        stats["disk_tier"] = bool(self.disk_dir)
+        stats["hit_rate"] = (stats["hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _count_hit(self, counter: str, result: CachedResult):
+        self._stats[counter] += 1
+        if result[1] is None:
+            self._stats["negative_hits"] += 1
+
+    def _remember(self, key: str, result: CachedResult, now: float):
+        with self._lock:
+            self._entries[key] = (now, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], key)
+
+    def _read_disk(self, key: str, now: float) -> Optional[CachedResult]:
+        path = self._disk_path(key)
+        try:
+            if now - os.path.getmtime(path) > self.ttl_seconds:
+                os.remove(path)
+                with self._lock:
+                    self._stats["expirations"] += 1
+                return None
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        if not data:
+            return None
+        if data[0] == _FACE:
+            embedding = np.frombuffer(data, dtype=np.float32, offset=1)
+            return True, embedding
+        return data[0] == _NO_FACE, None
+
+    def _write_disk(self, key: str, result: CachedResult):
+        decoded, embedding = result
+        if embedding is not None:
+            data = bytes([_FACE]) + embedding.astype(np.float32).tobytes()
+        else:
+            data = bytes([_NO_FACE if decoded else _INVALID_IMAGE])
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️ Failed to write embedding cache entry: {e}")
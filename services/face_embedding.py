@@ -1,20 +1,170 @@
+import os
+import threading
+import time
 import torch
 import numpy as np
 import cv2
 from PIL import Image
-from mtcnn import MTCNN
-from face_embedding import get_embedding_from_image
-from inception_resnet_v1 import InceptionResnetV1
+from mtcnn import MTCNN, fixed_image_standardization, load_weights_file
+from inception_resnet_v1 import InceptionResnetV1, get_torch_home
+from inference_scheduler import BatchingScheduler
+from quantization import build_quantized_model
+from slim_model import load_slim_facenet, mapped_bytes, slim_weights_path
+from precision import DETECT_PRECISION, MEMORY_FORMAT, PRECISION, apply_detector_precision, apply_embedder_precision, is_reduced
+from model_export import compile_mtcnn, load_or_export, warm_up
 
 # Device configuration
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-# Load face detection and recognition models
-mtcnn = MTCNN(device=device)
-facenet = InceptionResnetV1(pretrained='vggFace2', classify=False).eval().to(device)
+# Micro-batching of concurrent embedding requests
+BATCH_MAX_SIZE = int(os.getenv("FACE_BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = float(os.getenv("FACE_BATCH_MAX_WAIT_MS", "5"))
+
+# Detection runs on a downscaled proxy of large uploads; faces are cropped from the original.
+# Set FACE_DETECT_MAX_SIDE=0 to detect at full resolution.
+DETECT_MAX_SIDE = int(os.getenv("FACE_DETECT_MAX_SIDE", "1024"))
+DETECT_MIN_FACE_FRACTION = float(os.getenv("FACE_DETECT_MIN_FACE_FRACTION", "0")) or None
+
+# Pre-cropped face fast path: crops smaller than this, too elongated, or scored below
+# CROP_MIN_FACE_PROB by the MTCNN O-net fall back to full detection
+FACE_IMAGE_SIZE = 160
+CROP_MIN_SIDE = int(os.getenv("FACE_CROP_MIN_SIDE", "64"))
+CROP_MAX_ASPECT = float(os.getenv("FACE_CROP_MAX_ASPECT", "1.6"))
+CROP_MIN_FACE_PROB = float(os.getenv("FACE_CROP_MIN_FACE_PROB", "0.9"))
+
+# Opt-in quantized InceptionResnetV1 (CPU only): "none", "dynamic" (last_linear int8)
+# or "int8" (static PTQ of the conv stacks, calibrated on faces from FACE_QUANT_CALIBRATION_DIR)
+QUANTIZE_MODE = os.getenv("FACE_QUANTIZE", "none")
+QUANT_CALIBRATION_DIR = os.getenv("FACE_QUANT_CALIBRATION_DIR", "calibration_faces")
+
+# Serve the inference-only InceptionResnetV1 (BatchNorm folded, dropout and logits removed)
+SLIM_MODEL = os.getenv("FACE_SLIM_MODEL", "1") == "1"
+
+# Local InceptionResnetV1 weights; models are never downloaded at startup
+FACE_WEIGHTS_PATH = os.getenv(
+    "FACE_WEIGHTS_PATH", os.path.join(get_torch_home(), "checkpoints", "20180402-114759-vggface2.pt")
+)
+
+# "eager" or "torchscript": traced + frozen models, cached under FACE_COMPILED_DIR
+INFERENCE_RUNTIME = os.getenv("FACE_INFERENCE_RUNTIME", "eager")
+
+# Load the fp32 InceptionResnetV1 from the local weights file (memory-mapped where possible).
+# The slim model is mapped from its folded checkpoint, written next to the weights on first use.
+def load_facenet(slim: bool = SLIM_MODEL):
+    if not os.path.exists(FACE_WEIGHTS_PATH):
+        raise FileNotFoundError(
+            f"InceptionResnetV1 weights not found at {FACE_WEIGHTS_PATH}; set FACE_WEIGHTS_PATH to a local copy"
+        )
+    if slim:
+        return load_slim_facenet(FACE_WEIGHTS_PATH, lambda: load_facenet(slim=False)).to(device)
+    model = InceptionResnetV1(classify=False)
+    state_dict = load_weights_file(FACE_WEIGHTS_PATH)
+    # The classification logits are never used for embeddings
+    state_dict = {key: value for key, value in state_dict.items() if not key.startswith("logits.")}
+    model.load_state_dict(state_dict, assign=True)
+    return model.eval().to(device)
+
+# Warn when the served fp32 weights are not file-backed: each worker then holds its own copy
+def _check_weights_mapped(model):
+    path = slim_weights_path(FACE_WEIGHTS_PATH) if SLIM_MODEL else FACE_WEIGHTS_PATH
+    result = mapped_bytes(model, path)
+    if result is None:
+        return
+    mapped, total = result
+    if mapped < total:
+        print(
+            f"⚠️ Only {mapped / 2**20:.1f} of {total / 2**20:.1f} MB of InceptionResnetV1 weights are "
+            f"memory-mapped from {path}; the rest is private to this process"
+        )
+
+# Build the served recognition model: load_facenet() plus the configured quantization
+def _build_facenet():
+    model = load_facenet()
+    if QUANTIZE_MODE != "none":
+        if device.type == "cpu":
+            model = build_quantized_model(model, QUANTIZE_MODE, QUANT_CALIBRATION_DIR, mtcnn)
+            print(f"⚙️ InceptionResnetV1 quantization: {QUANTIZE_MODE}")
+        else:
+            print("⚠️ Quantized inference is CPU only, using the fp32 model")
+    if is_reduced(PRECISION, MEMORY_FORMAT):
+        if QUANTIZE_MODE != "none" and device.type == "cpu":
+            print("⚠️ FACE_PRECISION / FACE_MEMORY_FORMAT are ignored for quantized models")
+        else:
+            model = apply_embedder_precision(model, PRECISION, MEMORY_FORMAT)
+            print(f"⚙️ InceptionResnetV1 precision: {PRECISION}, memory format: {MEMORY_FORMAT}")
+    return model
+
+# Face detection and recognition models, built by init_models(). The API calls it from
+# its lifespan handler; scripts and worker processes get it on first use.
+mtcnn = None
+facenet = None
+scheduler = None
+_init_lock = threading.Lock()
+_ready = threading.Event()
+
+def init_models(warmup: bool = True):
+    """Load MTCNN and InceptionResnetV1 (once per process) and run warm-up forwards."""
+    global mtcnn, facenet, scheduler
+    with _init_lock:
+        if _ready.is_set():
+            return
+        start = time.perf_counter()
+        mtcnn = MTCNN(device=device, detect_max_side=DETECT_MAX_SIDE or None, min_face_fraction=DETECT_MIN_FACE_FRACTION)
+        apply_detector_precision(mtcnn, DETECT_PRECISION, MEMORY_FORMAT)
+        if INFERENCE_RUNTIME == "torchscript":
+            compile_mtcnn(mtcnn, device, batch_sizes=(1, BATCH_MAX_SIZE), tag=f"{DETECT_PRECISION}-{MEMORY_FORMAT}")
+            facenet = load_or_export(
+                "inception_resnet_v1", _build_facenet, (torch.zeros(1, 3, 160, 160),), device,
+                tag=f"vggface2-{QUANTIZE_MODE if device.type == 'cpu' else 'none'}{'-slim' if SLIM_MODEL else ''}"
+                    f"-{PRECISION}-{MEMORY_FORMAT}"
+            )
+        elif INFERENCE_RUNTIME == "eager":
+            facenet = _build_facenet()
+            if QUANTIZE_MODE == "none" and not is_reduced(PRECISION, MEMORY_FORMAT) and device.type == "cpu":
+                _check_weights_mapped(facenet)
+        else:
+            raise ValueError('FACE_INFERENCE_RUNTIME must be "eager" or "torchscript"')
+        if warmup:
+            warm_up_models()
+        scheduler = BatchingScheduler(facenet, device, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS)
+        _ready.set()
+        print(f"✅ Face models ready in {time.perf_counter() - start:.1f}s")
+
+# One detection over a blank upload-sized image (the P-net pyramid) plus R/O-net and
+# InceptionResnetV1 forwards at the batch sizes used when serving. Pre-forked workers
+# call it after fork, with their own thread count.
+def warm_up_models():
+    side = DETECT_MAX_SIDE or 640
+    mtcnn.detect(Image.new("RGB", (side, side * 3 // 4)))
+    warm_up(mtcnn.rnet, [(1, 3, 24, 24), (BATCH_MAX_SIZE, 3, 24, 24)], device, runs=1)
+    warm_up(mtcnn.onet, [(1, 3, 48, 48), (BATCH_MAX_SIZE, 3, 48, 48)], device, runs=1)
+    warm_up(facenet, [(1, 3, 160, 160), (BATCH_MAX_SIZE, 3, 160, 160)], device, runs=1)
+
+def ensure_models():
+    if not _ready.is_set():
+        init_models()
+
+def models_ready() -> bool:
+    return _ready.is_set()
+
+def get_scheduler() -> BatchingScheduler:
+    ensure_models()
+    return scheduler
+
+# Settings that change the embedding an image maps to; namespaces cached results
+def pipeline_tag() -> str:
+    return "-".join([
+        os.path.basename(FACE_WEIGHTS_PATH), QUANTIZE_MODE, PRECISION, MEMORY_FORMAT, DETECT_PRECISION,
+        "slim" if SLIM_MODEL else "full", f"side{DETECT_MAX_SIDE}", f"minface{DETECT_MIN_FACE_FRACTION}",
+    ])
+
+def shutdown_models():
+    if scheduler is not None:
+        scheduler.shutdown()
 
 # Extract embedding from image file path
 def get_embedding(image_path: str):
+    ensure_models()
     img = Image.open(image_path).convert("RGB")
     face = mtcnn(img)
     if face is None:
@@ -24,14 +174,137 @@ def get_embedding(image_path: str):
         emb = facenet(face).squeeze(0).cpu().numpy()
     return emb
 
-# Extract embedding from OpenCV image array
-def get_embedding_from_image(cv2_img: np.ndarray):
+# Detect and crop the face from an OpenCV image array
+def detect_face_tensor(cv2_img: np.ndarray):
+    ensure_models()
     # Convert OpenCV BGR image to PIL RGB image
     img = Image.fromarray(cv2.cvtColor(cv2_img, cv2.COLOR_BGR2RGB))
-    face = mtcnn(img)
+    return mtcnn(img)
+
+# Cut the face region out of a pre-cropped upload: the whole image, or `box` = [x1, y1, x2, y2]
+# in image coordinates. Returns None if the region fails validation.
+def _crop_region(cv2_img: np.ndarray, box=None, landmarks=None):
+    h, w = cv2_img.shape[:2]
+    if box is None:
+        x1, y1, x2, y2 = 0, 0, w, h
+    else:
+        x1, y1, x2, y2 = (int(round(v)) for v in box)
+        x1, y1, x2, y2 = max(x1, 0), max(y1, 0), min(x2, w), min(y2, h)
+    crop_w, crop_h = x2 - x1, y2 - y1
+    if min(crop_w, crop_h) < CROP_MIN_SIDE or max(crop_w, crop_h) > CROP_MAX_ASPECT * min(crop_w, crop_h):
+        return None
+
+    if landmarks is not None:
+        # MTCNN order: left eye, right eye, nose, mouth left, mouth right
+        points = np.asarray(landmarks, dtype=np.float32).reshape(5, 2)
+        inside = (points[:, 0] >= x1) & (points[:, 0] <= x2) & (points[:, 1] >= y1) & (points[:, 1] <= y2)
+        eyes_above_mouth = max(points[0, 1], points[1, 1]) < min(points[3, 1], points[4, 1])
+        if not inside.all() or not eyes_above_mouth or points[0, 0] >= points[1, 0]:
+            return None
+
+    return cv2_img[y1:y2, x1:x2]
+
+# Score a face crop (RGB uint8) with the MTCNN O-net, the last stage of the detection cascade
+def _crop_face_prob(rgb_crop: np.ndarray) -> float:
+    ensure_models()
+    onet_input = cv2.resize(rgb_crop, (48, 48), interpolation=cv2.INTER_AREA)
+    onet_input = torch.as_tensor(onet_input, dtype=torch.float32, device=device).permute(2, 0, 1).unsqueeze(0)
+    with torch.no_grad():
+        _, _, probs = mtcnn.onet((onet_input - 127.5) * 0.0078125)
+    return float(probs[0, 1])
+
+# Turn a pre-cropped face (or a frame plus face box and landmarks) into a standardized
+# 3x160x160 face tensor without running detection. Returns None if the crop looks wrong.
+def crop_face_tensor(cv2_img: np.ndarray, box=None, landmarks=None):
+    region = _crop_region(cv2_img, box, landmarks)
+    if region is None:
+        return None
+    rgb = cv2.cvtColor(region, cv2.COLOR_BGR2RGB)
+    if _crop_face_prob(rgb) < CROP_MIN_FACE_PROB:
+        return None
+    face = cv2.resize(rgb, (FACE_IMAGE_SIZE, FACE_IMAGE_SIZE), interpolation=cv2.INTER_AREA)
+    face = torch.as_tensor(face, dtype=torch.float32).permute(2, 0, 1)
+    return fixed_image_standardization(face)
+
+# Pre-cropped fast path with a fallback to the full MTCNN cascade when the crop is rejected
+def face_tensor_from_crop(cv2_img: np.ndarray, box=None, landmarks=None):
+    face = crop_face_tensor(cv2_img, box, landmarks)
+    if face is None:
+        print("⚠️ Pre-cropped face rejected, falling back to full detection")
+        return detect_face_tensor(cv2_img)
+    return face
+
+# Extract embedding from OpenCV image array
+def get_embedding_from_image(cv2_img: np.ndarray):
+    ensure_models()
+    face = detect_face_tensor(cv2_img)
     if face is None:
         return None
     face = face.unsqueeze(0).to(device)
     with torch.no_grad():
         emb = facenet(face).squeeze(0).cpu().numpy()
-    return emb
\ No newline at end of file
+    return emb
+
+# Decode uploaded image bytes into an OpenCV BGR array (None if not an image)
+def decode_image(image_bytes: bytes):
+    np_arr = np.frombuffer(image_bytes, np.uint8)
+    return cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+
+# Full decode -> detect -> embed pipeline on raw upload bytes.
+# Returns (decoded, embedding); used as the unit of work in process pools.
+def embedding_from_bytes(image_bytes: bytes):
+    img = decode_image(image_bytes)
+    if img is None:
+        return False, None
+    return True, get_embedding_from_image(img)
+
+# embedding_from_bytes() for pre-cropped uploads (see face_tensor_from_crop)
+def embedding_from_crop_bytes(image_bytes: bytes, box=None, landmarks=None):
+    ensure_models()
+    img = decode_image(image_bytes)
+    if img is None:
+        return False, None
+    face = face_tensor_from_crop(img, box, landmarks)
+    if face is None:
+        return True, None
+    with torch.no_grad():
+        emb = facenet(face.unsqueeze(0).to(device)).squeeze(0).cpu().numpy()
+    return True, emb
+
+# Detect and crop faces from several OpenCV images with batched MTCNN passes.
+# Differently sized images are bucketed and padded by MTCNN itself.
+def detect_face_tensors(cv2_imgs):
+    ensure_models()
+    faces = [None] * len(cv2_imgs)
+    indices = [i for i, cv2_img in enumerate(cv2_imgs) if cv2_img is not None]
+    if not indices:
+        return faces
+    imgs = [Image.fromarray(cv2.cvtColor(cv2_imgs[i], cv2.COLOR_BGR2RGB)) for i in indices]
+    for i, face in zip(indices, mtcnn(imgs)):
+        faces[i] = face
+    return faces
+
+# Embed a list of face crops with one InceptionResnetV1 forward per BATCH_MAX_SIZE faces
+def embed_face_tensors(faces):
+    ensure_models()
+    if not faces:
+        return np.empty((0, 512), dtype=np.float32)
+    embeddings = []
+    with torch.no_grad():
+        for start in range(0, len(faces), BATCH_MAX_SIZE):
+            batch = torch.stack(faces[start:start + BATCH_MAX_SIZE]).to(device)
+            embeddings.append(facenet(batch).cpu().numpy())
+    return np.concatenate(embeddings)
+
+# Batched decode -> detect -> embed on a list of raw upload bytes.
+# Returns a list of (decoded, embedding) tuples in input order.
+def embeddings_from_bytes_batch(image_bytes_list):
+    imgs = [decode_image(image_bytes) for image_bytes in image_bytes_list]
+    faces = detect_face_tensors(imgs)
+    found = [i for i, face in enumerate(faces) if face is not None]
+    embeddings = embed_face_tensors([faces[i] for i in found])
+
+    results = [(img is not None, None) for img in imgs]
+    for i, embedding in zip(found, embeddings):
+        results[i] = (True, embedding)
+    return results
@@ -1,7 +1,9 @@
 import numpy as np
-from typing import Optional
+from typing import List, Optional, Tuple
 from datetime import datetime
-from database import FaceEmbeddingsDB
+from database_embedding import FaceEmbeddingsDB
+from async_database_embedding import AsyncFaceEmbeddingsDB
+from gallery_index import get_gallery_index, get_gallery_index_async
 
 
 class FaceRegistrar:
@@ -9,8 +11,15 @@ class FaceRegistrar:
     Handles the registration and updating of face embeddings in the database.
     """
 
-    def __init__(self, db_uri: str = "mongodb://localhost:27017", db_name: str = "face_recognition_db"):
-        self.db = FaceEmbeddingsDB(mongo_uri=db_uri, db_name=db_name)
+    def __init__(
+        self,
+        db_uri: str = "mongodb://localhost:27017",
+        db_name: str = "face_recognition_db",
+        db: Optional[FaceEmbeddingsDB] = None,
+    ):
+        # A shared `db` is borrowed, not owned: close() leaves it open.
+        self._owns_db = db is None
+        self.db = db if db is not None else FaceEmbeddingsDB(mongo_uri=db_uri, db_name=db_name)
 
     def register_face(
         self,
@@ -20,7 +29,7 @@ class FaceRegistrar:
         timestamp: Optional[datetime] = None,
     ) -> bool:
         """
-        Register a new face embedding or update an existing one by averaging.
+        Register a face embedding as a new template in the person's template set.
 
         Args:
             person_id (str): Unique identifier for the person (e.g. matriculation number).
@@ -32,11 +41,10 @@ class FaceRegistrar:
             bool: True if the embedding was saved successfully, False otherwise.
         """
         timestamp = timestamp or datetime.utcnow()
-        embedding_list = embedding.tolist()
 
         result = self.db.save_embedding(
             person_id=person_id,
-            new_embedding=embedding_list,
+            new_embedding=embedding,
             image_path=image_path,
             timestamp=timestamp,
         )
@@ -44,17 +52,28 @@ class FaceRegistrar:
         return getattr(result, "acknowledged", True)
 
     def close(self):
-        """Close the database connection."""
-        self.db.close()
+        """Close the database connection if this instance opened it."""
+        if self._owns_db:
+            self.db.close()
 
 
 class FaceVerifier:
     """
     Verifies face embeddings against registered ones in the database.
+
+    Matching runs against the process-wide GalleryIndex, which is loaded from
+    the database once and kept current by FaceEmbeddingsDB change notifications.
     """
 
-    def __init__(self, db_uri: str = "mongodb://localhost:27017", db_name: str = "face_recognition_db"):
-        self.db = FaceEmbeddingsDB(mongo_uri=db_uri, db_name=db_name)
+    def __init__(
+        self,
+        db_uri: str = "mongodb://localhost:27017",
+        db_name: str = "face_recognition_db",
+        db: Optional[FaceEmbeddingsDB] = None,
+    ):
+        # A shared `db` is borrowed, not owned: close() leaves it open.
+        self._owns_db = db is None
+        self.db = db if db is not None else FaceEmbeddingsDB(mongo_uri=db_uri, db_name=db_name)
 
     def cosine_similarity(self, vec1: np.ndarray, vec2: np.ndarray) -> float:
         """Compute cosine similarity between two vectors."""
@@ -62,31 +81,146 @@ class FaceVerifier:
             return 0.0
         return np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
 
-    def verify_face(self, embedding: np.ndarray, threshold: float = 0.7) -> Optional[str]:
+    def search(
+        self,
+        embedding: np.ndarray,
+        k: int = 5,
+        exact: bool = False,
+        nprobe: Optional[int] = None,
+        rerank_k: Optional[int] = None,
+    ) -> List[Tuple[str, float]]:
+        """
+        Return the k closest registered faces as (person_id, similarity), best first.
+
+        Args:
+            exact (bool): Force brute-force search even when the ANN backend is active.
+            nprobe (Optional[int]): IVF cells to scan for this query (higher = better recall).
+            rerank_k (Optional[int]): Shortlist size that is re-scored exactly.
+        """
+        return get_gallery_index(self.db).search(
+            embedding, k=k, exact=exact, nprobe=nprobe, rerank_k=rerank_k
+        )
+
+    def verify_face(self, embedding: np.ndarray, threshold: float = 0.7, exact: bool = False) -> Optional[str]:
         """
         Match input embedding against all registered embeddings.
 
         Returns:
             person_id (str) if match found above threshold, else None.
         """
-        person_ids = self.db.list_person_ids()
-        best_match_id = None
-        highest_similarity = 0.0
+        match = get_gallery_index(self.db).best_match(embedding, exact=exact)
+        if match is None:
+            return None
+
+        best_match_id, highest_similarity = match
+        return best_match_id if highest_similarity >= threshold else None
+
+    def close(self):
+        """Close the database connection if this instance opened it."""
+        if self._owns_db:
+            self.db.close()
+
+
+class AsyncFaceRegistrar:
+    """
+    Async counterpart of FaceRegistrar backed by AsyncFaceEmbeddingsDB.
+    """
+
+    def __init__(
+        self,
+        db_uri: str = "mongodb://localhost:27017",
+        db_name: str = "face_recognition_db",
+        db: Optional[AsyncFaceEmbeddingsDB] = None,
+    ):
+        self._owns_db = db is None
+        self.db = db if db is not None else AsyncFaceEmbeddingsDB(mongo_uri=db_uri, db_name=db_name)
+
+    async def register_face(
+        self,
+        person_id: str,
+        embedding: np.ndarray,
+        image_path: Optional[str] = None,
+        timestamp: Optional[datetime] = None,
+    ) -> bool:
+        """
+        Register a face embedding as a new template in the person's template set.
 
-        for person_id in person_ids:
-            doc = self.db.get_embedding(person_id)
-            if not doc:
-                continue
+        Returns:
+            bool: True if the embedding was saved successfully, False otherwise.
+        """
+        timestamp = timestamp or datetime.utcnow()
+        result = await self.db.save_embedding(
+            person_id=person_id,
+            new_embedding=embedding,
+            image_path=image_path,
+            timestamp=timestamp,
+        )
+        return getattr(result, "acknowledged", True)
+
+    def close(self):
+        """Close the database connection if this instance opened it."""
+        if self._owns_db:
+            self.db.close()
+
+
+class AsyncFaceVerifier:
+    """
+    Async counterpart of FaceVerifier; the shared GalleryIndex is loaded through
+    a motor cursor, after which matching involves no database round trips.
+    """
 
-            registered_embedding = np.array(doc["embedding"])
-            similarity = self.cosine_similarity(embedding, registered_embedding)
+    def __init__(
+        self,
+        db_uri: str = "mongodb://localhost:27017",
+        db_name: str = "face_recognition_db",
+        db: Optional[AsyncFaceEmbeddingsDB] = None,
+    ):
+        self._owns_db = db is None
+        self.db = db if db is not None else AsyncFaceEmbeddingsDB(mongo_uri=db_uri, db_name=db_name)
+
+    async def search(
+        self,
+        embedding: np.ndarray,
+        k: int = 5,
+        exact: bool = False,
+        nprobe: Optional[int] = None,
+        rerank_k: Optional[int] = None,
+    ) -> List[Tuple[str, float]]:
+        """Return the k closest registered faces as (person_id, similarity), best first."""
+        index = await get_gallery_index_async(self.db)
+        return index.search(embedding, k=k, exact=exact, nprobe=nprobe, rerank_k=rerank_k)
+
+    async def verify_face(self, embedding: np.ndarray, threshold: float = 0.7, exact: bool = False) -> Optional[str]:
+        """
+        Match input embedding against all registered embeddings.
 
-            if similarity > highest_similarity:
-                highest_similarity = similarity
-                best_match_id = person_id
+        Returns:
+            person_id (str) if match found above threshold, else None.
+        """
+        index = await get_gallery_index_async(self.db)
+        match = index.best_match(embedding, exact=exact)
+        if match is None:
+            return None
 
+        best_match_id, highest_similarity = match
         return best_match_id if highest_similarity >= threshold else None
 
+    async def verify_faces(
+        self, embeddings: np.ndarray, threshold: float = 0.7, exact: bool = False
+    ) -> List[Optional[Tuple[str, float]]]:
+        """
+        Match a batch of probe embeddings in one pass.
+
+        Returns:
+            For each probe, (person_id, similarity) if matched above threshold, else None.
+        """
+        index = await get_gallery_index_async(self.db)
+        return [
+            match if match is not None and match[1] >= threshold else None
+            for match in index.best_matches(embeddings, exact=exact)
+        ]
+
     def close(self):
-        """Close the database connection."""
-        self.db.close()
\ No newline at end of file
+        """Close the database connection if this instance opened it."""
+        if self._owns_db:
+            self.db.close()
@@ -0,0 +1,513 @@
+import asyncio
+import os
+import threading
+import numpy as np
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+from database_embedding import FaceEmbeddingsDB, MAX_TEMPLATES, add_change_listener, remove_change_listener, doc_templates
+from async_database_embedding import AsyncFaceEmbeddingsDB
+from ann_index import IVFIndex
+
+if TYPE_CHECKING:
+    from gallery_snapshot import GallerySnapshot
+
+# Matching backend for the shared index: "exact" (brute-force matmul) or "ivf".
+GALLERY_BACKEND = os.getenv("FACE_GALLERY_BACKEND", "exact")
+# The IVF index is only worth building once the gallery is reasonably large.
+IVF_MIN_GALLERY_SIZE = int(os.getenv("FACE_IVF_MIN_GALLERY_SIZE", "20000"))
+IVF_NPROBE = int(os.getenv("FACE_IVF_NPROBE", "8"))
+IVF_RERANK_K = int(os.getenv("FACE_IVF_RERANK_K", "256"))
+# How a person's template scores are combined: "max" or "topk_mean"
+TEMPLATE_REDUCE = os.getenv("FACE_TEMPLATE_REDUCE", "max")
+TEMPLATE_TOP_K = int(os.getenv("FACE_TEMPLATE_TOP_K", "2"))
+# Identities scored per block in batch matching, bounding the (probes, block, templates) score buffer
+SCORE_BLOCK_ROWS = int(os.getenv("FACE_SCORE_BLOCK_ROWS", "16384"))
+
+
+def reduce_template_scores(scores: np.ndarray, mask: np.ndarray, reduce: str = "max", top_k: int = 2) -> np.ndarray:
+    """
+    Collapse (..., T) per-template similarities into one score per identity.
+
+    Slots outside `mask` are ignored. "topk_mean" averages the best
+    min(top_k, templates) scores, so one lucky template counts for less.
+    """
+    scores = np.where(mask, scores, -np.inf)
+    k = min(top_k, scores.shape[-1])
+    if reduce == "max" or k == 1:
+        return scores.max(axis=-1)
+    top = -np.partition(-scores, k - 1, axis=-1)[..., :k]
+    top = np.where(np.isfinite(top), top, 0.0)
+    return top.sum(axis=-1) / np.maximum(np.minimum(mask.sum(axis=-1), k), 1)
+
+
+class GalleryIndex:
+    """
+    Process-resident index of registered face templates.
+
+    Each person owns one row of a contiguous (N, T, D) float32 array holding
+    up to T = `max_templates` L2-normalized embeddings, with a (N, T) mask of
+    the filled slots and a parallel array of person ids. Matching a probe is
+    a single matrix product against all N*T slots, after which the template
+    scores are reduced per person with "max" or "topk_mean". Memory is fixed
+    at N * T * D floats however templates accumulate.
+
+    With backend="ivf" an IVFIndex over the individual template slots is
+    maintained for galleries of at least `ivf_min_size` people; searches scan
+    only a few cells and the shortlisted people are then scored exactly.
+    Smaller galleries always use exact search. Builds and retrains (once the
+    gallery doubles past the trained size) run on a background thread; the
+    previous index (or exact search) keeps serving, and slots written
+    meanwhile are re-added to the new index before it is swapped in.
+    """
+
+    def __init__(
+        self,
+        dim: int = 512,
+        initial_capacity: int = 1024,
+        backend: str = "exact",
+        ivf_min_size: int = IVF_MIN_GALLERY_SIZE,
+        ivf_params: Optional[Dict] = None,
+        max_templates: int = MAX_TEMPLATES,
+        reduce: str = TEMPLATE_REDUCE,
+        top_k: int = TEMPLATE_TOP_K,
+    ):
+        if backend not in ("exact", "ivf"):
+            raise ValueError('backend must be "exact" or "ivf"')
+        if reduce not in ("max", "topk_mean"):
+            raise ValueError('reduce must be "max" or "topk_mean"')
+        self.dim = dim
+        self.backend = backend
+        self.ivf_min_size = ivf_min_size
+        self.ivf_params = ivf_params or {"nprobe": IVF_NPROBE, "rerank_k": IVF_RERANK_K}
+        self.max_templates = max_templates
+        self.reduce = reduce
+        self.top_k = top_k
+        self.namespace: Optional[str] = None
+        self.loaded = False
+        self._lock = threading.RLock()
+        self._matrix = np.zeros((initial_capacity, max_templates, dim), dtype=np.float32)
+        self._mask = np.zeros((initial_capacity, max_templates), dtype=bool)
+        self._ids = np.empty(initial_capacity, dtype=object)
+        self._rows: Dict[str, int] = {}
+        self._size = 0
+        self._ann: Optional[IVFIndex] = None
+        # Background IVF build: its thread, the slots written while it runs,
+        # and a generation bumped whenever the gallery is replaced wholesale
+        self._ann_thread: Optional[threading.Thread] = None
+        self._ann_dirty: Optional[Set[int]] = None
+        self._ann_generation = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def template_count(self) -> int:
+        return int(self._mask[:self._size].sum())
+
+    @property
+    def ann_active(self) -> bool:
+        return self._ann is not None
+
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> Optional[np.ndarray]:
+        vec = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vec)
+        if norm == 0 or not np.isfinite(norm):
+            return None
+        return vec / norm
+
+    def normalize_templates(self, templates: np.ndarray) -> Optional[np.ndarray]:
+        """L2-normalize a (T, D) template set (or one vector), keeping the newest max_templates valid rows."""
+        vecs = np.asarray(templates, dtype=np.float32)
+        if vecs.ndim == 1:
+            vecs = vecs[None]
+        if vecs.ndim != 2 or vecs.shape[1] != self.dim:
+            return None
+        norms = np.linalg.norm(vecs, axis=1)
+        valid = (norms > 0) & np.isfinite(norms)
+        vecs = (vecs[valid] / norms[valid, None])[-self.max_templates:]
+        return vecs if len(vecs) else None
+
+    def _flat(self) -> np.ndarray:
+        """(capacity * T, D) view of the template array; slot r*T + t is template t of row r."""
+        return self._matrix.reshape(-1, self.dim)
+
+    def _slots(self, row: int) -> np.ndarray:
+        return row * self.max_templates + np.flatnonzero(self._mask[row])
+
+    def _grow(self, min_capacity: int):
+        capacity = max(min_capacity, 2 * len(self._ids))
+        matrix = np.zeros((capacity, self.max_templates, self.dim), dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        mask = np.zeros((capacity, self.max_templates), dtype=bool)
+        mask[:self._size] = self._mask[:self._size]
+        ids = np.empty(capacity, dtype=object)
+        ids[:self._size] = self._ids[:self._size]
+        self._matrix, self._mask, self._ids = matrix, mask, ids
+
+    def _maybe_rebuild_ann(self):
+        """Start a background build or retrain when the gallery outgrows the IVF training set."""
+        if self.backend != "ivf":
+            return
+        if self._size < self.ivf_min_size:
+            if self._ann is not None or self._ann_dirty is not None:
+                self._ann = None
+                self._ann_generation += 1
+                self._ann_dirty = None
+            return
+        if self._ann is None or len(self._ann) > 2 * self._ann.trained_size:
+            if self._ann_thread is None or not self._ann_thread.is_alive():
+                # The build reads the matrix without the lock, so any slot
+                # written from here on may have been read in any state; those
+                # slots are redone from the live matrix before the swap
+                slots = np.flatnonzero(self._mask[:self._size].reshape(-1))
+                self._ann_dirty = set()
+                self._ann_thread = threading.Thread(
+                    target=self._build_ann, args=(self._flat(), slots, self._ann_generation),
+                    name="gallery-ivf-build", daemon=True,
+                )
+                self._ann_thread.start()
+
+    def _build_ann(self, flat: np.ndarray, slots: np.ndarray, generation: int):
+        ann = IVFIndex(dim=self.dim, **self.ivf_params)
+        ann.build_from(flat, slots)
+        with self._lock:
+            if generation != self._ann_generation or self._ann_dirty is None:
+                return
+            mask = self._mask.reshape(-1)
+            flat = self._flat()
+            for slot in self._ann_dirty:
+                ann.remove(slot)
+                if slot < self._size * self.max_templates and mask[slot]:
+                    ann.add(slot, flat[slot])
+            self._ann_dirty = None
+            self._ann = ann
+
+    def _ann_write(self, op: str, *args):
+        """Apply an add/remove/move to the live IVF index and note the slots for an in-flight build."""
+        if self._ann is not None:
+            getattr(self._ann, op)(*args)
+        if self._ann_dirty is not None:
+            self._ann_dirty.update(arg for arg in args if isinstance(arg, int))
+
+    def enable_ann(self, **ivf_params):
+        """(Re)build the IVF index over the current gallery now, regardless of its size."""
+        with self._lock:
+            slots = np.flatnonzero(self._mask[:self._size].reshape(-1))
+            ann = IVFIndex(dim=self.dim, **ivf_params)
+            ann.build_from(self._flat(), slots)
+            self._ann_generation += 1
+            self._ann_dirty = None
+            self._ann = ann
+
+    def _replace(self, person_ids: List[str], template_sets: List[np.ndarray], namespace: str):
+        with self._lock:
+            size = len(person_ids)
+            capacity = max(size, 1024)
+            self._matrix = np.zeros((capacity, self.max_templates, self.dim), dtype=np.float32)
+            self._mask = np.zeros((capacity, self.max_templates), dtype=bool)
+            for row, vecs in enumerate(template_sets):
+                self._matrix[row, :len(vecs)] = vecs
+                self._mask[row, :len(vecs)] = True
+            self._ids = np.empty(capacity, dtype=object)
+            self._ids[:size] = person_ids
+            self._rows = {person_id: row for row, person_id in enumerate(person_ids)}
+            self._size = size
+            self._ann = None
+            self._ann_generation += 1
+            self._ann_dirty = None
+            self._maybe_rebuild_ann()
+            self.namespace = namespace
+            self.loaded = True
+
+    def load_snapshot(self, snapshot: "GallerySnapshot"):
+        """
+        Serve the gallery straight from a snapshot's copy-on-write memory map.
+
+        Pages stay shared with every other worker mapping the same snapshot
+        until a row is written; new people go into the snapshot's spare rows,
+        and only outgrowing those copies the matrix into private memory.
+        """
+        if snapshot.dim != self.dim or snapshot.max_templates != self.max_templates:
+            raise ValueError(
+                f"Snapshot layout ({snapshot.max_templates} x {snapshot.dim}) does not match "
+                f"the gallery ({self.max_templates} x {self.dim})"
+            )
+        with self._lock:
+            size = len(snapshot.ids)
+            self._matrix = snapshot.templates
+            self._mask = np.array(snapshot.mask)
+            self._ids = np.empty(len(self._matrix), dtype=object)
+            self._ids[:size] = snapshot.ids
+            self._rows = {person_id: row for row, person_id in enumerate(snapshot.ids)}
+            self._size = size
+            self._ann = None
+            self._ann_generation += 1
+            self._ann_dirty = None
+            self._maybe_rebuild_ann()
+            self.namespace = snapshot.namespace
+            self.loaded = True
+
+    def arrays(self) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """Copies of (person_ids, (N, T, D) templates, (N, T) mask) for the current gallery."""
+        with self._lock:
+            return (
+                list(self._ids[:self._size]),
+                self._matrix[:self._size].copy(),
+                self._mask[:self._size].copy(),
+            )
+
+    def load(self, db: FaceEmbeddingsDB, batch_size: int = 1000):
+        """(Re)build the index from every document in the embeddings collection."""
+        person_ids: List[str] = []
+        template_sets: List[np.ndarray] = []
+        for person_id, templates in db.iter_templates(batch_size=batch_size):
+            vecs = self.normalize_templates(templates)
+            if vecs is None:
+                continue
+            person_ids.append(person_id)
+            template_sets.append(vecs)
+        self._replace(person_ids, template_sets, db.namespace)
+
+    async def load_async(self, db: AsyncFaceEmbeddingsDB, batch_size: int = 1000):
+        """Async variant of load() that streams the collection through a motor cursor."""
+        person_ids: List[str] = []
+        template_sets: List[np.ndarray] = []
+        async for doc in db.iter_all(batch_size=batch_size):
+            templates = doc_templates(doc, self.max_templates)
+            vecs = self.normalize_templates(templates) if len(templates) else None
+            if vecs is None:
+                continue
+            person_ids.append(doc["person_id"])
+            template_sets.append(vecs)
+        # Building the matrix (and IVF training) is CPU-bound, keep it off the loop
+        await asyncio.to_thread(self._replace, person_ids, template_sets, db.namespace)
+
+    def upsert(self, person_id: str, templates: np.ndarray):
+        """Insert or replace the template set (T, D), or a single embedding, for a person."""
+        vecs = self.normalize_templates(templates)
+        if vecs is None:
+            self.remove(person_id)
+            return
+
+        with self._lock:
+            row = self._rows.get(person_id)
+            if row is None:
+                if self._size == len(self._ids):
+                    self._grow(self._size + 1)
+                row = self._size
+                self._size += 1
+                self._ids[row] = person_id
+                self._rows[person_id] = row
+            else:
+                for slot in self._slots(row):
+                    self._ann_write("remove", int(slot))
+            self._matrix[row] = 0
+            self._matrix[row, :len(vecs)] = vecs
+            self._mask[row] = False
+            self._mask[row, :len(vecs)] = True
+            for slot in self._slots(row):
+                self._ann_write("add", int(slot), self._flat()[slot])
+            self._maybe_rebuild_ann()
+
+    def remove(self, person_id: str):
+        """Drop a person from the index, moving the last row into its slot."""
+        with self._lock:
+            row = self._rows.pop(person_id, None)
+            if row is None:
+                return
+            last = self._size - 1
+            for slot in self._slots(row):
+                self._ann_write("remove", int(slot))
+            if row != last:
+                moved_id = self._ids[last]
+                for slot in self._slots(last):
+                    self._ann_write("move", int(slot), int(slot) - (last - row) * self.max_templates)
+                self._matrix[row] = self._matrix[last]
+                self._mask[row] = self._mask[last]
+                self._ids[row] = moved_id
+                self._rows[moved_id] = row
+            self._mask[last] = False
+            self._ids[last] = None
+            self._size = last
+
+    def apply_change(self, namespace: str, person_id: str, templates: Optional[np.ndarray]):
+        """Change listener hooked into FaceEmbeddingsDB writes."""
+        if not self.loaded or namespace != self.namespace:
+            return
+        if templates is None:
+            self.remove(person_id)
+        else:
+            self.upsert(person_id, templates)
+
+    def _score_rows(self, queries: np.ndarray, start: int, stop: int) -> np.ndarray:
+        """Reduced (B, stop - start) person scores of normalized `queries` for gallery rows start..stop."""
+        block = self._matrix[start:stop].reshape(-1, self.dim)
+        scores = (queries @ block.T).reshape(len(queries), stop - start, self.max_templates)
+        return reduce_template_scores(scores, self._mask[start:stop], self.reduce, self.top_k)
+
+    def _score_candidates(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        scores = self._matrix[rows] @ query
+        return reduce_template_scores(scores, self._mask[rows], self.reduce, self.top_k)
+
+    def search(
+        self,
+        embedding: np.ndarray,
+        k: int = 1,
+        exact: bool = False,
+        nprobe: Optional[int] = None,
+        rerank_k: Optional[int] = None,
+    ) -> List[Tuple[str, float]]:
+        """
+        Return up to k (person_id, similarity) pairs, best first, where the
+        similarity is the person's reduced template score.
+
+        Uses the IVF index when one is active unless `exact` is set; `nprobe`
+        and `rerank_k` override the index defaults for this query only.
+        """
+        query = self._normalize(embedding)
+        if query is None:
+            return []
+
+        with self._lock:
+            if self._size == 0:
+                return []
+            k = min(k, self._size)
+            if self._ann is not None and not exact:
+                # A person can fill several shortlist slots, so ask for enough
+                # slots to cover k people before re-scoring them exactly.
+                slots, _ = self._ann.search(
+                    query, self._flat(), k=k * self.max_templates, nprobe=nprobe, rerank_k=rerank_k
+                )
+                candidates = np.unique(slots // self.max_templates)
+                if len(candidates) == 0:
+                    return []
+                scores = self._score_candidates(query, candidates)
+                order = np.argsort(-scores)[:k]
+                rows, scores = candidates[order], scores[order]
+            else:
+                scores = self._score_rows(query[None], 0, self._size)[0]
+                if k == 1:
+                    rows = np.array([int(np.argmax(scores))])
+                else:
+                    rows = np.argpartition(-scores, k - 1)[:k]
+                    rows = rows[np.argsort(-scores[rows])]
+                scores = scores[rows]
+            return [(self._ids[row], float(score)) for row, score in zip(rows, scores)]
+
+    def best_matches(self, embeddings: np.ndarray, exact: bool = False, **search_kwargs) -> List[Optional[Tuple[str, float]]]:
+        """
+        best_match() for a batch of probes. Exact search scores every probe
+        against all templates with one matrix product per block of
+        SCORE_BLOCK_ROWS people, keeping a running best per probe.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        if len(embeddings) == 0:
+            return []
+
+        with self._lock:
+            if self._ann is not None and not exact:
+                return [self.best_match(embedding, **search_kwargs) for embedding in embeddings]
+            if self._size == 0:
+                return [None] * len(embeddings)
+
+            norms = np.linalg.norm(embeddings, axis=1)
+            valid = (norms > 0) & np.isfinite(norms)
+            queries = np.zeros_like(embeddings)
+            queries[valid] = embeddings[valid] / norms[valid, None]
+
+            best = np.full(len(queries), -np.inf, dtype=np.float32)
+            rows = np.zeros(len(queries), dtype=np.int64)
+            probes = np.arange(len(queries))
+            for start in range(0, self._size, SCORE_BLOCK_ROWS):
+                stop = min(start + SCORE_BLOCK_ROWS, self._size)
+                scores = self._score_rows(queries, start, stop)
+                block_rows = np.argmax(scores, axis=1)
+                block_best = scores[probes, block_rows]
+                better = block_best > best
+                best[better] = block_best[better]
+                rows[better] = block_rows[better] + start
+            return [
+                (self._ids[row], float(score)) if ok else None
+                for row, score, ok in zip(rows, best, valid)
+            ]
+
+    def best_match(self, embedding: np.ndarray, **search_kwargs) -> Optional[Tuple[str, float]]:
+        """Return (person_id, similarity) of the closest registered person."""
+        results = self.search(embedding, k=1, **search_kwargs)
+        return results[0] if results else None
+
+    def ann_recall(self, queries: np.ndarray, k: int = 10, **search_kwargs) -> float:
+        """Mean recall@k of the IVF search against exact search for `queries`."""
+        if self._ann is None:
+            return 1.0
+        hits, total = 0, 0
+        for query in queries:
+            exact_ids = {pid for pid, _ in self.search(query, k=k, exact=True)}
+            if not exact_ids:
+                continue
+            ann_ids = {pid for pid, _ in self.search(query, k=k, **search_kwargs)}
+            hits += len(exact_ids & ann_ids)
+            total += len(exact_ids)
+        return hits / total if total else 1.0
+
+
+_gallery_index: Optional[GalleryIndex] = None
+_gallery_lock = threading.Lock()
+_gallery_async_lock: Optional[asyncio.Lock] = None
+
+
+def _install(index: GalleryIndex) -> GalleryIndex:
+    global _gallery_index
+    if _gallery_index is not None:
+        remove_change_listener(_gallery_index.apply_change)
+    add_change_listener(index.apply_change)
+    _gallery_index = index
+    return index
+
+
+def get_gallery_index(db: FaceEmbeddingsDB) -> GalleryIndex:
+    """Return the shared gallery index, loading it from `db` on first use."""
+    with _gallery_lock:
+        if _gallery_index is None or _gallery_index.namespace != db.namespace:
+            index = GalleryIndex(backend=GALLERY_BACKEND)
+            index.load(db)
+            _install(index)
+        return _gallery_index
+
+
+async def get_gallery_index_async(db: AsyncFaceEmbeddingsDB) -> GalleryIndex:
+    """Async variant of get_gallery_index() for the motor-backed store."""
+    global _gallery_async_lock
+    if _gallery_async_lock is None:
+        _gallery_async_lock = asyncio.Lock()
+    async with _gallery_async_lock:
+        if _gallery_index is None or _gallery_index.namespace != db.namespace:
+            index = GalleryIndex(backend=GALLERY_BACKEND)
+            await index.load_async(db)
+            with _gallery_lock:
+                _install(index)
+        return _gallery_index
+
+
+def install_gallery_index(index: GalleryIndex) -> GalleryIndex:
+    """Swap `index` in as the shared gallery index."""
+    with _gallery_lock:
+        return _install(index)
+
+
+async def reload_gallery_index_async(db: AsyncFaceEmbeddingsDB, snapshot: Optional["GallerySnapshot"] = None) -> GalleryIndex:
+    """
+    Rebuild the shared gallery index and swap it in, even if one is already loaded.
+
+    With a `snapshot` the index is mapped from it instead of scanning `db`.
+    """
+    global _gallery_async_lock
+    if _gallery_async_lock is None:
+        _gallery_async_lock = asyncio.Lock()
+    async with _gallery_async_lock:
+        index = GalleryIndex(backend=GALLERY_BACKEND)
+        if snapshot is not None:
+            await asyncio.to_thread(index.load_snapshot, snapshot)
+        else:
+            await index.load_async(db)
+        return install_gallery_index(index)
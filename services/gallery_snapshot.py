@@ -0,0 +1,244 @@
+"""
+On-disk gallery snapshots that every worker process maps instead of scanning Mongo.
+
+A snapshot directory holds one sub-directory per version plus a CURRENT file
+naming the live one:
+
+    <dir>/CURRENT
+    <dir>/<version>/manifest.json   format, version, namespace, sizes, sync stamp
+    <dir>/<version>/templates.npy   (capacity, T, D) float32, L2-normalized
+    <dir>/<version>/mask.npy        (capacity, T) bool, filled template slots
+    <dir>/<version>/ids.json        person_ids of the first `count` rows
+
+Versions are written to a temporary directory, synced to disk, renamed into
+place and only then published by atomically replacing CURRENT, so readers
+never see a partial snapshot, even after a crash. Spare rows past `count` leave room for people enrolled
+after the snapshot without copying the shared mapping.
+
+Build one (or keep rebuilding every N seconds) with:
+    python gallery_snapshot.py --dir gallery_snapshots [--every 600] [--keep 2]
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import Dict, List, Optional
+
+import numpy as np
+from bson.timestamp import Timestamp
+from numpy.lib.format import open_memmap
+
+from database_embedding import FaceEmbeddingsDB, MAX_TEMPLATES
+from gallery_index import GalleryIndex
+
+# Directory workers map snapshots from; unset disables snapshots
+SNAPSHOT_DIR = os.getenv("FACE_GALLERY_SNAPSHOT_DIR") or None
+# Spare rows written after the gallery, as a fraction of its size (at least 1024)
+SNAPSHOT_HEADROOM = float(os.getenv("FACE_GALLERY_SNAPSHOT_HEADROOM", "0.1"))
+SNAPSHOT_FORMAT_VERSION = 1
+
+_CURRENT = "CURRENT"
+
+
+class GallerySnapshot:
+    """A mapped snapshot version. `templates` is a copy-on-write memmap; writes stay private to the process."""
+
+    def __init__(self, path: str, manifest: Dict, templates: np.ndarray, mask: np.ndarray, ids: List[str]):
+        self.path = path
+        self.manifest = manifest
+        self.templates = templates
+        self.mask = mask
+        self.ids = ids
+
+    @property
+    def version(self) -> str:
+        return self.manifest["version"]
+
+    @property
+    def namespace(self) -> str:
+        return self.manifest["namespace"]
+
+    @property
+    def dim(self) -> int:
+        return self.manifest["dim"]
+
+    @property
+    def max_templates(self) -> int:
+        return self.manifest["max_templates"]
+
+    @property
+    def created_at(self) -> float:
+        return self.manifest["created_at"]
+
+    @property
+    def sync_stamp(self) -> Optional[Timestamp]:
+        """Write stamp read before the collection scan; changes after it must be replayed."""
+        stamp = self.manifest.get("sync_stamp")
+        return Timestamp(*stamp) if stamp else None
+
+
+def current_version(directory: str) -> Optional[str]:
+    try:
+        with open(os.path.join(directory, _CURRENT)) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def open_snapshot(directory: str, version: Optional[str] = None) -> Optional[GallerySnapshot]:
+    """Map the given (default: current) snapshot version, or return None if there is none."""
+    version = version or current_version(directory)
+    if version is None:
+        return None
+    path = os.path.join(directory, version)
+    with open(os.path.join(path, "manifest.json")) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != SNAPSHOT_FORMAT_VERSION:
+        raise ValueError(f"Unknown gallery snapshot format: {manifest.get('format')}")
+    with open(os.path.join(path, "ids.json")) as f:
+        ids = json.load(f)
+    templates = np.load(os.path.join(path, "templates.npy"), mmap_mode="c")
+    mask = np.load(os.path.join(path, "mask.npy"))
+    return GallerySnapshot(path, manifest, templates, mask, ids)
+
+
+def _capacity(count: int, headroom: float) -> int:
+    return count + max(int(count * headroom), 1024)
+
+
+def _fsync(path: str):
+    """Flush a file, or a directory's entries, to disk."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _grow_templates(path: str, out: np.memmap, capacity: int) -> np.memmap:
+    """Copy the mapped templates file at `path` into a larger one in its place."""
+    grown_path = f"{path}.grow"
+    grown = open_memmap(grown_path, mode="w+", dtype=np.float32, shape=(capacity,) + out.shape[1:])
+    grown[:len(out)] = out
+    del out
+    os.replace(grown_path, path)
+    return grown
+
+
+def write_snapshot(
+    db: FaceEmbeddingsDB,
+    directory: str,
+    headroom: float = SNAPSHOT_HEADROOM,
+    max_templates: int = MAX_TEMPLATES,
+) -> str:
+    """Scan `db` into a new snapshot version, publish it as CURRENT and return the version."""
+    os.makedirs(directory, exist_ok=True)
+    # Taken before the scan so workers replay anything written while it runs
+    stamp = db.latest_sync_stamp()
+    created_at = time.time()
+    version = time.strftime("%Y%m%dT%H%M%S", time.gmtime(created_at)) + f"-{uuid.uuid4().hex[:8]}"
+    tmp_path = os.path.join(directory, f".tmp-{version}")
+    os.makedirs(tmp_path)
+
+    # Template sets are streamed from the cursor straight into the mapped file,
+    # sized from a count taken up front and grown if inserts outpace it
+    normalizer = GalleryIndex(max_templates=max_templates, initial_capacity=1)
+    capacity = _capacity(db.collection.count_documents({}), headroom)
+    templates_path = os.path.join(tmp_path, "templates.npy")
+    out = open_memmap(templates_path, mode="w+", dtype=np.float32, shape=(capacity, max_templates, normalizer.dim))
+    mask = np.zeros((capacity, max_templates), dtype=bool)
+    ids: List[str] = []
+    for person_id, templates in db.iter_templates():
+        vecs = normalizer.normalize_templates(templates)
+        if vecs is None:
+            continue
+        row = len(ids)
+        if row == capacity:
+            capacity = _capacity(row, headroom)
+            out = _grow_templates(templates_path, out, capacity)
+            mask = np.concatenate([mask, np.zeros((capacity - row, max_templates), dtype=bool)])
+        out[row, :len(vecs)] = vecs
+        mask[row, :len(vecs)] = True
+        ids.append(person_id)
+    count = len(ids)
+    out.flush()
+    del out
+    np.save(os.path.join(tmp_path, "mask.npy"), mask)
+    with open(os.path.join(tmp_path, "ids.json"), "w") as f:
+        json.dump(ids, f)
+    manifest = {
+        "format": SNAPSHOT_FORMAT_VERSION,
+        "version": version,
+        "created_at": created_at,
+        "namespace": db.namespace,
+        "count": count,
+        "capacity": capacity,
+        "dim": normalizer.dim,
+        "max_templates": max_templates,
+        "dtype": "float32",
+        "sync_stamp": [stamp.time, stamp.inc] if stamp is not None else None,
+    }
+    with open(os.path.join(tmp_path, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    # Contents reach the disk before the renames that expose them
+    for name in ("templates.npy", "mask.npy", "ids.json", "manifest.json"):
+        _fsync(os.path.join(tmp_path, name))
+    _fsync(tmp_path)
+    os.rename(tmp_path, os.path.join(directory, version))
+    pointer = os.path.join(directory, f".{_CURRENT}.{os.getpid()}.tmp")
+    with open(pointer, "w") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    _fsync(directory)
+    os.replace(pointer, os.path.join(directory, _CURRENT))
+    _fsync(directory)
+    return version
+
+
+def prune_snapshots(directory: str, keep: int = 2):
+    """Delete all but the newest `keep` versions; the current one is always kept."""
+    current = current_version(directory)
+    versions = sorted(
+        name for name in os.listdir(directory)
+        if not name.startswith(".") and os.path.isdir(os.path.join(directory, name))
+    )
+    for name in versions[:-keep] if keep > 0 else versions:
+        if name != current:
+            # Workers still mapping it keep the files alive until they swap
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write memory-mappable gallery snapshots from the embeddings collection.")
+    parser.add_argument("--dir", default=SNAPSHOT_DIR, required=SNAPSHOT_DIR is None)
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db-name", default="face_recognition_db")
+    parser.add_argument("--collection", default="face_embeddings")
+    parser.add_argument("--keep", type=int, default=2, help="Snapshot versions to keep on disk")
+    parser.add_argument("--every", type=float, default=0.0, help="Rebuild every N seconds instead of once")
+    args = parser.parse_args()
+
+    db = FaceEmbeddingsDB(mongo_uri=args.mongo_uri, db_name=args.db_name, collection_name=args.collection)
+    try:
+        while True:
+            start = time.perf_counter()
+            version = write_snapshot(db, args.dir)
+            prune_snapshots(args.dir, args.keep)
+            snapshot = open_snapshot(args.dir, version)
+            print(
+                f"✅ Snapshot {version}: {len(snapshot.ids)} identities, "
+                f"{int(snapshot.mask.sum())} templates in {time.perf_counter() - start:.1f}s"
+            )
+            if args.every <= 0:
+                break
+            time.sleep(args.every)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
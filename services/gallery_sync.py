@@ -0,0 +1,332 @@
+import asyncio
+import os
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from bson.timestamp import Timestamp
+from pymongo.errors import PyMongoError
+
+from async_database_embedding import AsyncFaceEmbeddingsDB
+from database_embedding import SYNC_FIELD, TOMBSTONE_TTL_SECONDS, doc_templates
+from gallery_index import (
+    GALLERY_BACKEND,
+    GalleryIndex,
+    get_gallery_index_async,
+    install_gallery_index,
+    reload_gallery_index_async,
+)
+from gallery_snapshot import SNAPSHOT_DIR, GallerySnapshot, current_version, open_snapshot
+
+# "auto" (change streams on a replica set, polling otherwise), "change_stream", "poll" or "off"
+GALLERY_SYNC_MODE = os.getenv("FACE_GALLERY_SYNC", "auto")
+# Delay between polls, and the change stream's idle wait
+GALLERY_SYNC_INTERVAL_SECONDS = float(os.getenv("FACE_GALLERY_SYNC_INTERVAL_SECONDS", "1.0"))
+# Verification is never served from a gallery that is older than this
+GALLERY_MAX_STALENESS_SECONDS = float(os.getenv("FACE_GALLERY_MAX_STALENESS_SECONDS", "5.0"))
+# Each poll re-reads this much history, so writes whose stamp was taken before
+# a concurrent, already-polled write are not missed. Re-applying is idempotent.
+POLL_OVERLAP_SECONDS = int(os.getenv("FACE_GALLERY_POLL_OVERLAP_SECONDS", "2"))
+# How often workers look for a newer gallery snapshot to swap in
+SNAPSHOT_CHECK_SECONDS = float(os.getenv("FACE_GALLERY_SNAPSHOT_CHECK_SECONDS", "30"))
+
+# Change events for person documents and tombstones, trimmed to what the gallery needs
+_WATCHED_OPERATIONS = ["insert", "update", "replace"]
+
+
+class GallerySync:
+    """
+    Keeps this worker's GalleryIndex in step with writes made by other workers.
+
+    On a replica set the embeddings and tombstone collections are followed
+    through a change stream started at the operation time read before the
+    initial load. Elsewhere (or if the stream fails) both collections are
+    polled for documents whose server-side write stamp is newer than the last
+    one applied. Either way only changed people are re-applied to the index.
+
+    With a snapshot directory, the gallery is mapped from the current
+    snapshot rather than scanned, and writes since the snapshot's stamp are
+    replayed on top. Newer snapshots are swapped in the same way as they
+    are published.
+
+    `synced_at` is the wall-clock time up to which all writes are known to be
+    applied; ensure_fresh() forces a catch-up poll when it is older than
+    `max_staleness`.
+    """
+
+    def __init__(
+        self,
+        db: AsyncFaceEmbeddingsDB,
+        mode: str = GALLERY_SYNC_MODE,
+        interval: float = GALLERY_SYNC_INTERVAL_SECONDS,
+        max_staleness: float = GALLERY_MAX_STALENESS_SECONDS,
+        snapshot_dir: Optional[str] = SNAPSHOT_DIR,
+    ):
+        if mode not in ("auto", "change_stream", "poll", "off"):
+            raise ValueError('Gallery sync mode must be "auto", "change_stream", "poll" or "off"')
+        self.db = db
+        self.mode = mode
+        self.interval = interval
+        self.max_staleness = max_staleness
+        self.snapshot_dir = snapshot_dir
+        self.synced_at = 0.0
+        self._stamp: Optional[Timestamp] = None
+        # (person_id, stamp) pairs applied by the last poll, for de-duplicating the overlap window
+        self._applied: Set[Tuple[str, Timestamp]] = set()
+        self._snapshot_version: Optional[str] = None
+        self._snapshot_checked = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._poll_lock = asyncio.Lock()
+        self._stats = {
+            "applied": 0, "polls": 0, "events": 0, "reloads": 0, "errors": 0,
+            "forced_catch_ups": 0, "snapshot_swaps": 0,
+        }
+
+    async def start(self) -> GalleryIndex:
+        """Load the gallery and start following changes; returns the loaded index."""
+        if self.mode == "off":
+            self.synced_at = float("inf")
+            return await get_gallery_index_async(self.db)
+
+        await self.db.ensure_sync_indexes()
+        operation_time = None
+        if self.mode in ("auto", "change_stream"):
+            operation_time = await self._replica_set_time()
+            if operation_time is None:
+                if self.mode == "change_stream":
+                    print("⚠️ Change streams need a replica set, falling back to polling")
+                self.mode = "poll"
+            else:
+                self.mode = "change_stream"
+
+        snapshot = self._open_snapshot()
+        if snapshot is not None:
+            # Map the snapshot, then replay everything written since it was taken
+            index = await reload_gallery_index_async(self.db, snapshot)
+            self._snapshot_version = snapshot.version
+            self._snapshot_checked = time.time()
+            self._stamp = snapshot.sync_stamp
+            self.synced_at = snapshot.created_at
+            await self.poll_once()
+            index = await get_gallery_index_async(self.db)
+        else:
+            # Checkpoints are taken before the load so writes made during it are replayed
+            started = time.time()
+            self._stamp = await self.db.latest_sync_stamp()
+            index = await reload_gallery_index_async(self.db)
+            self.synced_at = started
+
+        if self.mode == "change_stream":
+            self._task = asyncio.create_task(self._watch(operation_time))
+        else:
+            self._task = asyncio.create_task(self._poll_loop())
+        print(f"🔄 Gallery sync started ({self.mode}, max staleness {self.max_staleness:.1f}s)")
+        return index
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def staleness(self) -> float:
+        return max(0.0, time.time() - self.synced_at)
+
+    async def ensure_fresh(self) -> bool:
+        """Catch up now if the gallery may be older than max_staleness; False if that failed."""
+        if self.staleness() <= self.max_staleness:
+            return True
+        self._stats["forced_catch_ups"] += 1
+        try:
+            await self.poll_once(skip_within=self.max_staleness)
+        except PyMongoError as e:
+            print(f"⚠️ Gallery catch-up failed: {e}")
+            return False
+        return self.staleness() <= self.max_staleness
+
+    async def poll_once(self, skip_within: Optional[float] = None):
+        """
+        Apply every document and tombstone written since the last applied stamp.
+
+        With `skip_within`, nothing is done if the gallery is at most that many
+        seconds old once the lock is held, e.g. because a concurrent catch-up
+        just finished.
+        """
+        async with self._poll_lock:
+            if skip_within is not None and self.staleness() <= skip_within:
+                return
+            started = time.time()
+            if started - self.synced_at > TOMBSTONE_TTL_SECONDS:
+                # Tombstones older than this may be gone, so a diff could miss deletes
+                self._stamp = await self.db.latest_sync_stamp()
+                await reload_gallery_index_async(self.db)
+                self._stats["reloads"] += 1
+                self.synced_at = started
+                return
+
+            changes = await self._fetch_changes(self._stamp)
+            # Skip what an earlier poll of the overlap window already applied
+            fresh = [
+                (person_id, templates) for stamp, person_id, templates in changes
+                if (person_id, stamp) not in self._applied
+            ]
+            if fresh:
+                await self._apply(fresh)
+            if changes:
+                self._stamp = max(self._stamp, changes[-1][0]) if self._stamp is not None else changes[-1][0]
+            self._applied = {(person_id, stamp) for stamp, person_id, _ in changes}
+            self._stats["polls"] += 1
+            self.synced_at = started
+
+    async def _fetch_changes(self, stamp: Optional[Timestamp]) -> List[Tuple[Timestamp, str, Optional[np.ndarray]]]:
+        """
+        (stamp, person_id, templates or None) for writes since `stamp` minus the
+        overlap, oldest first, keeping only the newest change per person.
+
+        A stamp is taken before its write commits, so an older tombstone can
+        become visible after a newer re-enrollment was already applied; it
+        must not be applied on its own then.
+        """
+        since = None
+        if stamp is not None:
+            since = Timestamp(max(stamp.time - POLL_OVERLAP_SECONDS, 0), 0)
+        docs, tombstones = await self.db.changes_since(since)
+        changes = [(doc[SYNC_FIELD], doc["person_id"], doc_templates(doc)) for doc in docs]
+        changes += [(doc[SYNC_FIELD], doc["person_id"], None) for doc in tombstones]
+        changes.sort(key=lambda change: change[0])
+        latest = {change[1]: change for change in changes}
+        return sorted(latest.values(), key=lambda change: change[0])
+
+    async def _apply(self, changes: List[Tuple[str, Optional[np.ndarray]]], index: Optional[GalleryIndex] = None):
+        if index is None:
+            index = await get_gallery_index_async(self.db)
+        namespace = self.db.namespace
+        for person_id, templates in changes:
+            index.apply_change(namespace, person_id, templates)
+        self._stats["applied"] += len(changes)
+
+    async def _poll_loop(self):
+        while True:
+            try:
+                await self.poll_once()
+                await self._maybe_swap_snapshot()
+            except PyMongoError as e:
+                self._stats["errors"] += 1
+                print(f"⚠️ Gallery poll failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def _open_snapshot(self, version: Optional[str] = None) -> Optional[GallerySnapshot]:
+        if not self.snapshot_dir:
+            return None
+        try:
+            snapshot = open_snapshot(self.snapshot_dir, version)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Could not open gallery snapshot: {e}")
+            return None
+        if snapshot is None or snapshot.namespace != self.db.namespace:
+            return None
+        return snapshot
+
+    async def _maybe_swap_snapshot(self):
+        """Swap in a newly published snapshot, caught up to the current writes."""
+        if not self.snapshot_dir or time.time() - self._snapshot_checked < SNAPSHOT_CHECK_SECONDS:
+            return
+        self._snapshot_checked = time.time()
+        version = current_version(self.snapshot_dir)
+        if version is None or version == self._snapshot_version:
+            return
+        self._snapshot_version = version
+        snapshot = await asyncio.to_thread(self._open_snapshot, version)
+        if snapshot is None:
+            return
+
+        async with self._poll_lock:
+            index = GalleryIndex(backend=GALLERY_BACKEND)
+            try:
+                await asyncio.to_thread(index.load_snapshot, snapshot)
+            except ValueError as e:
+                print(f"⚠️ Skipping gallery snapshot {version}: {e}")
+                return
+            changes = await self._fetch_changes(snapshot.sync_stamp)
+            await self._apply([(person_id, templates) for _, person_id, templates in changes], index)
+            install_gallery_index(index)
+            # Writes that reached the old index while the new one was catching up
+            stamp = changes[-1][0] if changes else snapshot.sync_stamp
+            late = await self._fetch_changes(stamp)
+            await self._apply([(person_id, templates) for _, person_id, templates in late], index)
+            for latest in (changes, late):
+                if latest and (self._stamp is None or latest[-1][0] > self._stamp):
+                    self._stamp = latest[-1][0]
+            self._applied = {(person_id, stamp) for stamp, person_id, _ in late}
+            self._stats["snapshot_swaps"] += 1
+        print(f"🔁 Swapped in gallery snapshot {version} ({len(snapshot.ids)} identities)")
+
+    async def _replica_set_time(self) -> Optional[Timestamp]:
+        """Current operation time if the server is a replica set member, else None."""
+        try:
+            hello = await self.db.db.command("hello")
+        except PyMongoError as e:
+            print(f"⚠️ Could not query server topology: {e}")
+            return None
+        if "setName" not in hello:
+            return None
+        return hello.get("operationTime")
+
+    def _pipeline(self) -> List[Dict]:
+        collections = [self.db.collection.name, self.db.tombstones.name]
+        return [
+            {"$match": {"ns.coll": {"$in": collections}, "operationType": {"$in": _WATCHED_OPERATIONS}}},
+            {"$project": {
+                "ns": 1,
+                "clusterTime": 1,
+                "fullDocument.person_id": 1,
+                "fullDocument.embedding": 1,
+                "fullDocument.templates": 1,
+            }},
+        ]
+
+    async def _watch(self, operation_time: Optional[Timestamp]):
+        try:
+            async with self.db.db.watch(
+                self._pipeline(),
+                full_document="updateLookup",
+                start_at_operation_time=operation_time,
+                max_await_time_ms=int(self.interval * 1000),
+            ) as stream:
+                while True:
+                    await self._maybe_swap_snapshot()
+                    issued = time.time()
+                    change = await stream.try_next()
+                    if change is None:
+                        # An empty getMore means every write before it was issued has been seen
+                        self.synced_at = issued
+                        continue
+                    self._stats["events"] += 1
+                    document = change.get("fullDocument")
+                    if document is not None:
+                        if change["ns"]["coll"] == self.db.tombstones.name:
+                            await self._apply([(document["person_id"], None)])
+                        else:
+                            await self._apply([(document["person_id"], doc_templates(document))])
+                    # Otherwise it was deleted before the lookup; its tombstone event follows
+                    cluster_time = change.get("clusterTime")
+                    if cluster_time is not None:
+                        self._stamp = cluster_time
+                        # Events arrive in cluster time order, so every earlier write has been seen
+                        self.synced_at = max(self.synced_at, float(cluster_time.time))
+        except PyMongoError as e:
+            self._stats["errors"] += 1
+            print(f"⚠️ Gallery change stream failed ({e}), falling back to polling")
+            self.mode = "poll"
+            await self._poll_loop()
+
+    def stats(self) -> Dict:
+        stats = dict(self._stats)
+        stats["mode"] = self.mode
+        stats["snapshot_version"] = self._snapshot_version
+        stats["staleness_seconds"] = self.staleness()
+        stats["max_staleness_seconds"] = self.max_staleness
+        return stats
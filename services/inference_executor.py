@@ -0,0 +1,153 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+import face_embedding
+from embedding_cache import EMBEDDING_CACHE_SIZE, EmbeddingCache
+
+# "thread": decode/detect in a thread pool, embeddings through the batching scheduler.
+# "process": the whole decode/detect/embed pipeline runs in worker processes.
+EXECUTOR_MODE = os.getenv("FACE_EXECUTOR_MODE", "thread")
+EXECUTOR_WORKERS = int(os.getenv("FACE_EXECUTOR_WORKERS", str(min(4, os.cpu_count() or 1))))
+# torch intra-op threads per worker process, so workers don't oversubscribe cores
+PROCESS_TORCH_THREADS = int(os.getenv("FACE_PROCESS_TORCH_THREADS", "1"))
+
+
+def _init_process_worker(torch_threads: int):
+    import torch
+    torch.set_num_threads(torch_threads)
+    # Load and warm up this worker's models before it takes any work
+    face_embedding.init_models()
+
+
+class InferenceExecutor:
+    """
+    Runs image decoding, face detection and embedding off the asyncio event loop.
+
+    In thread mode the CPU-bound calls run in a ThreadPoolExecutor (torch and
+    OpenCV release the GIL) and the embedding forward goes through the shared
+    BatchingScheduler. In process mode each worker process holds its own copy
+    of the models and runs the full pipeline, sidestepping the GIL entirely.
+    """
+
+    def __init__(
+        self,
+        mode: str = EXECUTOR_MODE,
+        max_workers: int = EXECUTOR_WORKERS,
+        cache: Optional[EmbeddingCache] = None,
+    ):
+        """
+        Results are looked up in `cache` by a hash of the upload bytes before any
+        decoding; by default a cache is created from the FACE_EMBEDDING_CACHE_*
+        settings unless FACE_EMBEDDING_CACHE_SIZE=0.
+        """
+        if mode not in ("thread", "process"):
+            raise ValueError('mode must be "thread" or "process"')
+        self.mode = mode
+        self.max_workers = max_workers
+        if cache is None and EMBEDDING_CACHE_SIZE > 0:
+            cache = EmbeddingCache(namespace=face_embedding.pipeline_tag())
+        self.cache = cache
+        self._executor: Executor
+        if mode == "process":
+            self._executor = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_process_worker,
+                initargs=(PROCESS_TORCH_THREADS,),
+            )
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+
+    async def run(self, fn, *args):
+        """Run a picklable callable on the executor and await its result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    async def _cached(self, image_bytes: bytes, variant: str, compute, *args) -> Tuple[bool, Optional[np.ndarray]]:
+        """Serve a single-image result from the cache, computing and storing it on a miss."""
+        if self.cache is None:
+            return await compute(*args)
+        key, result = await asyncio.to_thread(self.cache.lookup, image_bytes, variant)
+        if result is None:
+            result = await compute(*args)
+            await asyncio.to_thread(self.cache.put, key, result)
+        return result
+
+    async def embedding_from_bytes(self, image_bytes: bytes) -> Tuple[bool, Optional[np.ndarray]]:
+        """
+        Decode an uploaded image and compute its face embedding.
+
+        Returns:
+            (decoded, embedding): decoded is False when the bytes are not a valid
+            image; embedding is None when no face was found.
+        """
+        return await self._cached(image_bytes, "", self._embedding_from_bytes, image_bytes)
+
+    async def _embedding_from_bytes(self, image_bytes: bytes) -> Tuple[bool, Optional[np.ndarray]]:
+        if self.mode == "process":
+            return await self.run(face_embedding.embedding_from_bytes, image_bytes)
+
+        img = await self.run(face_embedding.decode_image, image_bytes)
+        if img is None:
+            return False, None
+        face = await self.run(face_embedding.detect_face_tensor, img)
+        if face is None:
+            return True, None
+        embedding = await asyncio.wrap_future(face_embedding.get_scheduler().submit(face))
+        return True, embedding
+
+    async def embedding_from_crop_bytes(self, image_bytes: bytes, box=None, landmarks=None) -> Tuple[bool, Optional[np.ndarray]]:
+        """
+        embedding_from_bytes() for uploads that are already a face crop, or a frame
+        with a client-supplied face box and landmarks. Skips MTCNN unless the crop
+        fails validation.
+        """
+        variant = "crop:{}:{}".format(
+            None if box is None else np.round(np.asarray(box, dtype=np.float32), 1).tolist(),
+            None if landmarks is None else np.round(np.asarray(landmarks, dtype=np.float32), 1).tolist(),
+        )
+        return await self._cached(image_bytes, variant, self._embedding_from_crop_bytes, image_bytes, box, landmarks)
+
+    async def _embedding_from_crop_bytes(self, image_bytes: bytes, box=None, landmarks=None) -> Tuple[bool, Optional[np.ndarray]]:
+        if self.mode == "process":
+            return await self.run(face_embedding.embedding_from_crop_bytes, image_bytes, box, landmarks)
+
+        img = await self.run(face_embedding.decode_image, image_bytes)
+        if img is None:
+            return False, None
+        face = await self.run(face_embedding.face_tensor_from_crop, img, box, landmarks)
+        if face is None:
+            return True, None
+        embedding = await asyncio.wrap_future(face_embedding.get_scheduler().submit(face))
+        return True, embedding
+
+    async def embeddings_from_bytes_batch(self, image_bytes_list) -> List[Tuple[bool, Optional[np.ndarray]]]:
+        """
+        Batched embedding_from_bytes() for bulk work: one call on the executor
+        runs batched detection and a batched InceptionResnetV1 forward over the
+        images that are not already cached.
+        """
+        image_bytes_list = list(image_bytes_list)
+        if self.cache is None:
+            return await self.run(face_embedding.embeddings_from_bytes_batch, image_bytes_list)
+
+        lookups = await asyncio.to_thread(lambda: [self.cache.lookup(image_bytes) for image_bytes in image_bytes_list])
+        results = [result for _, result in lookups]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            computed = await self.run(face_embedding.embeddings_from_bytes_batch, [image_bytes_list[i] for i in missing])
+            for i, result in zip(missing, computed):
+                results[i] = result
+            await asyncio.to_thread(lambda: [self.cache.put(lookups[i][0], results[i]) for i in missing])
+        return results
+
+    def stats(self):
+        return {"mode": self.mode, "max_workers": self.max_workers}
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
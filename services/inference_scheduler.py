@@ -0,0 +1,153 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+_SHUTDOWN = object()
+
+
+class BatchingScheduler:
+    """
+    Dynamic micro-batching front end for a face embedding model.
+
+    Callers submit single face tensors (3 x H x W) and get back a Future. A
+    background worker collects pending requests and runs them through the
+    model as one batch as soon as either `max_batch_size` requests are queued
+    or the oldest request has waited `max_wait_ms`.
+    """
+
+    def __init__(
+        self,
+        model: torch.nn.Module,
+        device: Optional[torch.device] = None,
+        max_batch_size: int = 16,
+        max_wait_ms: float = 5.0,
+        stats_window: int = 10000,
+    ):
+        self.model = model
+        self.device = device or torch.device("cpu")
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue: "queue.Queue" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._batch_sizes: Dict[int, int] = {}
+        self._queue_waits: Deque[float] = deque(maxlen=stats_window)
+        self._forward_times: Deque[float] = deque(maxlen=stats_window)
+
+    def _ensure_started(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._start_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._run, name="embedding-batcher", daemon=True
+                )
+                self._worker.start()
+
+    def submit(self, face: torch.Tensor) -> Future:
+        """Queue one cropped, standardized face tensor for embedding."""
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((face, future, time.perf_counter()))
+        return future
+
+    def embed(self, face: torch.Tensor) -> np.ndarray:
+        """Blocking convenience wrapper around submit()."""
+        return self.submit(face).result()
+
+    def _collect(self) -> Optional[List[Tuple[torch.Tensor, Future, float]]]:
+        first = self._queue.get()
+        if first is _SHUTDOWN:
+            return None
+        batch = [first]
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _SHUTDOWN:
+                self._queue.put(_SHUTDOWN)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+
+            started = time.perf_counter()
+            futures = [future for _, future, _ in batch]
+            try:
+                faces = torch.stack([face for face, _, _ in batch]).to(self.device)
+                with torch.no_grad():
+                    embeddings = self.model(faces).cpu().numpy()
+            except Exception as e:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            finished = time.perf_counter()
+
+            for future, embedding in zip(futures, embeddings):
+                if not future.done():
+                    future.set_result(embedding)
+            self._record(batch, started, finished)
+
+    def _record(self, batch, started: float, finished: float):
+        with self._stats_lock:
+            self._batches += 1
+            self._requests += len(batch)
+            self._batch_sizes[len(batch)] = self._batch_sizes.get(len(batch), 0) + 1
+            self._queue_waits.extend(started - enqueued for _, _, enqueued in batch)
+            self._forward_times.append(finished - started)
+
+    def stats(self) -> Dict:
+        """Batch size distribution plus queue-wait and forward-time summaries in ms."""
+
+        def summarize(samples) -> Dict[str, float]:
+            if not samples:
+                return {"mean": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+            ms = np.asarray(samples) * 1000.0
+            return {
+                "mean": float(ms.mean()),
+                "p50": float(np.percentile(ms, 50)),
+                "p95": float(np.percentile(ms, 95)),
+                "max": float(ms.max()),
+            }
+
+        with self._stats_lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "batches": self._batches,
+                "requests": self._requests,
+                "mean_batch_size": self._requests / self._batches if self._batches else 0.0,
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+                "pending": self._queue.qsize(),
+                "queue_wait_ms": summarize(list(self._queue_waits)),
+                "forward_ms": summarize(list(self._forward_times)),
+            }
+
+    def shutdown(self, wait: bool = True):
+        """Stop the worker after the requests already queued have been served."""
+        if self._worker is None:
+            return
+        self._queue.put(_SHUTDOWN)
+        if wait:
+            self._worker.join()
+        self._worker = None
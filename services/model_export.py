@@ -0,0 +1,105 @@
+import os
+from typing import Callable, Iterable, Optional, Tuple
+
+import torch
+from torch import nn
+
+# Where traced + frozen TorchScript artifacts are cached between restarts
+COMPILED_DIR = os.getenv("FACE_COMPILED_DIR", "compiled_models")
+WARMUP_RUNS = 3
+
+
+class CompiledModule(nn.Module):
+    """
+    Wraps a frozen TorchScript module so it can stand in for the eager one.
+
+    Frozen modules have their weights inlined as constants and expose no
+    parameters, but callers such as MTCNN's detect_face read the model dtype
+    from next(model.parameters()). An empty parameter in the traced dtype keeps
+    that working.
+    """
+
+    def __init__(self, compiled: torch.jit.ScriptModule, dtype: torch.dtype = torch.float32):
+        super().__init__()
+        self.compiled = compiled
+        self.dtype_marker = nn.Parameter(torch.empty(0, dtype=dtype), requires_grad=False)
+
+    def forward(self, *args):
+        return self.compiled(*args)
+
+
+def artifact_path(name: str, device: torch.device, tag: str = "") -> str:
+    """Cache path for a compiled model; the torch version and device are part of the key."""
+    parts = [name, tag, device.type, f"torch{torch.__version__.replace('+', '_')}"]
+    return os.path.join(COMPILED_DIR, "-".join(part for part in parts if part) + ".pt")
+
+
+def export_torchscript(model: nn.Module, example_inputs: Tuple[torch.Tensor, ...], path: str) -> torch.jit.ScriptModule:
+    """Trace, freeze (constant weights, conv + bn folding) and save a model for inference."""
+    with torch.no_grad():
+        traced = torch.jit.trace(model.eval(), example_inputs, check_trace=False)
+        frozen = torch.jit.freeze(traced)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    torch.jit.save(frozen, tmp_path)
+    os.replace(tmp_path, path)
+    return frozen
+
+
+def _optimize(compiled: torch.jit.ScriptModule) -> torch.jit.ScriptModule:
+    # optimize_for_inference rewrites the graph with backend-specific ops that do not
+    # survive torch.jit.save, so it is applied after loading rather than before saving
+    with torch.no_grad():
+        return torch.jit.optimize_for_inference(compiled)
+
+
+def load_or_export(
+    name: str,
+    build: Callable[[], nn.Module],
+    example_inputs: Tuple[torch.Tensor, ...],
+    device: torch.device,
+    tag: str = "",
+) -> CompiledModule:
+    """
+    Load the cached TorchScript artifact for `name`, or build the eager model,
+    export it and cache it. `build` is only called on a cache miss, so a warm
+    start never constructs or traces the eager model.
+    """
+    path = artifact_path(name, device, tag)
+    if os.path.exists(path):
+        try:
+            compiled = torch.jit.load(path, map_location=device)
+            print(f"📦 Loaded compiled {name} from {path}")
+            return CompiledModule(_optimize(compiled), example_inputs[0].dtype)
+        except Exception as e:
+            print(f"⚠️ Failed to load {path}, re-exporting: {e}")
+
+    model = build().to(device).eval()
+    compiled = export_torchscript(model, tuple(t.to(device) for t in example_inputs), path)
+    print(f"🛠️ Exported compiled {name} to {path}")
+    return CompiledModule(_optimize(compiled), example_inputs[0].dtype)
+
+
+def warm_up(model: nn.Module, shapes: Iterable[Tuple[int, ...]], device: torch.device, runs: int = WARMUP_RUNS):
+    """Run each input shape a few times so TorchScript's profiling executor settles before serving."""
+    with torch.no_grad():
+        for shape in shapes:
+            x = torch.zeros(shape, device=device)
+            for _ in range(runs):
+                model(x)
+
+
+def compile_mtcnn(mtcnn, device: torch.device, batch_sizes: Optional[Iterable[int]] = None, tag: str = ""):
+    """Swap the P-, R- and O-nets of an MTCNN for cached TorchScript versions and warm them up."""
+    batch_sizes = list(batch_sizes or (1, 16))
+    nets = (
+        ("mtcnn_pnet", "pnet", (1, 3, 64, 64), [(1, 3, 12 * s, 12 * s) for s in (1, 4, 16)]),
+        ("mtcnn_rnet", "rnet", (1, 3, 24, 24), [(b, 3, 24, 24) for b in batch_sizes]),
+        ("mtcnn_onet", "onet", (1, 3, 48, 48), [(b, 3, 48, 48) for b in batch_sizes]),
+    )
+    for name, attr, example_shape, warmup_shapes in nets:
+        eager = getattr(mtcnn, attr)
+        compiled = load_or_export(name, lambda eager=eager: eager, (torch.zeros(example_shape),), device, tag)
+        warm_up(compiled, warmup_shapes, device)
+        setattr(mtcnn, attr, compiled)
+    return mtcnn
@@ -0,0 +1,169 @@
+"""
+Reduced-precision CPU inference: bfloat16 autocast and channels_last memory format.
+
+Run directly to check agreement with fp32 embeddings and measure throughput:
+    python precision.py [--images sample_faces] [--max-images 200] [--batch-size 16]
+"""
+import argparse
+import copy
+import os
+import time
+from typing import Dict, List
+
+import numpy as np
+import torch
+from torch import nn
+from torch.nn import functional as F
+
+# InceptionResnetV1 compute precision: "fp32" or "bf16" (autocast)
+PRECISION = os.getenv("FACE_PRECISION", "fp32")
+# MTCNN P/R/O-net precision, kept separate because detection thresholds are tuned for fp32
+DETECT_PRECISION = os.getenv("FACE_DETECT_PRECISION", "fp32")
+# "contiguous" (NCHW) or "channels_last" (NHWC), for both models
+MEMORY_FORMAT = os.getenv("FACE_MEMORY_FORMAT", "contiguous")
+
+_MEMORY_FORMATS = {"contiguous": torch.contiguous_format, "channels_last": torch.channels_last}
+# InceptionResnetV1 layers run under autocast; last_linear, last_bn and the L2
+# normalisation that follow them always run in fp32
+_BACKBONE = (
+    "conv2d_1a", "conv2d_2a", "conv2d_2b", "maxpool_3a", "conv2d_3b", "conv2d_4a", "conv2d_4b",
+    "repeat_1", "mixed_6a", "repeat_2", "mixed_7a", "repeat_3", "block8", "avgpool_1a", "dropout",
+)
+
+
+def _check_mode(precision: str, memory_format: str):
+    if precision not in ("fp32", "bf16"):
+        raise ValueError('Precision must be "fp32" or "bf16"')
+    if memory_format not in _MEMORY_FORMATS:
+        raise ValueError('Memory format must be "contiguous" or "channels_last"')
+    if precision == "bf16" and torch.backends.cpu.get_cpu_capability() not in ("AVX512", "AVX512_BF16", "AMX"):
+        print(f"⚠️ bf16 requested but CPU capability is {torch.backends.cpu.get_cpu_capability()}; expect emulated (slow) bf16")
+
+
+class ReducedPrecisionEmbedder(nn.Module):
+    """
+    InceptionResnetV1 embedding forward with the convolutional backbone in
+    bf16 autocast and/or channels_last. The embedding head (last_linear,
+    last_bn and L2 normalisation) runs in fp32 on the pooled features.
+    """
+
+    def __init__(self, model: nn.Module, precision: str = PRECISION, memory_format: str = MEMORY_FORMAT):
+        super().__init__()
+        _check_mode(precision, memory_format)
+        if getattr(model, "classify", False):
+            raise ValueError("Reduced-precision mode only supports embedding models (classify=False)")
+        self.model = model.eval().to(memory_format=_MEMORY_FORMATS[memory_format])
+        self.precision = precision
+        self.memory_format = _MEMORY_FORMATS[memory_format]
+        self.eval()
+
+    def forward(self, x):
+        x = x.contiguous(memory_format=self.memory_format)
+        with torch.autocast(device_type=x.device.type, dtype=torch.bfloat16, enabled=self.precision == "bf16"):
+            for name in _BACKBONE:
+                x = getattr(self.model, name)(x)
+        x = x.flatten(1).float()
+        x = self.model.last_linear(x)
+        x = self.model.last_bn(x)
+        return F.normalize(x, p=2, dim=1)
+
+
+class ReducedPrecisionNet(nn.Module):
+    """Runs an MTCNN P/R/O-net in the configured precision and memory format, returning fp32 outputs."""
+
+    def __init__(self, net: nn.Module, precision: str = DETECT_PRECISION, memory_format: str = MEMORY_FORMAT):
+        super().__init__()
+        _check_mode(precision, memory_format)
+        self.net = net.eval().to(memory_format=_MEMORY_FORMATS[memory_format])
+        self.precision = precision
+        self.memory_format = _MEMORY_FORMATS[memory_format]
+        self.eval()
+
+    def forward(self, x):
+        x = x.contiguous(memory_format=self.memory_format)
+        with torch.autocast(device_type=x.device.type, dtype=torch.bfloat16, enabled=self.precision == "bf16"):
+            outputs = self.net(x)
+        return tuple(output.float() for output in outputs)
+
+
+def is_reduced(precision: str, memory_format: str) -> bool:
+    return precision != "fp32" or memory_format != "contiguous"
+
+
+def apply_embedder_precision(model: nn.Module, precision: str = PRECISION, memory_format: str = MEMORY_FORMAT) -> nn.Module:
+    """Wrap InceptionResnetV1 for the configured mode; the fp32 NCHW model is returned unchanged."""
+    if not is_reduced(precision, memory_format):
+        return model
+    return ReducedPrecisionEmbedder(model, precision, memory_format)
+
+
+def apply_detector_precision(mtcnn, precision: str = DETECT_PRECISION, memory_format: str = MEMORY_FORMAT):
+    """Wrap the P-, R- and O-nets of an MTCNN in place for the configured mode."""
+    if is_reduced(precision, memory_format):
+        for name in ("pnet", "rnet", "onet"):
+            setattr(mtcnn, name, ReducedPrecisionNet(getattr(mtcnn, name), precision, memory_format))
+    return mtcnn
+
+
+def cosine_agreement(reference: np.ndarray, candidate: np.ndarray) -> Dict:
+    """Row-wise cosine similarity between two sets of L2-normalised embeddings."""
+    cosine = np.sum(reference * candidate, axis=1)
+    return {"mean": float(cosine.mean()), "min": float(cosine.min()), "p1": float(np.percentile(cosine, 1))}
+
+
+def throughput(model: nn.Module, faces: torch.Tensor, batch_size: int, repeats: int = 3) -> float:
+    """Faces per second over batched forwards, after one warm-up pass."""
+    def run():
+        with torch.no_grad():
+            return torch.cat([model(faces[i:i + batch_size]) for i in range(0, len(faces), batch_size)])
+
+    run()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        run()
+    return repeats * len(faces) / (time.perf_counter() - start)
+
+
+def _embed(model: nn.Module, faces: torch.Tensor, batch_size: int) -> np.ndarray:
+    with torch.no_grad():
+        return torch.cat([model(faces[i:i + batch_size]) for i in range(0, len(faces), batch_size)]).numpy()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare reduced-precision InceptionResnetV1 modes against fp32.")
+    parser.add_argument("--images", default="calibration_faces", help="Folder of sample face images")
+    parser.add_argument("--max-images", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=16)
+    args = parser.parse_args()
+
+    import face_embedding
+    from quantization import load_calibration_faces
+
+    face_embedding.init_models(warmup=False)
+    faces: List[torch.Tensor] = []
+    if os.path.isdir(args.images):
+        faces = load_calibration_faces(args.images, face_embedding.mtcnn, args.max_images)
+    if not faces:
+        print(f"⚠️ No faces found under {args.images}, using random inputs (agreement is not representative)")
+        faces = list(torch.randn(args.batch_size * 4, 3, 160, 160))
+    faces = torch.stack(faces)
+
+    reference = face_embedding.load_facenet()
+    reference_embeddings = _embed(reference, faces, args.batch_size)
+    modes = [("fp32", "contiguous"), ("fp32", "channels_last"), ("bf16", "contiguous"), ("bf16", "channels_last")]
+
+    print(f"\n--- Reduced precision vs fp32 ({len(faces)} faces, batch {args.batch_size}, {torch.get_num_threads()} threads) ---")
+    print(f"CPU capability: {torch.backends.cpu.get_cpu_capability()}")
+    for precision, memory_format in modes:
+        model = ReducedPrecisionEmbedder(copy.deepcopy(reference), precision, memory_format) \
+            if is_reduced(precision, memory_format) else reference
+        agreement = cosine_agreement(reference_embeddings, _embed(model, faces, args.batch_size))
+        rate = throughput(model, faces, args.batch_size)
+        print(
+            f"{precision:<5} {memory_format:<14} cosine mean {agreement['mean']:.5f} "
+            f"min {agreement['min']:.5f} p1 {agreement['p1']:.5f}  {rate:.1f} faces/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
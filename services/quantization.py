@@ -0,0 +1,115 @@
+import copy
+import os
+from typing import Iterable, List, Optional
+
+import cv2
+import torch
+from PIL import Image
+from torch import nn
+from torch.ao.quantization import QConfigMapping, get_default_qconfig, per_channel_dynamic_qconfig, quantize_dynamic
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+# x86 (fbgemm/onednn kernels) for servers, qnnpack for ARM
+QUANT_BACKEND = os.getenv("FACE_QUANT_BACKEND", "x86")
+# Faces used to calibrate activation ranges for static quantization
+CALIBRATION_MAX_IMAGES = int(os.getenv("FACE_QUANT_CALIBRATION_IMAGES", "200"))
+CALIBRATION_BATCH_SIZE = 16
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+# Kept in floating point: the embedding head is dynamically quantized instead,
+# and last_bn + L2 normalisation stay fp32 for stable embedding norms.
+# last_linear weights are quantized per output channel, which also keeps a
+# last_bn folded in by slim_model accurate.
+_FLOAT_MODULES = ("last_bn", "logits")
+
+
+def quantize_dynamic_head(model: nn.Module) -> nn.Module:
+    """Int8 dynamic quantization of the Linear layers (last_linear) only; weights int8, activations fp32."""
+    return quantize_dynamic(copy.deepcopy(model).eval(), {nn.Linear: per_channel_dynamic_qconfig}, dtype=torch.qint8)
+
+
+def quantize_static(model: nn.Module, calibration_faces: Iterable[torch.Tensor], backend: str = QUANT_BACKEND) -> nn.Module:
+    """
+    Post-training static int8 quantization of an InceptionResnetV1.
+
+    The BasicConv2d stem and the Block35/Block17/Block8 stacks are quantized
+    with FX graph mode (conv + bn + relu fused, activation ranges from the
+    calibration faces), last_linear is dynamically quantized and last_bn and
+    the L2 normalisation stay in fp32.
+
+    Arguments:
+        calibration_faces: iterable of 3x160x160 standardized face tensors, or batches of them.
+    """
+    torch.backends.quantized.engine = backend
+    model = copy.deepcopy(model).cpu().eval()
+
+    qconfig_mapping = QConfigMapping().set_global(get_default_qconfig(backend))
+    qconfig_mapping.set_module_name("last_linear", per_channel_dynamic_qconfig)
+    for name in _FLOAT_MODULES:
+        qconfig_mapping.set_module_name(name, None)
+
+    example_inputs = (torch.zeros(1, 3, 160, 160),)
+    prepared = prepare_fx(model, qconfig_mapping, example_inputs)
+
+    seen = 0
+    with torch.no_grad():
+        for faces in _batches(calibration_faces, CALIBRATION_BATCH_SIZE):
+            prepared(faces)
+            seen += len(faces)
+    if not seen:
+        raise ValueError("Static quantization needs at least one calibration face")
+    print(f"📐 Calibrated int8 activation ranges on {seen} faces")
+
+    return convert_fx(prepared)
+
+
+def load_calibration_faces(folder: str, mtcnn, max_images: int = CALIBRATION_MAX_IMAGES) -> List[torch.Tensor]:
+    """Detect and crop faces from the images under `folder` (recursively) with the given MTCNN."""
+    faces = []
+    for root, _, files in sorted(os.walk(folder)):
+        for name in sorted(files):
+            if len(faces) >= max_images:
+                return faces
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            img = cv2.imread(os.path.join(root, name))
+            if img is None:
+                continue
+            face = mtcnn(Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB)))
+            if face is not None:
+                faces.append(face)
+    return faces
+
+
+def build_quantized_model(model: nn.Module, mode: str, calibration_dir: Optional[str] = None, mtcnn=None) -> nn.Module:
+    """
+    Return the InceptionResnetV1 to serve for a quantization mode:
+    "none" (unchanged), "dynamic" (last_linear only) or "int8" (static + dynamic head).
+
+    "int8" falls back to "dynamic" when no calibration faces are available.
+    """
+    if mode == "none":
+        return model
+    if mode not in ("dynamic", "int8"):
+        raise ValueError('Quantization mode must be "none", "dynamic" or "int8"')
+
+    if mode == "int8":
+        faces = load_calibration_faces(calibration_dir, mtcnn) if calibration_dir and os.path.isdir(calibration_dir) else []
+        if faces:
+            return quantize_static(model, faces)
+        print("⚠️ No calibration faces found, using dynamic quantization of last_linear only")
+    return quantize_dynamic_head(model)
+
+
+def _batches(faces: Iterable[torch.Tensor], batch_size: int):
+    batch = []
+    for face in faces:
+        if face.dim() == 4:
+            yield face
+            continue
+        batch.append(face)
+        if len(batch) == batch_size:
+            yield torch.stack(batch)
+            batch = []
+    if batch:
+        yield torch.stack(batch)
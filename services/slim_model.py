@@ -0,0 +1,217 @@
+"""
+Inference-only InceptionResnetV1: every BatchNorm folded into the preceding
+conv/linear, dropout removed and the unused classification logits dropped.
+
+Folding creates new tensors, so the folded weights are saved once as their own
+checkpoint next to the original and served memory-mapped from there, keeping
+the parameters in the shared page cache rather than in every worker's heap.
+
+Run directly for a memory / latency / accuracy report against the eager model:
+    python slim_model.py [--batch-size 16] [--repeats 10]
+"""
+import argparse
+import copy
+import os
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+import torch
+from torch import nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval, fuse_linear_bn_eval
+
+from inception_resnet_v1 import BasicConv2d, InceptionResnetV1
+from mtcnn import load_weights_file
+
+# Largest allowed element-wise difference between slim and eager embeddings
+SLIM_TOLERANCE = float(os.getenv("FACE_SLIM_TOLERANCE", "1e-4"))
+# Folded checkpoint; defaults to "<weights>-slim.pt" next to FACE_WEIGHTS_PATH
+SLIM_WEIGHTS_PATH = os.getenv("FACE_SLIM_WEIGHTS_PATH") or None
+
+
+def slim_inception_resnet_v1(model: InceptionResnetV1, check: bool = True) -> InceptionResnetV1:
+    """
+    Return an inference-only copy of an (eval mode) InceptionResnetV1.
+
+    BasicConv2d conv + bn pairs and last_linear + last_bn are folded into
+    single layers with a bias, dropout becomes an identity and the logits
+    layer is removed when the model produces embeddings. With `check`, the
+    copy is compared against the original on a random batch and a ValueError
+    is raised if any embedding element differs by more than SLIM_TOLERANCE.
+    """
+    if model.training:
+        raise ValueError("BatchNorm can only be folded in eval mode")
+    slim = copy.deepcopy(model)
+
+    for module in slim.modules():
+        if isinstance(module, BasicConv2d):
+            module.conv = fuse_conv_bn_eval(module.conv, module.bn)
+            module.bn = nn.Identity()
+    slim.last_linear = fuse_linear_bn_eval(slim.last_linear, slim.last_bn)
+    _strip(slim)
+
+    if check:
+        max_diff = max_abs_diff(model, slim)
+        if max_diff > SLIM_TOLERANCE:
+            raise ValueError(f"Slim model differs from the original by {max_diff:.2e} (> {SLIM_TOLERANCE:.0e})")
+    return slim
+
+
+def _strip(model: InceptionResnetV1):
+    model.last_bn = nn.Identity()
+    model.dropout = nn.Identity()
+    if not model.classify and hasattr(model, "logits"):
+        del model.logits
+
+
+def slim_skeleton() -> InceptionResnetV1:
+    """An unallocated (meta device) slim InceptionResnetV1 to load a folded state dict into with assign=True."""
+    with torch.device("meta"):
+        model = InceptionResnetV1(classify=False)
+        for module in model.modules():
+            if isinstance(module, BasicConv2d):
+                module.conv.bias = nn.Parameter(torch.empty(module.conv.out_channels))
+                module.bn = nn.Identity()
+        model.last_linear.bias = nn.Parameter(torch.empty(model.last_linear.out_features))
+    _strip(model)
+    return model.eval()
+
+
+def slim_weights_path(weights_path: str) -> str:
+    return SLIM_WEIGHTS_PATH or f"{os.path.splitext(weights_path)[0]}-slim.pt"
+
+
+def save_slim_weights(slim: InceptionResnetV1, path: str):
+    state_dict = {key: value.detach().cpu() for key, value in slim.state_dict().items()}
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    torch.save(state_dict, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_slim_facenet(weights_path: str, build_eager: Callable[[], InceptionResnetV1]) -> InceptionResnetV1:
+    """
+    Slim InceptionResnetV1 with its parameters memory-mapped from the folded checkpoint.
+
+    The checkpoint is (re)built from `build_eager()` when it is missing or
+    older than `weights_path`. If it cannot be written, the folded copy is
+    returned as is, in private memory.
+    """
+    path = slim_weights_path(weights_path)
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(weights_path):
+        slim = slim_inception_resnet_v1(build_eager())
+        try:
+            save_slim_weights(slim, path)
+        except OSError as e:
+            print(f"⚠️ Could not write folded weights to {path} ({e}); the slim model will not be shared")
+            return slim
+        print(f"🛠️ Folded InceptionResnetV1 weights written to {path}")
+        del slim
+    model = slim_skeleton()
+    model.load_state_dict(load_weights_file(path), assign=True)
+    return model
+
+
+def load_reference_facenet(weights_path: str) -> InceptionResnetV1:
+    """The model as InceptionResnetV1(pretrained="vggface2") builds it, logits included, from a local weights file."""
+    state_dict = load_weights_file(weights_path)
+    model = InceptionResnetV1(classify=False)
+    if "logits.weight" in state_dict:
+        out_features, in_features = state_dict["logits.weight"].shape
+        model.logits = nn.Linear(in_features, out_features)
+    model.load_state_dict(state_dict, assign=True)
+    return model.eval()
+
+
+def mapped_bytes(model: nn.Module, path: str) -> Optional[Tuple[int, int]]:
+    """
+    (bytes of parameters and buffers inside a memory mapping of `path`, total
+    bytes), read from /proc/self/maps; None where that is unavailable.
+    """
+    try:
+        with open("/proc/self/maps") as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    real_path = os.path.realpath(path)
+    ranges = []
+    for line in lines:
+        fields = line.split(maxsplit=5)
+        if len(fields) == 6 and fields[5].strip() == real_path:
+            start, end = (int(address, 16) for address in fields[0].split("-"))
+            ranges.append((start, end))
+    mapped = total = 0
+    for tensor in list(model.parameters()) + list(model.buffers()):
+        size = tensor.numel() * tensor.element_size()
+        total += size
+        address = tensor.data_ptr()
+        if any(start <= address and address + size <= end for start, end in ranges):
+            mapped += size
+    return mapped, total
+
+
+def max_abs_diff(reference: nn.Module, candidate: nn.Module, batch_size: int = 4) -> float:
+    device = next(reference.parameters()).device
+    x = torch.randn(batch_size, 3, 160, 160, device=device)
+    with torch.no_grad():
+        return (reference(x) - candidate(x)).abs().max().item()
+
+
+def model_bytes(model: nn.Module) -> int:
+    """Bytes held by a model's parameters and buffers."""
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def forward_ms(model: nn.Module, batch_size: int, repeats: int) -> float:
+    device = next(model.parameters()).device
+    x = torch.randn(batch_size, 3, 160, 160, device=device)
+    with torch.no_grad():
+        model(x)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            model(x)
+    return (time.perf_counter() - start) * 1000 / repeats
+
+
+def compare(reference: nn.Module, slim: nn.Module, batch_size: int = 16, repeats: int = 10) -> Dict:
+    """Memory, latency and embedding agreement of the slim model against the original."""
+    reference_ms = forward_ms(reference, batch_size, repeats)
+    slim_ms = forward_ms(slim, batch_size, repeats)
+    reference_bytes, slim_bytes = model_bytes(reference), model_bytes(slim)
+    return {
+        "reference_mb": reference_bytes / 2**20,
+        "slim_mb": slim_bytes / 2**20,
+        "saved_mb": (reference_bytes - slim_bytes) / 2**20,
+        "reference_ms": reference_ms,
+        "slim_ms": slim_ms,
+        "speedup": reference_ms / slim_ms,
+        "max_abs_diff": max_abs_diff(reference, slim),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the slim InceptionResnetV1 against the eager model.")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    from face_embedding import FACE_WEIGHTS_PATH, device, load_facenet
+    reference = load_reference_facenet(FACE_WEIGHTS_PATH).to(device)
+    slim = load_facenet(slim=True)
+    report = compare(reference, slim, args.batch_size, args.repeats)
+    logits_mb = model_bytes(reference.logits) / 2**20 if hasattr(reference, "logits") else 0.0
+    mapped = mapped_bytes(slim, slim_weights_path(FACE_WEIGHTS_PATH))
+
+    print("\n--- Slim InceptionResnetV1 ---")
+    print(f"💾 Memory: {report['reference_mb']:.1f} MB -> {report['slim_mb']:.1f} MB (saved {report['saved_mb']:.1f} MB)")
+    print(f"   of which unused classification logits: {logits_mb:.1f} MB, BatchNorm folding: {report['saved_mb'] - logits_mb:.2f} MB")
+    print(
+        f"⏱️ Forward (batch {args.batch_size}): {report['reference_ms']:.1f} ms -> {report['slim_ms']:.1f} ms "
+        f"(x{report['speedup']:.2f})"
+    )
+    print(f"📐 Max embedding difference: {report['max_abs_diff']:.2e}")
+    if mapped is not None:
+        print(f"📎 Memory-mapped: {mapped[0] / 2**20:.1f} of {mapped[1] / 2**20:.1f} MB of slim parameters")
+
+
+if __name__ == "__main__":
+    main()
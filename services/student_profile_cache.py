@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+from pymongo.errors import PyMongoError
+
+from models.student_model import Student, StudentProfile
+
+PROFILE_CACHE_SIZE = int(os.getenv("STUDENT_PROFILE_CACHE_SIZE", "50000"))
+# Upper bound on how stale a served profile can be when writes made outside this
+# process (other workers, direct DB edits) cannot be followed with a change stream
+PROFILE_CACHE_TTL_SECONDS = float(os.getenv("STUDENT_PROFILE_CACHE_TTL_SECONDS", "30"))
+# Change stream idle wait while following Student writes
+PROFILE_STREAM_WAIT_SECONDS = float(os.getenv("STUDENT_PROFILE_STREAM_WAIT_SECONDS", "1.0"))
+
+
+class StudentProfileCache:
+    """
+    LRU + TTL cache of StudentProfile projections keyed by matriculation_number.
+
+    Misses are fetched with a single projected $in query, so only the response
+    fields leave Mongo. Entries are dropped through invalidate(), which the API
+    registers as a Student change listener and also calls after bulk inserts.
+    On a replica set, follow() also drops entries written by other workers;
+    elsewhere those are served for at most `ttl_seconds`.
+    """
+
+    def __init__(self, max_entries: int = PROFILE_CACHE_SIZE, ttl_seconds: float = PROFILE_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple[float, StudentProfile]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0, "evictions": 0}
+        # Invalidations are numbered so a fetch can tell whether one of its keys was
+        # invalidated while it was in flight; per-key numbers are kept only while
+        # fetches are running
+        self._version = 0
+        self._cleared_version = 0
+        self._invalidated: Dict[str, int] = {}
+        self._fetches = 0
+
+    async def get(self, matriculation_number: str) -> Optional[StudentProfile]:
+        return (await self.get_many([matriculation_number])).get(matriculation_number)
+
+    async def get_many(self, matriculation_numbers: Iterable[str]) -> Dict[str, StudentProfile]:
+        """Profiles for the given matriculation numbers; unknown students are left out."""
+        profiles: Dict[str, StudentProfile] = {}
+        missing = []
+        now = time.time()
+        with self._lock:
+            version = self._version
+            for matriculation_number in dict.fromkeys(matriculation_numbers):
+                entry = self._entries.get(matriculation_number)
+                if entry is not None and now - entry[0] <= self.ttl_seconds:
+                    self._entries.move_to_end(matriculation_number)
+                    profiles[matriculation_number] = entry[1]
+                    self._stats["hits"] += 1
+                else:
+                    missing.append(matriculation_number)
+                    self._stats["misses"] += 1
+
+        if missing:
+            with self._lock:
+                self._fetches += 1
+            found = []
+            try:
+                found = await Student.find(
+                    {"matriculation_number": {"$in": missing}}
+                ).project(StudentProfile).to_list()
+            finally:
+                self._finish_fetch(found, version, now)
+            for profile in found:
+                profiles[profile.matriculation_number] = profile
+        return profiles
+
+    def _finish_fetch(self, found: List[StudentProfile], version: int, fetched_at: float):
+        """Cache fetched profiles, except those invalidated after `version` while the fetch ran."""
+        with self._lock:
+            self._fetches -= 1
+            if self._cleared_version <= version:
+                for profile in found:
+                    # Fetched before the invalidating write, possibly; the next get refetches
+                    if self._invalidated.get(profile.matriculation_number, -1) <= version:
+                        self._put(profile, fetched_at)
+            if not self._fetches:
+                self._invalidated.clear()
+
+    def put(self, profile: StudentProfile, fetched_at: Optional[float] = None):
+        with self._lock:
+            self._put(profile, fetched_at or time.time())
+
+    def _put(self, profile: StudentProfile, fetched_at: float):
+        self._entries[profile.matriculation_number] = (fetched_at, profile)
+        self._entries.move_to_end(profile.matriculation_number)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def invalidate(self, matriculation_number: str):
+        with self._lock:
+            self._version += 1
+            if self._fetches:
+                self._invalidated[matriculation_number] = self._version
+            if self._entries.pop(matriculation_number, None) is not None:
+                self._stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._version += 1
+            self._cleared_version = self._version
+            self._entries.clear()
+
+    async def follow(self, max_await_seconds: float = PROFILE_STREAM_WAIT_SECONDS):
+        """Invalidate entries from a change stream on the students collection until cancelled."""
+        pipeline = [{"$project": {
+            "operationType": 1,
+            "fullDocument.matriculation_number": 1,
+            "updateDescription.updatedFields.matriculation_number": 1,
+        }}]
+        try:
+            async with Student.get_motor_collection().watch(
+                pipeline, full_document="updateLookup", max_await_time_ms=int(max_await_seconds * 1000)
+            ) as stream:
+                async for change in stream:
+                    document = change.get("fullDocument")
+                    renamed = "matriculation_number" in change.get("updateDescription", {}).get("updatedFields", {})
+                    if change["operationType"] in ("insert", "update") and document is not None and not renamed:
+                        self.invalidate(document["matriculation_number"])
+                    else:
+                        # Deletes, replaces and renames don't carry the old matriculation number
+                        self.clear()
+        except PyMongoError as e:
+            print(f"⚠️ Student change stream failed ({e}); cached profiles now expire after {self.ttl_seconds:.0f}s")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The app runs with services/ and Database/ on PYTHONPATH; mirror that here
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, "services"), os.path.join(ROOT, "Database")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
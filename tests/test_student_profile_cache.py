@@ -0,0 +1,80 @@
+import asyncio
+from unittest import mock
+
+from models.student_model import Student, StudentProfile
+from student_profile_cache import StudentProfileCache
+
+
+def _profile(matriculation_number: str, room_details: str = "A101") -> StudentProfile:
+    return StudentProfile(
+        full_name="Test Student", program="Computer Science", hall_of_residence="Hall",
+        matriculation_number=matriculation_number, level="300", room_details=room_details,
+    )
+
+
+class _FakeStudents:
+    """Stand-in for Student.find(...).project(...).to_list() that can hold a fetch open."""
+
+    def __init__(self):
+        self.rows = {}
+        self.fetches = 0
+        self.release = None
+
+    def find(self, query):
+        return self
+
+    def project(self, model):
+        return self
+
+    async def to_list(self):
+        self.fetches += 1
+        rows = list(self.rows.values())
+        if self.release is not None:
+            await self.release.wait()
+        return rows
+
+
+def test_invalidate_during_fetch_is_not_cached():
+    async def run():
+        students = _FakeStudents()
+        students.rows["M1"] = _profile("M1", "old room")
+        cache = StudentProfileCache()
+        with mock.patch.object(Student, "find", students.find):
+            students.release = asyncio.Event()
+            fetch = asyncio.create_task(cache.get("M1"))
+            await asyncio.sleep(0)
+            # The write lands while the fetch that read the old document is suspended
+            students.rows["M1"] = _profile("M1", "new room")
+            cache.invalidate("M1")
+            students.release.set()
+            await fetch
+            students.release = None
+
+            assert (await cache.get("M1")).room_details == "new room"
+            assert students.fetches == 2
+            await cache.get("M1")
+            assert students.fetches == 2
+
+    asyncio.run(run())
+
+
+def test_clear_during_fetch_is_not_cached():
+    async def run():
+        students = _FakeStudents()
+        students.rows["M1"] = _profile("M1")
+        cache = StudentProfileCache()
+        with mock.patch.object(Student, "find", students.find):
+            students.release = asyncio.Event()
+            fetch = asyncio.create_task(cache.get("M1"))
+            await asyncio.sleep(0)
+            # e.g. a delete seen on the change stream
+            del students.rows["M1"]
+            cache.clear()
+            students.release.set()
+            await fetch
+            students.release = None
+
+            assert await cache.get("M1") is None
+            assert students.fetches == 2
+
+    asyncio.run(run())